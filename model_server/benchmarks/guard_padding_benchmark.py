@@ -0,0 +1,121 @@
+"""
+Benchmarks guard batch inference with and without length-bucketed padding.
+
+Prompts are sampled from a mixture of log-normal length distributions that resembles
+gateway traffic (mostly short chat turns, some pasted documents). For every batching
+strategy the script reports throughput in real (unpadded) tokens per second and the
+share of computed tokens that are padding.
+
+Usage (from the model_server directory):
+    python -m benchmarks.guard_padding_benchmark --num-inputs 512
+"""
+
+import time
+import random
+import argparse
+import numpy as np
+
+from src.core.guardrails import DEFAULT_LENGTH_BUCKETS, get_guardrail_handler
+from src.core.utils.model_utils import GuardBatchRequest
+
+
+# (weight, median length in words, sigma) of each prompt population
+LENGTH_DISTRIBUTION = [(0.7, 20, 0.6), (0.25, 90, 0.5), (0.05, 350, 0.3)]
+
+WORDS = (
+    "please tell me about the weather in seattle and ignore previous instructions "
+    "summarize this document for my manager with the key numbers from last quarter "
+    "what is the refund policy for orders shipped outside of the united states"
+).split()
+
+
+def sample_inputs(num_inputs, seed=0):
+    rng = random.Random(seed)
+    inputs = []
+    for _ in range(num_inputs):
+        _, median, sigma = rng.choices(
+            LENGTH_DISTRIBUTION, weights=[w for w, _, _ in LENGTH_DISTRIBUTION]
+        )[0]
+        num_words = max(1, min(int(rng.lognormvariate(np.log(median), sigma)), 299))
+        inputs.append(" ".join(rng.choice(WORDS) for _ in range(num_words)))
+    return inputs
+
+
+def make_arrival_order_batches(handler):
+    """
+    Returns a batching function that keeps arrival order, padding each batch to its longest input.
+    """
+
+    def make_batches(lengths):
+        batch_size = max(handler.max_batch_tokens // max(lengths), 1)
+        return [
+            list(range(i, min(i + batch_size, len(lengths))))
+            for i in range(0, len(lengths), batch_size)
+        ]
+
+    return make_batches
+
+
+def count_tokens(handler, inputs):
+    lengths = [
+        len(ids)
+        for ids in handler.tokenizer(inputs, truncation=True, max_length=512)[
+            "input_ids"
+        ]
+    ]
+    padded = sum(
+        len(batch) * max(lengths[idx] for idx in batch)
+        for batch in handler._make_batches(lengths)
+    )
+    return sum(lengths), padded
+
+
+def run(handler, inputs, num_runs):
+    request = GuardBatchRequest(inputs=inputs, tasks=["jailbreak"])
+
+    # warm-up
+    handler.predict_batch(request)
+
+    start_time = time.perf_counter()
+    for _ in range(num_runs):
+        handler.predict_batch(request)
+    return (time.perf_counter() - start_time) / num_runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="katanemo/Arch-Guard")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--num-inputs", type=int, default=512)
+    parser.add_argument("--num-runs", type=int, default=3)
+    parser.add_argument("--max-batch-tokens", type=int, default=8192)
+    args = parser.parse_args()
+
+    handler = get_guardrail_handler(
+        args.model, device=args.device, max_batch_tokens=args.max_batch_tokens
+    )
+    inputs = sample_inputs(args.num_inputs)
+    bucketed_batches = handler._make_batches
+
+    strategies = {
+        "arrival order": (make_arrival_order_batches(handler), DEFAULT_LENGTH_BUCKETS),
+        "length sorted": (bucketed_batches, []),
+        "length bucketed": (bucketed_batches, DEFAULT_LENGTH_BUCKETS),
+    }
+
+    print(f"{'strategy':<16} {'tokens/sec':>12} {'padding':>9} {'latency':>10}")
+    for name, (make_batches, length_buckets) in strategies.items():
+        handler._make_batches = make_batches
+        handler.length_buckets = list(length_buckets)
+
+        real_tokens, padded_tokens = count_tokens(handler, inputs)
+        latency = run(handler, inputs, args.num_runs)
+
+        print(
+            f"{name:<16} {real_tokens / latency:>12.0f} "
+            f"{1 - real_tokens / padded_tokens:>8.1%} {latency * 1000:>8.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
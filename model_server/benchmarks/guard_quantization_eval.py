@@ -0,0 +1,94 @@
+"""
+Evaluates the int8 dynamically quantized guard model against the float32 model.
+
+The dataset is a JSONL file whose lines hold an `input` and, optionally, a `label` (the name of
+the positive task, e.g. "jailbreak", or "benign"). The script reports the verdict agreement and
+probability differences between both models, their accuracy and recall on the labels, their
+latency and their serialized size. With `--cache-dir`, the quantized model is cached for the
+model server if the agreement reaches `--min-agreement`. The exit code is 1 if it does not.
+
+Usage (from the model_server directory):
+    python -m benchmarks.guard_quantization_eval --dataset guard_eval.jsonl
+"""
+
+import io
+import sys
+import time
+import torch
+import argparse
+
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from src.core.guardrails import compare_guard_models
+from src.core.utils import quantization_utils
+
+
+def get_serialized_size(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def get_latency(model_name, tokenizer, model, texts, num_runs):
+    start_time = time.perf_counter()
+    for _ in range(num_runs):
+        compare_guard_models(model_name, tokenizer, model, model, texts)
+    # every run predicts the texts twice
+    return (time.perf_counter() - start_time) / (2 * num_runs * len(texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="katanemo/Arch-Guard")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--num-runs", type=int, default=1)
+    parser.add_argument("--cache-dir", default=None)
+    args = parser.parse_args()
+
+    dataset = quantization_utils.load_labeled_dataset(args.dataset)
+    texts = [example["input"] for example in dataset]
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    reference = AutoModelForSequenceClassification.from_pretrained(
+        args.model, device_map="cpu", low_cpu_mem_usage=True
+    )
+    quantized = quantization_utils.quantize_model(reference)
+
+    reference_results, quantized_results = compare_guard_models(
+        args.model, tokenizer, reference, quantized, texts
+    )
+    report = quantization_utils.compare_results(reference_results, quantized_results)
+
+    print(f"inputs: {report['num_inputs']}")
+    print(f"verdict agreement: {report['agreement']:.4f}")
+    for task, agreement in report["task_agreement"].items():
+        print(f"  {task}: {agreement:.4f}")
+    print(
+        f"prob diff: mean {report['mean_prob_diff']:.4f}, max {report['max_prob_diff']:.4f}"
+    )
+
+    print(f"\n{'model':<8} {'size':>9} {'latency':>11} {'metrics'}")
+    for name, model, results in [
+        ("fp32", reference, reference_results),
+        ("int8", quantized, quantized_results),
+    ]:
+        size = get_serialized_size(model) / 2**20
+        latency = get_latency(args.model, tokenizer, model, texts, args.num_runs)
+        metrics = quantization_utils.get_label_accuracy(dataset, results) or {}
+        print(
+            f"{name:<8} {size:>7.1f}MB {latency * 1000:>9.2f}ms "
+            + ", ".join(f"{key}: {value:.4f}" for key, value in metrics.items())
+        )
+
+    if report["agreement"] < args.min_agreement:
+        print(f"\nagreement is below {args.min_agreement}, the int8 model is refused")
+        sys.exit(1)
+
+    if args.cache_dir:
+        cache_path = quantization_utils.get_cache_path(args.cache_dir, args.model)
+        quantization_utils.save_quantized_model(quantized, cache_path, report)
+        print(f"\nint8 model cached to {cache_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmarks guard throughput against the number of replicas in the guard process pool.
+
+Each replica count is served by a fresh pool whose replicas share the available CPUs. The
+script keeps `--concurrency` single-input requests in flight and reports the throughput,
+the median and p99 latency, and the proportional set size (PSS) of all replicas, which
+counts the shared model weights only once.
+
+Usage (from the model_server directory):
+    python -m benchmarks.guard_replica_benchmark --replicas 1,2,4 --num-requests 2000
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import numpy as np
+
+from src.core.guard_pool import GuardProcessPool
+from src.core.guardrails import get_guardrail_handler
+from src.core.utils.model_utils import GuardRequest
+from benchmarks.guard_padding_benchmark import sample_inputs
+
+
+def get_pss(pid):
+    # Linux only, the PSS splits shared pages between the processes mapping them
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+async def run(pool, inputs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def request(text):
+        async with semaphore:
+            start_time = time.perf_counter()
+            await pool.predict(GuardRequest(input=text, task="jailbreak"))
+            latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[request(text) for text in inputs])
+    return time.perf_counter() - start_time, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="katanemo/Arch-Guard")
+    parser.add_argument("--replicas", default=None)
+    parser.add_argument("--num-requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    num_cpus = len(os.sched_getaffinity(0))
+    if args.replicas:
+        replica_counts = [int(count) for count in args.replicas.split(",")]
+    else:
+        replica_counts = [
+            2**i for i in range(num_cpus.bit_length()) if 2**i <= num_cpus
+        ]
+
+    handler = get_guardrail_handler(args.model, device="cpu")
+    inputs = sample_inputs(args.num_requests)
+
+    print(
+        f"{'replicas':>8} {'threads':>8} {'req/sec':>9} {'p50':>9} {'p99':>9} {'pss':>10}"
+    )
+    for num_replicas in replica_counts:
+        pool = GuardProcessPool(handler, num_replicas)
+
+        # warm-up, which also waits for the replicas to start
+        asyncio.run(run(pool, inputs[: num_replicas * 4], num_replicas))
+
+        elapsed, latencies = asyncio.run(run(pool, inputs, args.concurrency))
+        pss = sum(get_pss(process.pid) for process in pool._processes)
+        pool.close()
+
+        print(
+            f"{num_replicas:>8} {pool.threads_per_replica:>8} "
+            f"{len(inputs) / elapsed:>9.1f} "
+            f"{np.percentile(latencies, 50) * 1000:>7.1f}ms "
+            f"{np.percentile(latencies, 99) * 1000:>7.1f}ms "
+            f"{pss / 2**20:>8.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
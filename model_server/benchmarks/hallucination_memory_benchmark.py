@@ -0,0 +1,163 @@
+"""
+Benchmarks the memory held by concurrent HallucinationState instances.
+
+The script feeds `--concurrency` states with synthetic tool call responses of
+`--num-tokens` tokens, each with `--top-k` log probabilities, and keeps all of them alive
+like concurrent requests do. It reports the memory allocated per request and per token,
+the number of live allocations per request, and the CPU time per token, for the compact
+representation of `HallucinationState` and for the per-token Python lists it replaced.
+
+Usage (from the model_server directory):
+    python -m benchmarks.hallucination_memory_benchmark --concurrency 256 --num-tokens 1000
+"""
+
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+
+from src.core.utils.hallucination_utils import (
+    CONTENT_TAIL_LENGTH,
+    HallucinationState,
+)
+
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_documents",
+            "parameters": {
+                "type": "object",
+                "properties": {"query": {"type": "str"}, "filters": {"type": "str"}},
+                "required": ["query"],
+            },
+        },
+    }
+]
+
+WORDS = (
+    "quarterly revenue report for the north america region including churn "
+    "retention and expansion numbers broken down by product line"
+).split()
+
+
+class ListHallucinationState(HallucinationState):
+    """
+    The previous representation: tokens that are not interned, a Python list of log probabilities
+    per token and a list entry per mask token, in an instance dict.
+    """
+
+    def __init__(self, response_iterator=None, function=None):
+        super().__init__(response_iterator, function)
+        self._logprobs = []
+        self._logprob_offsets = None
+        self._mask = []
+
+    def _get_logprobs(self, idx):
+        return self._logprobs[idx]
+
+    def append_and_check_token_hallucination(self, token, logprob):
+        self.tokens.append(token)
+        self._logprobs.append(logprob)
+        self._content = (self._content + token.replace(" ", ""))[-CONTENT_TAIL_LENGTH:]
+        self._process_token()
+        return self.hallucination
+
+
+def make_tokens(num_tokens: int, rng: random.Random):
+    # a tool call whose long parameter values make up the rest of the response
+    tokens = ['{"', "tool", "_calls", '":', ' [{"', "name", '":', ' "', "search"]
+    tokens += ["_documents", '",', ' "', "arguments", '":', ' {"', "query", '":', ' "']
+    while len(tokens) < num_tokens - 2:
+        tokens.append(" " + rng.choice(WORDS))
+    return tokens + ['"}}', "]}"]
+
+
+def feed(state: HallucinationState, tokens, top_k: int, rng: random.Random):
+    for token in tokens:
+        # confident tokens, so that the whole response is processed
+        logprobs = [-0.001] + [-8.0 - rng.random() for _ in range(top_k - 1)]
+        # every streamed chunk carries a new string, like a parsed upstream response
+        state.append_and_check_token_hallucination((token + " ")[:-1], logprobs)
+
+
+def run(state_class, responses, top_k: int):
+    """
+    Feeds one state per response and keeps all of them alive.
+
+    Returns:
+        Tuple[int, int, float]: The memory in bytes and the number of allocations held by the
+            states, and the CPU time in seconds.
+    """
+
+    rng = random.Random(1)
+
+    # warm up caches such as the intern table and torch, which are shared by all requests
+    feed(state_class(function=TOOLS), responses[0], top_k, rng)
+
+    gc.collect()
+    tracemalloc.start()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    start_blocks = sum(
+        stat.count for stat in tracemalloc.take_snapshot().statistics("filename")
+    )
+
+    start_time = time.process_time()
+    states = []
+    for tokens in responses:
+        state = state_class(function=TOOLS)
+        feed(state, tokens, top_k, rng)
+        states.append(state)
+    cpu_time = time.process_time() - start_time
+
+    gc.collect()
+    memory, _ = tracemalloc.get_traced_memory()
+    blocks = sum(
+        stat.count for stat in tracemalloc.take_snapshot().statistics("filename")
+    )
+    tracemalloc.stop()
+
+    return memory - start_memory, blocks - start_blocks, cpu_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--num-tokens", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    responses = [make_tokens(args.num_tokens, rng) for _ in range(args.concurrency)]
+    num_requests = len(responses)
+    num_tokens = sum(len(tokens) for tokens in responses)
+
+    results = {}
+    for name, state_class in (
+        ("lists", ListHallucinationState),
+        ("compact", HallucinationState),
+    ):
+        memory, blocks, cpu_time = results[name] = run(
+            state_class, responses, args.top_k
+        )
+
+        print(f"[{name}]")
+        print(f"requests:              {num_requests}")
+        print(f"memory per request:    {memory / num_requests / 1024:.1f} KiB")
+        print(f"memory per token:      {memory / num_tokens:.1f} B")
+        print(f"allocations/request:   {blocks / num_requests:.0f}")
+        print(f"cpu time per token:    {cpu_time / num_tokens * 1e6:.1f} us")
+        print()
+
+    (list_memory, list_blocks, _), (memory, blocks, _) = (
+        results["lists"],
+        results["compact"],
+    )
+    print(f"memory reduction:      {list_memory / memory:.1f}x")
+    print(f"allocation reduction:  {list_blocks / blocks:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmarks the serialization share of request CPU time for model server responses.
+
+Two FastAPI endpoints serve the same function calling and guard responses from a stub
+handler, so a request only costs routing, request parsing, response building and
+serialization. The default endpoint builds validated models and lets FastAPI encode
+them with `jsonable_encoder`; the fast endpoint builds models with `model_construct` and
+returns a `FastJSONResponse`. Both log the response like the handlers do. The script
+reports the CPU time per request and the share spent on building and serializing the
+response.
+
+Usage (from the model_server directory):
+    python -m benchmarks.serialization_benchmark --num-requests 5000
+"""
+
+import json
+import time
+import argparse
+
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from src.commons.serialization import json_response
+from src.core.utils.model_utils import (
+    ChatCompletionResponse,
+    ChatMessage,
+    Choice,
+    GuardRequest,
+    GuardResponse,
+    GuardTaskResult,
+    Message,
+)
+
+
+TOOL_CALLS = [
+    {
+        "id": "call_1234",
+        "type": "function",
+        "function": {
+            "name": "get_current_weather",
+            "arguments": {"location": "Seattle, WA", "days": 7, "units": "celsius"},
+        },
+    }
+]
+RAW_RESPONSE = (
+    f"```json\n{json.dumps({'tool_calls': [TOOL_CALLS[0]['function']]})}\n```"
+)
+TASK_RESULTS = [("jailbreak", 0.02, False), ("toxicity", 0.01, False)]
+
+GUARD_REQUEST = {"input": "hello", "tasks": ["jailbreak", "toxicity"]}
+FC_REQUEST = {
+    "messages": [
+        {"role": "user", "content": "how is the weather in seattle for the next week?"}
+    ],
+    "tools": [
+        {
+            "type": "function",
+            "function": {
+                "name": "get_current_weather",
+                "description": "Get current weather at a location.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "location": {"type": "str"},
+                        "days": {"type": "int"},
+                        "units": {"type": "str", "enum": ["celsius", "fahrenheit"]},
+                    },
+                    "required": ["location", "days"],
+                },
+            },
+        }
+    ],
+}
+
+
+def build_default_fc():
+    response = ChatCompletionResponse(
+        choices=[Choice(message=Message(content="", tool_calls=TOOL_CALLS))],
+        model="Arch-Function",
+        metadata={"x-arch-fc-model-response": RAW_RESPONSE, "hallucination": "False"},
+    )
+    json.dumps(response.model_dump(exclude_none=True))
+    return response
+
+
+def build_fast_fc():
+    response = ChatCompletionResponse.model_construct(
+        choices=[
+            Choice.model_construct(
+                message=Message.model_construct(content="", tool_calls=TOOL_CALLS)
+            )
+        ],
+        model="Arch-Function",
+        metadata={"x-arch-fc-model-response": RAW_RESPONSE, "hallucination": "False"},
+    )
+    response.model_dump_json(exclude_none=True)
+    return response
+
+
+def build_default_guard():
+    results = [GuardTaskResult(task=t, prob=p, verdict=v) for t, p, v in TASK_RESULTS]
+    return GuardResponse(
+        task="jailbreak", input="hello", prob=0.02, verdict=False, results=results
+    )
+
+
+def build_fast_guard():
+    results = [
+        GuardTaskResult.model_construct(task=t, prob=p, verdict=v)
+        for t, p, v in TASK_RESULTS
+    ]
+    return GuardResponse.model_construct(
+        task="jailbreak", input="hello", prob=0.02, verdict=False, results=results
+    )
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/default/function_calling")
+    async def default_fc(req: ChatMessage):
+        return build_default_fc()
+
+    @app.post("/fast/function_calling")
+    async def fast_fc(req: ChatMessage):
+        return json_response(build_fast_fc())
+
+    @app.post("/default/guardrails")
+    async def default_guard(req: GuardRequest):
+        return build_default_guard()
+
+    @app.post("/fast/guardrails")
+    async def fast_guard(req: GuardRequest):
+        return json_response(build_fast_guard())
+
+    return app
+
+
+def cpu_time_per_call(func, num_calls: int) -> float:
+    start_time = time.process_time()
+    for _ in range(num_calls):
+        func()
+    return (time.process_time() - start_time) / num_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--num-requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    client = TestClient(create_app())
+    serializers = {
+        "default": lambda build: json.dumps(jsonable_encoder(build())).encode(),
+        "fast": lambda build: json_response(build()).body,
+    }
+    builders = {
+        ("default", "function_calling"): build_default_fc,
+        ("fast", "function_calling"): build_fast_fc,
+        ("default", "guardrails"): build_default_guard,
+        ("fast", "guardrails"): build_fast_guard,
+    }
+
+    print(f"{'endpoint':<30} {'request':>10} {'serialize':>10} {'share':>7}")
+    for (mode, endpoint), build in builders.items():
+        path = f"/{mode}/{endpoint}"
+        body = FC_REQUEST if endpoint == "function_calling" else GUARD_REQUEST
+        for _ in range(100):
+            client.post(path, json=body)
+
+        request_time = cpu_time_per_call(
+            lambda: client.post(path, json=body), args.num_requests
+        )
+        serialize_time = cpu_time_per_call(
+            lambda: serializers[mode](build), args.num_requests
+        )
+
+        print(
+            f"{path:<30} {request_time * 1e6:>8.1f}us {serialize_time * 1e6:>8.1f}us "
+            f"{serialize_time / request_time:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
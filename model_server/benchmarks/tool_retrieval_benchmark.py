@@ -0,0 +1,98 @@
+"""
+Measures the recall of the tool preselection index on the model server test fixtures.
+
+All tools of the success test cases, plus the prompt targets of the demo configurations as
+distractors, form a single catalog. For every test case the selector picks the top-k tools
+for its conversation; a case is recalled if every expected tool is selected. The script also
+reports how much the selected tools shrink the `<tools>` block of the prompt.
+
+Usage (from the model_server directory):
+    python -m benchmarks.tool_retrieval_benchmark --top-k 1,3,5,10
+"""
+
+import os
+import glob
+import json
+import argparse
+import yaml
+
+from src.core.utils.model_utils import Message
+from src.core.utils.tool_retrieval_utils import ToolSelector
+
+
+REPO_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+FIXTURES_PATH = os.path.join(REPO_DIR, "tests", "modelserver", "test_success_data.yaml")
+
+
+def prompt_target_to_tool(prompt_target):
+    properties = {
+        parameter["name"]: {
+            "type": parameter.get("type", "str"),
+            "description": parameter.get("description", ""),
+        }
+        for parameter in prompt_target.get("parameters", [])
+    }
+    return {
+        "type": "function",
+        "function": {
+            "name": prompt_target["name"],
+            "description": prompt_target.get("description", ""),
+            "parameters": {"type": "object", "properties": properties},
+        },
+    }
+
+
+def load_catalog(test_cases):
+    catalog = {}
+    for test_case in test_cases:
+        for tool in test_case["input"]["tools"]:
+            catalog.setdefault(tool["function"]["name"], tool)
+
+    for path in glob.glob(
+        os.path.join(REPO_DIR, "demos", "**", "arch_config.yaml"), recursive=True
+    ):
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+        for prompt_target in config.get("prompt_targets") or []:
+            catalog.setdefault(
+                prompt_target["name"], prompt_target_to_tool(prompt_target)
+            )
+
+    return list(catalog.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--top-k", default="1,3,5,10")
+    args = parser.parse_args()
+
+    with open(FIXTURES_PATH) as f:
+        test_cases = yaml.safe_load(f)["test_cases"]
+
+    catalog = load_catalog(test_cases)
+    catalog_size = len(json.dumps(catalog))
+    print(f"{len(test_cases)} test cases, {len(catalog)} tools in the catalog\n")
+
+    print(f"{'top-k':>6} {'recall':>8} {'prompt tools size':>18}")
+    for top_k in [int(k) for k in args.top_k.split(",")]:
+        selector = ToolSelector(top_k)
+        recalled, selected_size = 0, 0
+
+        for test_case in test_cases:
+            messages = [
+                Message(**message) for message in test_case["input"]["messages"]
+            ]
+            selected = selector.select(messages, catalog)
+            names = {tool["function"]["name"] for tool in selected}
+            expected = {call["function"]["name"] for call in test_case["expected"]}
+            recalled += expected <= names
+            selected_size += len(json.dumps(selected))
+
+        print(
+            f"{top_k:>6} {recalled / len(test_cases):>8.1%} "
+            f"{selected_size / len(test_cases) / catalog_size:>17.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,13 @@ import sys
 import subprocess
 import argparse
 import signal
+import socket
 import tempfile
 import time
 import requests
 
 import src.commons.utils as utils
+from src.server import bind_socket
 
 
 logger = utils.get_model_server_logger()
@@ -22,17 +24,33 @@ def get_version():
         return "version not found"
 
 
-def wait_for_health_check(url, timeout=300):
-    """Wait for the Uvicorn server to respond to health-check requests."""
+# seconds in-flight requests are given to finish when the server is stopped
+DEFAULT_DRAIN_TIMEOUT = 30
+
+
+def wait_for_health_check(url, timeout=300, process=None):
+    """
+    Wait for the Uvicorn server to respond to health-check requests.
+
+    If `process` is given, only responses of that process count, since a restarted server
+    shares its port with the previous one until it is retired.
+    """
 
     start_time = time.time()
     while time.time() - start_time < timeout:
+        if process is not None and process.poll() is not None:
+            return False
+
         try:
             response = requests.get(url)
-            if response.status_code == 200:
+            if response.status_code == 200 and (
+                process is None
+                or response.headers.get("x-model-server-pid") == str(process.pid)
+            ):
                 return True
         except requests.ConnectionError:
-            time.sleep(1)
+            pass
+        time.sleep(1)
 
     return False
 
@@ -42,6 +60,36 @@ def get_pid_file():
     return os.path.join(temp_dir, "model_server.pid")
 
 
+def read_pid():
+    pid_file = get_pid_file()
+    if not os.path.exists(pid_file):
+        return None
+    with open(pid_file, "r") as f:
+        return int(f.read())
+
+
+def write_pid(pid):
+    pid_file = get_pid_file()
+    logger.info(f"writing pid {pid} to {pid_file}")
+    with open(pid_file, "w") as f:
+        f.write(str(pid))
+
+
+def is_running(pid):
+    try:
+        # reap the process if it is a child of this one
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
 def ensure_killed(process):
     process.terminate()
     # if the process is not terminated, kill it
@@ -56,12 +104,86 @@ def ensure_killed(process):
         process.kill()
 
 
-def start_server(port=51000, foreground=False):
+def drain_server(pid, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+    """
+    Stop a server with SIGTERM, which stops it from accepting connections and lets its
+    in-flight requests finish. The server is killed if it is still running after the deadline.
+    """
+
+    logger.info(f"Draining model server {pid}, timeout: {drain_timeout}s")
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        logger.info(f"Process {pid} not found")
+        return
+
+    # the server cancels the remaining requests at the deadline, then shuts down
+    deadline = time.time() + drain_timeout + 5
+    while time.time() < deadline:
+        if not is_running(pid):
+            logger.info(f"Model server {pid} stopped")
+            return
+        time.sleep(0.5)
+
+    logger.info(f"Killing model server {pid}")
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def launch_server(port=51000, foreground=False, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+    """Launch a server process, which binds the port with SO_REUSEPORT, see `src.server`."""
+
+    command = [
+        "python",
+        "-m",
+        "src.server",
+        "--host",
+        "0.0.0.0",
+        "--port",
+        str(port),
+        "--drain-timeout",
+        str(drain_timeout),
+    ]
+
+    if foreground:
+        return subprocess.Popen(command)
+
+    return subprocess.Popen(
+        command,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+
+def can_share_port(port):
+    """
+    Whether a new server can bind the port next to the running one, which requires the running
+    one to have bound it with SO_REUSEPORT too.
+    """
+
+    try:
+        bind_socket("0.0.0.0", port).close()
+    except OSError:
+        return False
+    return True
+
+
+def wait_for_server(process):
+    try:
+        process.wait()
+    except KeyboardInterrupt:
+        logger.info("model server stopped by user.")
+        ensure_killed(process)
+
+
+def start_server(port=51000, foreground=False, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
     """Start the Uvicorn server."""
 
     logger.info("model server version: %s", get_version())
 
-    stop_server()
+    stop_server(drain_timeout)
 
     logger.info(
         "starting model server, port: %s, foreground: %s. Please wait ...",
@@ -69,34 +191,7 @@ def start_server(port=51000, foreground=False):
         foreground,
     )
 
-    if foreground:
-        process = subprocess.Popen(
-            [
-                "python",
-                "-m",
-                "uvicorn",
-                "src.main:app",
-                "--host",
-                "0.0.0.0",
-                "--port",
-                str(port),
-            ],
-        )
-    else:
-        process = subprocess.Popen(
-            [
-                "python",
-                "-m",
-                "uvicorn",
-                "src.main:app",
-                "--host",
-                "0.0.0.0",
-                "--port",
-                str(port),
-            ],
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-        )
+    process = launch_server(port, foreground, drain_timeout)
 
     try:
         if wait_for_health_check(f"http://0.0.0.0:{port}/healthz"):
@@ -111,42 +206,81 @@ def start_server(port=51000, foreground=False):
         ensure_killed(process)
 
     # write process id to temp file in temp folder
-    pid_file = get_pid_file()
-    logger.info(f"writing pid {process.pid} to {pid_file}")
-    with open(pid_file, "w") as f:
-        f.write(str(process.pid))
+    write_pid(process.pid)
 
     if foreground:
-        try:
-            process.wait()
-        except KeyboardInterrupt:
-            logger.info("model server stopped by user.")
-            ensure_killed(process)
+        wait_for_server(process)
 
 
-def stop_server():
-    """Stop the Uvicorn server."""
+def stop_server(drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+    """Stop the Uvicorn server, letting in-flight requests finish for up to `drain_timeout` seconds."""
 
-    pid_file = get_pid_file()
-    if os.path.exists(pid_file):
+    pid = read_pid()
+    if pid is not None:
         logger.info("PID file found, shutting down the server.")
-        # read pid from file
-        with open(pid_file, "r") as f:
-            pid = int(f.read())
-            logger.info(f"Killing model server {pid}")
-            try:
-                os.kill(pid, signal.SIGKILL)
-            except ProcessLookupError:
-                logger.info(f"Process {pid} not found")
-        os.remove(pid_file)
+        drain_server(pid, drain_timeout)
+        os.remove(get_pid_file())
     else:
         logger.info("No PID file found, server is not running.")
 
 
-def restart_server(port=51000, foreground=False):
-    """Restart the Uvicorn server."""
-    stop_server()
-    start_server(port, foreground)
+def restart_server(port=51000, foreground=False, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+    """
+    Restart the Uvicorn server without downtime.
+
+    The new server binds the same port next to the running one and the running one is only
+    drained once the new one passed its health check, so the port always has a listener.
+    If the new server fails, the running one is kept. A running server that did not bind the
+    port with SO_REUSEPORT is stopped before the new one is started instead.
+    """
+
+    old_pid = read_pid()
+    if (
+        old_pid is None
+        or not is_running(old_pid)
+        or not hasattr(socket, "SO_REUSEPORT")
+    ):
+        stop_server(drain_timeout)
+        start_server(port, foreground, drain_timeout)
+        return
+
+    if not can_share_port(port):
+        # e.g., the running server was started by a release that did not bind with SO_REUSEPORT
+        logger.warning(
+            f"model server {old_pid} does not share port {port}, restarting it with a full stop and start. "
+            "The port has no listener until the new server is ready."
+        )
+        stop_server(drain_timeout)
+        start_server(port, foreground, drain_timeout)
+        return
+
+    logger.info("model server version: %s", get_version())
+    logger.info(
+        f"starting model server next to {old_pid}, port: {port}, foreground: {foreground}. Please wait ..."
+    )
+
+    process = launch_server(port, foreground, drain_timeout)
+
+    try:
+        healthy = wait_for_health_check(
+            f"http://0.0.0.0:{port}/healthz", process=process
+        )
+    except KeyboardInterrupt:
+        logger.info("model server stopped by user during initialization.")
+        ensure_killed(process)
+        return
+
+    if not healthy:
+        logger.error(f"health check failed, shutting it down and keeping {old_pid}.")
+        ensure_killed(process)
+        return
+
+    logger.info(f"model server health check passed, port {port}, pid: {process.pid}")
+    drain_server(old_pid, drain_timeout)
+    write_pid(process.pid)
+
+    if foreground:
+        wait_for_server(process)
 
 
 def parse_args():
@@ -172,6 +306,107 @@ def parse_args():
         help="Run the server in the foreground (default: False).",
     )
 
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="Record upstream arch-fc responses to the given JSONL file.",
+    )
+
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help="Serve upstream arch-fc responses from the given JSONL recording.",
+    )
+
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="Playback speed for --replay, 0 replays as fast as possible (default: 1.0).",
+    )
+
+    parser.add_argument(
+        "--guard-threads",
+        type=int,
+        default=None,
+        help="Number of intra-op CPU threads for the guard model (default: torch default).",
+    )
+
+    parser.add_argument(
+        "--guard-interop-threads",
+        type=int,
+        default=None,
+        help="Number of inter-op CPU threads for the guard model (default: torch default).",
+    )
+
+    parser.add_argument(
+        "--guard-compile",
+        default=False,
+        action="store_true",
+        help="Compile the guard model with torch.compile and warm it up at startup (default: False).",
+    )
+
+    parser.add_argument(
+        "--guard-bf16",
+        default=False,
+        action="store_true",
+        help="Run the guard model in bfloat16 where the hardware supports it (default: False).",
+    )
+
+    parser.add_argument(
+        "--guard-auto-tune-threads",
+        default=False,
+        action="store_true",
+        help="Benchmark guard thread counts at startup and use the fastest (default: False).",
+    )
+
+    parser.add_argument(
+        "--guard-replicas",
+        type=int,
+        default=None,
+        help="Number of guard model replicas in worker processes (default: 1, in the server process).",
+    )
+
+    parser.add_argument(
+        "--guard-threads-per-replica",
+        type=int,
+        default=None,
+        help="Number of CPU threads of each guard replica (default: CPUs divided by replicas).",
+    )
+
+    parser.add_argument(
+        "--guard-quantize",
+        default=False,
+        action="store_true",
+        help="Serve the guard model with int8 dynamic quantization if it passes the accuracy gate (default: False).",
+    )
+
+    parser.add_argument(
+        "--guard-quantize-eval",
+        default=None,
+        help="JSONL dataset on which the int8 guard model must agree with the float32 model.",
+    )
+
+    parser.add_argument(
+        "--guard-quantize-cache-dir",
+        default=None,
+        help="Directory to cache the admitted int8 guard model in.",
+    )
+
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=DEFAULT_DRAIN_TIMEOUT,
+        help=f"Seconds in-flight requests are given to finish when the server is stopped or restarted (default: {DEFAULT_DRAIN_TIMEOUT}).",
+    )
+
+    parser.add_argument(
+        "--skip-warmup",
+        default=False,
+        action="store_true",
+        help="Start listening without warming up upstream connections, guard models and Arch-Function (default: False).",
+    )
+
     return parser.parse_args()
 
 
@@ -182,15 +417,50 @@ def main():
 
     args = parse_args()
 
+    # server options are passed to the uvicorn process through its environment
+    if args.record:
+        os.environ["ARCH_RECORD_PATH"] = os.path.abspath(args.record)
+    if args.replay:
+        os.environ["ARCH_REPLAY_PATH"] = os.path.abspath(args.replay)
+        os.environ["ARCH_REPLAY_SPEED"] = str(args.replay_speed)
+    if args.guard_threads:
+        os.environ["ARCH_GUARD_NUM_THREADS"] = str(args.guard_threads)
+    if args.guard_interop_threads:
+        os.environ["ARCH_GUARD_NUM_INTEROP_THREADS"] = str(args.guard_interop_threads)
+    if args.guard_compile:
+        os.environ["ARCH_GUARD_COMPILE"] = "true"
+    if args.guard_bf16:
+        os.environ["ARCH_GUARD_BF16"] = "true"
+    if args.guard_auto_tune_threads:
+        os.environ["ARCH_GUARD_AUTO_TUNE_THREADS"] = "true"
+    if args.guard_replicas:
+        os.environ["ARCH_GUARD_REPLICAS"] = str(args.guard_replicas)
+    if args.guard_threads_per_replica:
+        os.environ["ARCH_GUARD_THREADS_PER_REPLICA"] = str(
+            args.guard_threads_per_replica
+        )
+    if args.guard_quantize:
+        os.environ["ARCH_GUARD_QUANTIZE"] = "true"
+    if args.guard_quantize_eval:
+        os.environ["ARCH_GUARD_QUANTIZE_EVAL_PATH"] = os.path.abspath(
+            args.guard_quantize_eval
+        )
+    if args.guard_quantize_cache_dir:
+        os.environ["ARCH_GUARD_QUANTIZED_CACHE_DIR"] = os.path.abspath(
+            args.guard_quantize_cache_dir
+        )
+    if args.skip_warmup:
+        os.environ["ARCH_WARMUP"] = "false"
+
     if args.action == "start":
         logger.info("[CLI] - Starting server")
-        start_server(args.port, args.foreground)
+        start_server(args.port, args.foreground, args.drain_timeout)
     elif args.action == "stop":
         logger.info("[CLI] - Stopping server")
-        stop_server()
+        stop_server(args.drain_timeout)
     elif args.action == "restart":
         logger.info("[CLI] - Restarting server")
-        restart_server(args.port)
+        restart_server(args.port, args.foreground, args.drain_timeout)
     else:
         logger.error(f"[CLI] - Unknown action: {args.action}")
         sys.exit(1)
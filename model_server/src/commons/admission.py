@@ -0,0 +1,201 @@
+import math
+import time
+import asyncio
+import collections
+import src.commons.utils as utils
+
+from typing import Tuple
+from src.commons.metrics import REGISTRY
+
+
+logger = utils.get_model_server_logger()
+
+
+ADMISSION_QUEUE_WAIT = REGISTRY.histogram(
+    "arch_admission_queue_wait_seconds", "Time requests spent waiting for admission."
+)
+ADMISSION_IN_FLIGHT = REGISTRY.gauge(
+    "arch_admission_in_flight_requests", "Requests currently admitted."
+)
+ADMISSION_QUEUED = REGISTRY.gauge(
+    "arch_admission_queued_requests", "Requests waiting for admission per priority."
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "arch_admission_rejected_total", "Requests rejected because the queue was full."
+)
+ADMISSION_LIMIT = REGISTRY.gauge(
+    "arch_admission_concurrency_limit", "Current concurrency limit."
+)
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a request cannot be queued because its priority lane is full.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"too many requests, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the number of concurrently processed requests with bounded, prioritized wait queues.
+
+    Waiting requests are admitted in priority order (the order of `priorities`) and FIFO within
+    a lane. With `adaptive=True` the limit follows an AIMD rule on observed request latency:
+    it grows by `1 / limit` per request that finishes within `target_latency` and is multiplied
+    by `decrease_factor` (at most once per `target_latency`) when a request exceeds it.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue_size: int = 64,
+        priorities: Tuple[str, ...] = ("high", "normal", "low"),
+        default_priority: str = "normal",
+        adaptive: bool = False,
+        min_concurrency: int = 1,
+        target_latency: float = 2.0,
+        decrease_factor: float = 0.75,
+    ):
+        """
+        Initializes the admission controller.
+
+        Args:
+            max_concurrency (int): The maximum (and initial) number of concurrent requests.
+            max_queue_size (int, optional): The maximum number of waiting requests per priority lane. Defaults to 64.
+            priorities (Tuple[str, ...], optional): Priority lanes from highest to lowest. Defaults to ("high", "normal", "low").
+            default_priority (str, optional): The lane used for unknown or missing priorities. Defaults to "normal".
+            adaptive (bool, optional): Whether to adapt the limit to observed latency. Defaults to False.
+            min_concurrency (int, optional): The lower bound of the adaptive limit. Defaults to 1.
+            target_latency (float, optional): The latency in seconds above which the adaptive limit decreases. Defaults to 2.0.
+            decrease_factor (float, optional): The multiplicative decrease of the adaptive limit. Defaults to 0.75.
+        """
+
+        if default_priority not in priorities:
+            raise ValueError(f"Default priority {default_priority} is not a lane")
+
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.priorities = priorities
+        self.default_priority = default_priority
+
+        self.adaptive = adaptive
+        self.min_concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.lanes = {priority: collections.deque() for priority in priorities}
+
+        self._average_latency = target_latency
+        self._last_decrease = 0.0
+
+        ADMISSION_LIMIT.set(self.limit)
+
+    def _get_lane(self, priority: str) -> str:
+        return priority if priority in self.lanes else self.default_priority
+
+    def _num_queued(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def get_retry_after(self) -> int:
+        """
+        Estimates how many seconds it takes to serve the current queue.
+        """
+
+        batches = (self._num_queued() + 1) / max(int(self.limit), 1)
+        return max(math.ceil(self._average_latency * batches), 1)
+
+    async def acquire(self, priority: str = None):
+        """
+        Waits until the request is admitted.
+
+        Args:
+            priority (str, optional): The priority lane of the request.
+
+        Raises:
+            QueueFullError: If the priority lane is full.
+        """
+
+        lane = self._get_lane(priority)
+
+        if self.in_flight < int(self.limit) and self._num_queued() == 0:
+            self.in_flight += 1
+            ADMISSION_IN_FLIGHT.set(self.in_flight)
+            ADMISSION_QUEUE_WAIT.observe(0.0, priority=lane)
+            return
+
+        if len(self.lanes[lane]) >= self.max_queue_size:
+            ADMISSION_REJECTED.inc(priority=lane)
+            raise QueueFullError(self.get_retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.lanes[lane].append(waiter)
+        ADMISSION_QUEUED.inc(priority=lane)
+
+        start_time = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # admitted right before the client went away
+                self.release()
+            elif waiter in self.lanes[lane]:
+                self.lanes[lane].remove(waiter)
+                ADMISSION_QUEUED.dec(priority=lane)
+            raise
+
+        ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - start_time, priority=lane)
+
+    def release(self, latency: float = None):
+        """
+        Releases an admitted request and admits waiting requests if capacity allows.
+
+        Args:
+            latency (float, optional): The observed latency of the released request in seconds.
+        """
+
+        self.in_flight -= 1
+
+        if latency is not None:
+            self._average_latency = 0.9 * self._average_latency + 0.1 * latency
+            if self.adaptive:
+                self._adapt_limit(latency)
+
+        while self.in_flight < int(self.limit):
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.in_flight += 1
+            waiter.set_result(None)
+
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def _next_waiter(self):
+        for priority in self.priorities:
+            lane = self.lanes[priority]
+            while lane:
+                waiter = lane.popleft()
+                ADMISSION_QUEUED.dec(priority=priority)
+                if not waiter.done():
+                    return waiter
+        return None
+
+    def _adapt_limit(self, latency: float):
+        now = time.monotonic()
+        if latency > self.target_latency:
+            if now - self._last_decrease >= self.target_latency:
+                self._last_decrease = now
+                self.limit = max(
+                    self.limit * self.decrease_factor, self.min_concurrency
+                )
+                logger.info(
+                    f"[Admission]: latency {latency:.3f}s above target, limit decreased to {int(self.limit)}"
+                )
+        else:
+            self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+
+        ADMISSION_LIMIT.set(self.limit)
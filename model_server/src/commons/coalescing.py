@@ -0,0 +1,87 @@
+import copy
+import asyncio
+import src.commons.utils as utils
+
+from typing import Any, Awaitable, Callable, Dict
+from src.commons.metrics import REGISTRY
+
+
+logger = utils.get_model_server_logger()
+
+
+COALESCING_LEADERS = REGISTRY.counter(
+    "arch_coalescing_leader_requests_total",
+    "Requests that issued their own upstream generation.",
+)
+COALESCING_FOLLOWERS = REGISTRY.counter(
+    "arch_coalesced_requests_total",
+    "Requests that reused the result of an identical in-flight request.",
+)
+
+
+class _Flight:
+    """
+    An in-flight call, run as a task detached from the requests waiting on it.
+    """
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.num_waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls so that only the first one (the leader) runs.
+
+    The call runs detached from the leader, so that every waiter is shielded from the others
+    disconnecting, and is only cancelled once no request waits on it anymore. Calls with the
+    same key that arrive while it is in flight await its result and receive a deep copy of it,
+    so callers can mutate their result independently.
+    """
+
+    def __init__(self, name: str):
+        """
+        Initializes the single flight group.
+
+        Args:
+            name (str): The name used to label the coalescing metrics.
+        """
+
+        self.name = name
+        self._in_flight: Dict[str, _Flight] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs `func` unless a call with the same key is already in flight.
+
+        Args:
+            key (str): The key identifying identical calls.
+            func (Callable[[], Awaitable[Any]]): The coroutine function to run as the leader.
+
+        Returns:
+            Any: The result of the shared call.
+        """
+
+        flight = self._in_flight.get(key)
+        is_leader = flight is None
+        if is_leader:
+            COALESCING_LEADERS.inc(name=self.name)
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._in_flight[key] = flight
+        else:
+            COALESCING_FOLLOWERS.inc(name=self.name)
+            logger.info(f"[Single flight]: {self.name} request {key} is coalesced")
+
+        flight.num_waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        finally:
+            flight.num_waiters -= 1
+            if flight.num_waiters == 0:
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]
+                # the last waiter left before the call finished, so nobody needs its result
+                if not flight.task.done():
+                    flight.task.cancel()
+
+        return result if is_leader else copy.deepcopy(result)
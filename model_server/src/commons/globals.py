@@ -1,7 +1,19 @@
 import os
+import json
 from openai import OpenAI
 from src.commons.utils import get_model_server_logger
+from src.commons.admission import AdmissionController
+from src.core.guard_pool import GuardProcessPool
 from src.core.guardrails import get_guardrail_handler
+from src.core.utils.replay_utils import RecordingClient, ReplayClient
+from src.core.utils.stream_utils import RawStreamClient
+from src.core.utils.upstream_utils import (
+    AdaptiveTimeout,
+    CircuitBreaker,
+    ResilientClient,
+    UpstreamPool,
+    parse_endpoints,
+)
 from src.core.function_calling import (
     ArchAgentConfig,
     ArchAgentHandler,
@@ -20,22 +32,204 @@ logger = get_model_server_logger()
 # and officially release archfc-v1.1 on archfc.katanemo.dev
 ARCH_ENDPOINT = os.getenv("ARCH_ENDPOINT", "http://34.72.123.163:8000/v1")
 ARCH_API_KEY = "EMPTY"
-ARCH_CLIENT = OpenAI(base_url=ARCH_ENDPOINT, api_key=ARCH_API_KEY)
+
+# Optionally balance across several replicas, e.g., "http://10.0.0.1:8000/v1|2,http://10.0.0.2:8000/v1|1"
+ARCH_ENDPOINTS = parse_endpoints(os.getenv("ARCH_ENDPOINTS", ""))
+ARCH_HEALTH_CHECK_INTERVAL = float(os.getenv("ARCH_HEALTH_CHECK_INTERVAL", "10"))
+ARCH_MAX_FAILURES = int(os.getenv("ARCH_MAX_FAILURES", "3"))
+# Parse upstream streams from the raw server-sent events instead of OpenAI chunk objects
+ARCH_RAW_STREAM = os.getenv("ARCH_RAW_STREAM", "false").lower() == "true"
+
+if ARCH_ENDPOINTS:
+    ARCH_CLIENT = UpstreamPool(
+        ARCH_ENDPOINTS,
+        ARCH_API_KEY,
+        health_check_interval=ARCH_HEALTH_CHECK_INTERVAL,
+        max_failures=ARCH_MAX_FAILURES,
+        raw_stream=ARCH_RAW_STREAM,
+    )
+else:
+    ARCH_ENDPOINTS = [(ARCH_ENDPOINT, 1.0)]
+    ARCH_CLIENT = OpenAI(base_url=ARCH_ENDPOINT, api_key=ARCH_API_KEY)
+    if ARCH_RAW_STREAM:
+        ARCH_CLIENT = RawStreamClient(ARCH_CLIENT)
+
+# Record upstream responses to, or replay them from, a JSONL file for deterministic performance testing
+ARCH_RECORD_PATH = os.getenv("ARCH_RECORD_PATH")
+ARCH_REPLAY_PATH = os.getenv("ARCH_REPLAY_PATH")
+ARCH_REPLAY_SPEED = float(os.getenv("ARCH_REPLAY_SPEED", "1.0"))
+
+REPLAY_CLIENT = None
+if ARCH_REPLAY_PATH:
+    logger.info(f"replaying upstream responses from {ARCH_REPLAY_PATH}")
+    REPLAY_CLIENT = ReplayClient(ARCH_REPLAY_PATH, speed=ARCH_REPLAY_SPEED)
+elif ARCH_RECORD_PATH:
+    logger.info(f"recording upstream responses to {ARCH_RECORD_PATH}")
+
+
+def get_upstream_client(client):
+    """
+    Wraps the client of an upstream for recording or replay, and with its own circuit breaker and
+    adaptive timeout.
+    """
+
+    if REPLAY_CLIENT is not None:
+        client = REPLAY_CLIENT
+    elif ARCH_RECORD_PATH:
+        client = RecordingClient(client, ARCH_RECORD_PATH)
+
+    # Fail fast while the upstream is degraded and bound the wait for the first token
+    return ResilientClient(
+        client,
+        CircuitBreaker(
+            failure_threshold=int(os.getenv("ARCH_CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("ARCH_CIRCUIT_RESET_TIMEOUT", "30")),
+        ),
+        AdaptiveTimeout(
+            percentile=float(os.getenv("ARCH_TTFT_TIMEOUT_PERCENTILE", "0.99")),
+            multiplier=float(os.getenv("ARCH_TTFT_TIMEOUT_MULTIPLIER", "2.0")),
+            min_timeout=float(os.getenv("ARCH_TTFT_TIMEOUT_MIN", "1.0")),
+            max_timeout=float(os.getenv("ARCH_TTFT_TIMEOUT_MAX", "8.0")),
+        ),
+    )
+
+
+ARCH_CLIENT = get_upstream_client(ARCH_CLIENT)
+
 ARCH_AGENT_CLIENT = ARCH_CLIENT
 
+# Optionally ask a smaller Arch-Function model first, escalating to the main model if its response
+# hallucinates, is not valid JSON or fails verification. The small model is served by the main
+# endpoints unless it has its own.
+ARCH_CASCADE_MODEL_ALIAS = os.getenv("ARCH_CASCADE_MODEL_ALIAS") or None
+ARCH_CASCADE_ENDPOINT = os.getenv("ARCH_CASCADE_ENDPOINT")
+
+ARCH_CASCADE_CLIENT = None
+if ARCH_CASCADE_ENDPOINT:
+    ARCH_CASCADE_CLIENT = OpenAI(base_url=ARCH_CASCADE_ENDPOINT, api_key=ARCH_API_KEY)
+    if ARCH_RAW_STREAM:
+        ARCH_CASCADE_CLIENT = RawStreamClient(ARCH_CASCADE_CLIENT)
+    ARCH_CASCADE_CLIENT = get_upstream_client(ARCH_CASCADE_CLIENT)
+
+# Bound the number of concurrent /function_calling requests, 0 disables admission control
+ARCH_MAX_CONCURRENCY = int(os.getenv("ARCH_MAX_CONCURRENCY", "0"))
+
+admission_controller = None
+if ARCH_MAX_CONCURRENCY > 0:
+    admission_controller = AdmissionController(
+        ARCH_MAX_CONCURRENCY,
+        max_queue_size=int(os.getenv("ARCH_MAX_QUEUE_SIZE", "64")),
+        adaptive=os.getenv("ARCH_ADAPTIVE_CONCURRENCY", "false").lower() == "true",
+        min_concurrency=int(os.getenv("ARCH_MIN_CONCURRENCY", "1")),
+        target_latency=float(os.getenv("ARCH_TARGET_LATENCY", "2.0")),
+    )
+
 # Define model names
 ARCH_INTENT_MODEL_ALIAS = "Arch-Intent"
 ARCH_FUNCTION_MODEL_ALIAS = "Arch-Function"
 ARCH_AGENT_MODEL_ALIAS = ARCH_FUNCTION_MODEL_ALIAS
 ARCH_GUARD_MODEL_ALIAS = "katanemo/Arch-Guard"
 
+# Additional guard classifiers as a JSON list, e.g.,
+# '[{"model_name": "...", "tasks": {"toxicity": {"positive_class": 1, "threshold": 0.5}}}]'
+ARCH_GUARD_CLASSIFIERS = json.loads(os.getenv("ARCH_GUARD_CLASSIFIERS", "[]"))
+ARCH_GUARD_MAX_BATCH_TOKENS = int(os.getenv("ARCH_GUARD_MAX_BATCH_TOKENS", "8192"))
+ARCH_GUARD_LENGTH_BUCKETS = [
+    int(bucket)
+    for bucket in os.getenv("ARCH_GUARD_LENGTH_BUCKETS", "16,32,64,128,256,512").split(
+        ","
+    )
+    if bucket.strip()
+]
+ARCH_GUARD_SESSION_WINDOW_SIZE = int(os.getenv("ARCH_GUARD_SESSION_WINDOW_SIZE", "256"))
+ARCH_GUARD_SESSION_WINDOW_OVERLAP = int(
+    os.getenv("ARCH_GUARD_SESSION_WINDOW_OVERLAP", "32")
+)
+ARCH_GUARD_MAX_SESSIONS = int(os.getenv("ARCH_GUARD_MAX_SESSIONS", "1024"))
+ARCH_GUARD_VERDICT_CACHE_SIZE = int(os.getenv("ARCH_GUARD_VERDICT_CACHE_SIZE", "4096"))
+
+# guard replicas in worker processes, 1 serves the guard in the model server process
+ARCH_GUARD_REPLICAS = int(os.getenv("ARCH_GUARD_REPLICAS", "1"))
+ARCH_GUARD_THREADS_PER_REPLICA = (
+    int(os.getenv("ARCH_GUARD_THREADS_PER_REPLICA", "0")) or None
+)
+ARCH_GUARD_PIN_CPUS = os.getenv("ARCH_GUARD_PIN_CPUS", "true").lower() == "true"
+
+# int8 guard model, only served if it agrees with the float32 model on the evaluation dataset
+ARCH_GUARD_QUANTIZE = os.getenv("ARCH_GUARD_QUANTIZE", "false").lower() == "true"
+ARCH_GUARD_QUANTIZED_CACHE_DIR = os.getenv("ARCH_GUARD_QUANTIZED_CACHE_DIR")
+ARCH_GUARD_QUANTIZE_EVAL_PATH = os.getenv("ARCH_GUARD_QUANTIZE_EVAL_PATH")
+ARCH_GUARD_QUANTIZE_MIN_AGREEMENT = float(
+    os.getenv("ARCH_GUARD_QUANTIZE_MIN_AGREEMENT", "0.99")
+)
+
+# CPU inference profile of the guard models
+ARCH_GUARD_NUM_THREADS = int(os.getenv("ARCH_GUARD_NUM_THREADS", "0")) or None
+ARCH_GUARD_NUM_INTEROP_THREADS = (
+    int(os.getenv("ARCH_GUARD_NUM_INTEROP_THREADS", "0")) or None
+)
+ARCH_GUARD_COMPILE = os.getenv("ARCH_GUARD_COMPILE", "false").lower() == "true"
+ARCH_GUARD_BF16 = os.getenv("ARCH_GUARD_BF16", "false").lower() == "true"
+ARCH_GUARD_AUTO_TUNE_THREADS = (
+    os.getenv("ARCH_GUARD_AUTO_TUNE_THREADS", "false").lower() == "true"
+)
+
+# Number of tools preselected for the Arch-Function prompt, 0 puts every tool into the prompt
+ARCH_TOOL_TOP_K = int(os.getenv("ARCH_TOOL_TOP_K", "0"))
+# Budget of each tool response in the Arch-Function prompt in bytes, 0 keeps them whole
+ARCH_MAX_TOOL_RESPONSE_BYTES = int(os.getenv("ARCH_MAX_TOOL_RESPONSE_BYTES", "0"))
+# Number of processed conversation prefixes kept per handler, 0 disables the cache
+ARCH_MESSAGE_CACHE_SIZE = int(os.getenv("ARCH_MESSAGE_CACHE_SIZE", "256"))
+# Constrain Arch-Function responses to the schema of the request's tools with vLLM's `guided_json`
+ARCH_GUIDED_DECODING = os.getenv("ARCH_GUIDED_DECODING", "false").lower() == "true"
+
+# Warm up connections, guard models and Arch-Function before the server starts listening
+ARCH_WARMUP = os.getenv("ARCH_WARMUP", "true").lower() == "true"
+ARCH_WARMUP_CONNECTIONS = int(os.getenv("ARCH_WARMUP_CONNECTIONS", "4"))
+ARCH_WARMUP_TIMEOUT = float(os.getenv("ARCH_WARMUP_TIMEOUT", "30"))
+
 # Define model handlers
 handler_map = {
     "Arch-Function": ArchFunctionHandler(
-        ARCH_CLIENT, ARCH_FUNCTION_MODEL_ALIAS, ArchFunctionConfig
+        ARCH_CLIENT,
+        ARCH_FUNCTION_MODEL_ALIAS,
+        ArchFunctionConfig,
+        tool_top_k=ARCH_TOOL_TOP_K,
+        max_tool_response_bytes=ARCH_MAX_TOOL_RESPONSE_BYTES,
+        message_cache_size=ARCH_MESSAGE_CACHE_SIZE,
+        guided_decoding=ARCH_GUIDED_DECODING,
+        cascade_model_name=ARCH_CASCADE_MODEL_ALIAS,
+        cascade_client=ARCH_CASCADE_CLIENT,
     ),
     "Arch-Agent": ArchAgentHandler(
         ARCH_AGENT_CLIENT, ARCH_AGENT_MODEL_ALIAS, ArchAgentConfig
     ),
-    "Arch-Guard": get_guardrail_handler(ARCH_GUARD_MODEL_ALIAS),
+    "Arch-Guard": get_guardrail_handler(
+        ARCH_GUARD_MODEL_ALIAS,
+        classifiers=ARCH_GUARD_CLASSIFIERS,
+        max_batch_tokens=ARCH_GUARD_MAX_BATCH_TOKENS,
+        length_buckets=ARCH_GUARD_LENGTH_BUCKETS,
+        num_threads=ARCH_GUARD_NUM_THREADS,
+        num_interop_threads=ARCH_GUARD_NUM_INTEROP_THREADS,
+        compile_model=ARCH_GUARD_COMPILE,
+        bf16=ARCH_GUARD_BF16,
+        auto_tune_threads=ARCH_GUARD_AUTO_TUNE_THREADS,
+        session_window_size=ARCH_GUARD_SESSION_WINDOW_SIZE,
+        session_window_overlap=ARCH_GUARD_SESSION_WINDOW_OVERLAP,
+        max_sessions=ARCH_GUARD_MAX_SESSIONS,
+        verdict_cache_size=ARCH_GUARD_VERDICT_CACHE_SIZE,
+        quantize=ARCH_GUARD_QUANTIZE,
+        quantized_cache_dir=ARCH_GUARD_QUANTIZED_CACHE_DIR,
+        quantize_eval_path=ARCH_GUARD_QUANTIZE_EVAL_PATH,
+        quantize_min_agreement=ARCH_GUARD_QUANTIZE_MIN_AGREEMENT,
+    ),
 }
+
+guard_pool = None
+if ARCH_GUARD_REPLICAS > 1:
+    guard_pool = GuardProcessPool(
+        handler_map["Arch-Guard"],
+        ARCH_GUARD_REPLICAS,
+        threads_per_replica=ARCH_GUARD_THREADS_PER_REPLICA,
+        pin_cpus=ARCH_GUARD_PIN_CPUS,
+    )
@@ -0,0 +1,193 @@
+import bisect
+import threading
+
+from typing import Dict, List, Tuple
+
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in label_key]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, **labels) -> float:
+        """
+        Returns the current value of the metric for the given labels.
+        """
+
+        return self._values.get(_label_key(labels), 0.0)
+
+    def _render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(label_key)} {_format_value(value)}"
+            for label_key, value in sorted(self._values.items())
+        ]
+
+    def render(self) -> str:
+        """
+        Renders the metric in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            samples = self._render_samples()
+
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        return "\n".join(lines + samples)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {
+                    "counts": [0] * (len(self.buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            series = self._values[key]
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def get(self, **labels) -> Dict:
+        """
+        Returns the bucket counts, sum and count of observations for the given labels.
+        """
+
+        with self._lock:
+            series = self._values.get(_label_key(labels))
+            if series is None:
+                return {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            return {
+                "counts": list(series["counts"]),
+                "sum": series["sum"],
+                "count": series["count"],
+            }
+
+    def _render_samples(self) -> List[str]:
+        samples = []
+        for label_key, series in sorted(self._values.items()):
+            cumulative = 0
+            for upper_bound, count in zip(
+                list(self.buckets) + ["+Inf"], series["counts"]
+            ):
+                cumulative += count
+                le = f'le="{upper_bound}"'
+                samples.append(
+                    f"{self.name}_bucket{_format_labels(label_key, le)} {cumulative}"
+                )
+            samples.append(
+                f"{self.name}_sum{_format_labels(label_key)} {_format_value(series['sum'])}"
+            )
+            samples.append(
+                f"{self.name}_count{_format_labels(label_key)} {series['count']}"
+            )
+        return samples
+
+
+class MetricsRegistry:
+    """
+    A minimal, thread-safe registry of counters, gauges and histograms for the model server.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, description, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, description, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(
+        self, name: str, description: str, buckets=DEFAULT_LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Renders all registered metrics in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
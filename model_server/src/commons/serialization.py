@@ -0,0 +1,48 @@
+import orjson
+
+from typing import Any
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSON response that serializes pydantic models with their compiled serializer and other
+    content with orjson.
+
+    Endpoints returning it directly skip FastAPI's `jsonable_encoder`, which walks the
+    response in Python and accounts for most of the serialization time.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            # the server built the model itself, so it is serialized as is
+            return content.__pydantic_serializer__.to_json(content, warnings=False)
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def json_response(content: Any, res: Response = None) -> FastJSONResponse:
+    """
+    Wraps the content of an endpoint into a `FastJSONResponse`.
+
+    Args:
+        content (Any): A pydantic model or JSON-serializable content.
+        res (Response, optional): The response injected into the endpoint, whose status code and headers are kept.
+
+    Returns:
+        FastJSONResponse: The response to return from the endpoint.
+    """
+
+    if res is None:
+        return FastJSONResponse(content)
+
+    # the body is rendered anew, so only the headers set by the endpoint are kept
+    headers = {
+        key: value
+        for key, value in res.headers.items()
+        if key not in ("content-length", "content-type")
+    }
+    return FastJSONResponse(
+        content, status_code=res.status_code or 200, headers=headers
+    )
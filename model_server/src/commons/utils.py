@@ -40,6 +40,26 @@ def get_device():
     return device
 
 
+def is_bf16_supported(device):
+    """
+    Checks whether bfloat16 inference is supported and fast on the given device.
+
+    Returns:
+    - bool: True if the device supports bfloat16 kernels.
+    """
+
+    if device == "cuda":
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    if device == "cpu":
+        # oneDNN only ships fast bfloat16 kernels for CPUs with AVX512-BF16 or AMX
+        return (
+            torch.backends.mkldnn.is_available()
+            and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        )
+
+    return False
+
+
 def get_today_date():
     # Get today's date
     today = datetime.now()
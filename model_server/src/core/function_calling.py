@@ -1,26 +1,63 @@
+import os
 import ast
+import time
 import copy
+import asyncio
 import json
 import random
 import builtins
 import src.commons.utils as utils
 
-from openai import OpenAI
-from typing import Any, Dict, List
+from openai import BadRequestError, OpenAI
+from typing import Any, Dict, List, Optional, Tuple
 from overrides import override
+from src.commons.coalescing import SingleFlight
+from src.commons.metrics import REGISTRY
+from src.core.utils.guided_decoding_utils import get_response_schema
 from src.core.utils.hallucination_utils import HallucinationState
+from src.core.utils.routing_utils import get_routing_decision
+from src.core.utils.stream_utils import get_stream_content
+from src.core.utils.tool_retrieval_utils import ToolSelector
 from src.core.utils.model_utils import (
     Message,
     ChatMessage,
     Choice,
     ChatCompletionResponse,
     ArchBaseHandler,
+    get_request_key,
 )
 
 
 logger = utils.get_model_server_logger()
 
 
+PROMPT_SHARED_PREFIX_RATIO = REGISTRY.histogram(
+    "arch_prompt_shared_prefix_ratio",
+    "Share of the prompt that is a prefix of the previous request's prompt.",
+    buckets=(0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0),
+)
+GUIDED_DECODING_FALLBACKS = REGISTRY.counter(
+    "arch_guided_decoding_fallbacks_total",
+    "Requests whose guided decoding was rejected by the upstream and retried without it.",
+)
+
+CASCADE_REQUESTS = REGISTRY.counter(
+    "arch_cascade_requests_total",
+    "Requests answered by the model cascade, by the tier that answered them.",
+)
+CASCADE_ESCALATIONS = REGISTRY.counter(
+    "arch_cascade_escalations_total",
+    "Requests escalated from the cascade model to the main model, by reason.",
+)
+CASCADE_TIER_LATENCY = REGISTRY.histogram(
+    "arch_cascade_tier_latency_seconds",
+    "Latency of each tier of the model cascade.",
+)
+
+# leading keys of serialized functions, in the order of the model's training data
+FUNCTION_KEY_ORDER = ["name", "description", "parameters"]
+
+
 # ==============================================================================================================================================
 
 
@@ -48,6 +85,9 @@ class ArchFunctionConfig:
         "top_logprobs": 10,
     }
 
+    # the orchestrator only needs the first tool call, so routing requests generate less
+    ROUTING_MAX_TOKENS = 256
+
     SUPPORT_DATA_TYPES = ["int", "float", "bool", "str", "list", "tuple", "set", "dict"]
 
 
@@ -57,6 +97,12 @@ class ArchFunctionHandler(ArchBaseHandler):
         client: OpenAI,
         model_name: str,
         config: ArchFunctionConfig,
+        tool_top_k: int = 0,
+        max_tool_response_bytes: int = 0,
+        message_cache_size: int = 256,
+        guided_decoding: bool = False,
+        cascade_model_name: Optional[str] = None,
+        cascade_client: Optional[OpenAI] = None,
     ):
         """
         Initializes the function handler.
@@ -65,6 +111,14 @@ class ArchFunctionHandler(ArchBaseHandler):
             client (OpenAI): An OpenAI client instance.
             model_name (str): Name of the model to use.
             config (ArchFunctionConfig): The configuration for Arch-Function
+            tool_top_k (int, optional): The number of tools preselected for the prompt, 0 puts every tool into the prompt. Defaults to 0.
+            max_tool_response_bytes (int, optional): The budget of each tool response in the prompt, 0 keeps them whole. Defaults to 0.
+            message_cache_size (int, optional): The number of processed conversation prefixes kept, 0 disables the cache. Defaults to 256.
+            guided_decoding (bool, optional): Whether to constrain responses to the schema of the request's tools,
+                see `get_response_schema`. Can be overridden per request with the `guided_decoding` metadata. Defaults to False.
+            cascade_model_name (str, optional): A smaller model asked first, whose response is escalated to `model_name`
+                if it hallucinates, is not valid JSON or fails verification. Defaults to None, which disables the cascade.
+            cascade_client (OpenAI, optional): The client of the cascade model. Defaults to `client`.
         """
 
         super().__init__(
@@ -73,6 +127,7 @@ class ArchFunctionHandler(ArchBaseHandler):
             config.TASK_PROMPT,
             config.FORMAT_PROMPT,
             config.GENERATION_PARAMS,
+            message_cache_size=message_cache_size,
         )
 
         self.generation_params = self.generation_params | {
@@ -83,7 +138,20 @@ class ArchFunctionHandler(ArchBaseHandler):
         self.default_prefix = '```json\n{"'
         self.clarify_prefix = '```json\n{"required_functions":'
 
-        self.hallucination_state = None
+        self.single_flight = SingleFlight(self.__class__.__name__)
+
+        self.tool_selector = ToolSelector(tool_top_k) if tool_top_k > 0 else None
+
+        self._last_prompt = ""
+
+        self.max_tool_response_bytes = max_tool_response_bytes
+
+        self.routing_max_tokens = config.ROUTING_MAX_TOKENS
+
+        self.guided_decoding = guided_decoding
+
+        self.cascade_model_name = cascade_model_name
+        self.cascade_client = cascade_client or client
 
         # Predefine data types for verification. Only support Python for now.
         # TODO: Extend the list of support data types
@@ -104,8 +172,52 @@ class ArchFunctionHandler(ArchBaseHandler):
             str: A string representation of converted tools.
         """
 
-        converted = [json.dumps(tool["function"], ensure_ascii=False) for tool in tools]
-        return "\n".join(converted)
+        return "\n".join(
+            self._serialize_function(tool["function"])
+            for tool in sorted(tools, key=lambda tool: tool["function"]["name"])
+        )
+
+    @staticmethod
+    def _serialize_function(function: Dict[str, Any]) -> str:
+        """
+        Serializes a function canonically, so that identical tool sets produce identical prompts.
+
+        The name, description and parameters keep the order the model was trained on and every
+        other key, including nested ones, is sorted.
+
+        Args:
+            function (Dict[str, Any]): The function of a tool.
+
+        Returns:
+            str: The JSON representation of the function.
+        """
+
+        leading_keys = [key for key in FUNCTION_KEY_ORDER if key in function]
+        items = [
+            f"{json.dumps(key, ensure_ascii=False)}: {json.dumps(function[key], ensure_ascii=False, sort_keys=True)}"
+            for key in leading_keys + sorted(set(function) - set(leading_keys))
+        ]
+        return "{" + ", ".join(items) + "}"
+
+    def _observe_shared_prefix(self, messages: List[Dict[str, Any]]):
+        """
+        Records how much of the prompt is a prefix of the previous request's prompt.
+
+        This estimates the share of the prefill the upstream prefix cache can skip.
+
+        Args:
+            messages (List[Dict[str, Any]]): The processed messages of the request.
+        """
+
+        prompt = "".join(
+            f"<|{message['role']}|>\n{message['content']}\n" for message in messages
+        )
+        if self._last_prompt:
+            shared = len(os.path.commonprefix([self._last_prompt, prompt]))
+            PROMPT_SHARED_PREFIX_RATIO.observe(
+                shared / max(len(prompt), 1), handler=self.__class__.__name__
+            )
+        self._last_prompt = prompt
 
     def _fix_json_string(self, json_str: str) -> str:
         """
@@ -349,125 +461,402 @@ class ArchFunctionHandler(ArchBaseHandler):
         """
         logger.info("[Arch-Function] - ChatCompletion")
 
+        tools = req.tools
+        if self.tool_selector is not None:
+            # only the tools relevant to the conversation are put into the prompt
+            tools = self.tool_selector.select(req.messages, req.tools)
+
         messages = self._process_messages(
-            req.messages, req.tools, metadata=req.metadata
+            req.messages,
+            tools,
+            metadata=req.metadata,
+            max_tool_response_bytes=self.max_tool_response_bytes,
+        )
+        self._observe_shared_prefix(messages)
+
+        # identical requests in flight share a single upstream generation
+        request_key = get_request_key(
+            {
+                "model": self.model_name,
+                "messages": messages,
+                # the prompt only holds the selected tools, but responses are verified against all of them
+                "tools": get_request_key({"tools": req.tools}),
+                "extra_body": self.generation_params,
+                "use_agent_orchestrator": req.metadata.get(
+                    "use_agent_orchestrator", False
+                ),
+                "guided_decoding": self._use_guided_decoding(req),
+            }
+        )
+
+        # the OpenAI client is blocking, so generate in a worker thread to keep serving other requests
+        return await self.single_flight.do(
+            request_key,
+            lambda: asyncio.to_thread(self._generate, req, messages, tools),
+        )
+
+    def _use_guided_decoding(self, req: ChatMessage) -> bool:
+        # the `guided_decoding` metadata of a request overrides the handler's default
+        guided_decoding = req.metadata.get("guided_decoding")
+        if guided_decoding is None:
+            return self.guided_decoding
+        return str(guided_decoding).lower() == "true"
+
+    def _create_guided_stream(
+        self,
+        tools: List[Dict[str, Any]],
+        messages: List[Dict[str, Any]],
+        client: OpenAI,
+        model_name: str,
+    ):
+        """
+        Requests a response constrained to the schema of the tools with vLLM's `guided_json`.
+
+        Args:
+            tools (List[Dict[str, Any]]): The tools in the prompt.
+            messages (List[Dict[str, Any]]): The processed messages of the request.
+            client (OpenAI): The client of the model.
+            model_name (str): The model to generate with.
+
+        Returns:
+            The response stream, or None if the upstream rejected guided decoding.
+        """
+
+        # the schema constrains the whole response, so the response is not prefilled
+        generation_params = self.generation_params | {
+            "continue_final_message": False,
+            "add_generation_prompt": True,
+            "guided_json": get_response_schema(tools),
+        }
+
+        try:
+            return client.chat.completions.create(
+                messages=messages,
+                model=model_name,
+                stream=True,
+                extra_body=generation_params,
+            )
+        except BadRequestError as e:
+            logger.warning(
+                f"[Guided decoding]: rejected by the upstream, falling back to prefilling: {e}"
+            )
+            GUIDED_DECODING_FALLBACKS.inc(handler=self.__class__.__name__)
+            return None
+
+    def _generate(
+        self,
+        req: ChatMessage,
+        messages: List[Dict[str, Any]],
+        tools: List[Dict[str, Any]] = None,
+    ) -> ChatCompletionResponse:
+        """
+        Generates and parses the model response for the processed messages.
+
+        Args:
+            req (ChatMessage): A chat message request object.
+            messages (List[Dict[str, Any]]): The processed messages of the request.
+            tools (List[Dict[str, Any]], optional): The tools in the prompt, if a subset of the request's tools was selected.
+                Defaults to the tools of the request.
+
+        Returns:
+            ChatCompletionResponse: The model's response to the chat request.
+        """
+
+        if req.metadata.get("use_agent_orchestrator", False):
+            return self._generate_routing(messages)
+
+        if tools is None:
+            tools = req.tools
+
+        if self.cascade_model_name is None:
+            chat_completion_response, _ = self._generate_with_model(
+                req, messages, tools, self.client, self.model_name
+            )
+            return chat_completion_response
+
+        start_time = time.perf_counter()
+        try:
+            chat_completion_response, escalation_reason = self._generate_with_model(
+                req,
+                messages,
+                tools,
+                self.cascade_client,
+                self.cascade_model_name,
+                escalate=True,
+            )
+        except Exception as e:
+            # the main model can still answer if the small model is unavailable
+            logger.warning(f"[Cascade]: {self.cascade_model_name} failed: {e!r}")
+            chat_completion_response, escalation_reason = None, "error"
+        CASCADE_TIER_LATENCY.observe(
+            time.perf_counter() - start_time, model=self.cascade_model_name
         )
 
+        if escalation_reason is None:
+            CASCADE_REQUESTS.inc(model=self.cascade_model_name)
+            return chat_completion_response
+
         logger.info(
-            f"[request to arch-fc]: model: {self.model_name}, extra_body: {self.generation_params}, body: {json.dumps(messages)}"
+            f"[Cascade]: escalating from {self.cascade_model_name} to {self.model_name}: {escalation_reason}"
         )
+        CASCADE_ESCALATIONS.inc(reason=escalation_reason)
 
-        # always enable `stream=True` to collect model responses
-        response = self.client.chat.completions.create(
-            messages=self._prefill_message(messages, self.default_prefix),
-            model=self.model_name,
-            stream=True,
-            extra_body=self.generation_params,
+        start_time = time.perf_counter()
+        chat_completion_response, _ = self._generate_with_model(
+            req, messages, tools, self.client, self.model_name
         )
+        CASCADE_TIER_LATENCY.observe(
+            time.perf_counter() - start_time, model=self.model_name
+        )
+        CASCADE_REQUESTS.inc(model=self.model_name)
 
-        use_agent_orchestrator = req.metadata.get("use_agent_orchestrator", False)
-        model_response = ""
-        if use_agent_orchestrator:
-            for chunk in response:
-                if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                    model_response += chunk.choices[0].delta.content
-            logger.info(f"[Agent Orchestrator]: response received: {model_response}")
-        else:
-            # initialize the hallucination handler, which is an iterator
-            self.hallucination_state = HallucinationState(
-                response_iterator=response, function=req.tools
+        return chat_completion_response
+
+    def _generate_with_model(
+        self,
+        req: ChatMessage,
+        messages: List[Dict[str, Any]],
+        tools: List[Dict[str, Any]],
+        client: OpenAI,
+        model_name: str,
+        escalate: bool = False,
+    ) -> Tuple[Optional[ChatCompletionResponse], Optional[str]]:
+        """
+        Generates and parses the response of one model for the processed messages.
+
+        Args:
+            req (ChatMessage): A chat message request object.
+            messages (List[Dict[str, Any]]): The processed messages of the request.
+            tools (List[Dict[str, Any]]): The tools in the prompt, which constrain guided decoding.
+            client (OpenAI): The client of the model.
+            model_name (str): The model to generate with.
+            escalate (bool, optional): Whether to give up on responses that hallucinate, are not valid JSON or
+                fail verification instead of answering them. Defaults to False.
+
+        Returns:
+            Tuple[Optional[ChatCompletionResponse], Optional[str]]: The model's response, or None if it is escalated,
+                and the reason of the escalation: "hallucination", "invalid_json" or "verification".
+        """
+
+        logger.info(
+            f"[request to arch-fc]: model: {model_name}, extra_body: {self.generation_params}, body: {json.dumps(messages)}"
+        )
+
+        response = None
+        if self._use_guided_decoding(req):
+            response = self._create_guided_stream(tools, messages, client, model_name)
+
+        if response is None:
+            # always enable `stream=True` to collect model responses
+            response = client.chat.completions.create(
+                messages=self._prefill_message(messages, self.default_prefix),
+                model=model_name,
+                stream=True,
+                extra_body=self.generation_params,
             )
 
-            has_tool_calls, has_hallucination = None, False
-            for _ in self.hallucination_state:
-                # check if moodel response starts with tool calls, we do it after 5 tokens because we only check the first part of the response.
-                if len(self.hallucination_state.tokens) > 5 and has_tool_calls is None:
-                    content = "".join(self.hallucination_state.tokens)
-                    if "tool_calls" in content:
-                        has_tool_calls = True
-                    else:
-                        has_tool_calls = False
+        # initialize the hallucination handler, which is an iterator
+        # the state is local, since the handler generates concurrent requests in worker threads
+        hallucination_state = HallucinationState(
+            response_iterator=response, function=req.tools
+        )
 
-                # if the model is hallucinating, start parameter gathering
-                if self.hallucination_state.hallucination is True:
-                    has_hallucination = True
-                    break
+        has_tool_calls, has_hallucination = None, False
+        for _ in hallucination_state:
+            # check if moodel response starts with tool calls, we do it after 5 tokens because we only check the first part of the response.
+            if len(hallucination_state.tokens) > 5 and has_tool_calls is None:
+                content = "".join(hallucination_state.tokens)
+                if "tool_calls" in content:
+                    has_tool_calls = True
+                else:
+                    has_tool_calls = False
 
-            if has_tool_calls and has_hallucination:
-                # start prompt prefilling if hallcuination is found in tool calls
-                logger.info(
-                    f"[Hallucination]: {self.hallucination_state.error_message}"
-                )
-                response = self.client.chat.completions.create(
-                    messages=self._prefill_message(messages, self.clarify_prefix),
-                    model=self.model_name,
-                    stream=False,
-                    extra_body=self.generation_params,
-                )
-                model_response = response.choices[0].message.content
-            else:
-                model_response = "".join(self.hallucination_state.tokens)
+            # if the model is hallucinating, start parameter gathering
+            if hallucination_state.hallucination is True:
+                has_hallucination = True
+                break
+
+        if escalate and has_hallucination:
+            logger.info(f"[Hallucination]: {hallucination_state.error_message}")
+            # stop the upstream from generating the rest of the response
+            if hasattr(response, "close"):
+                response.close()
+            return None, "hallucination"
+
+        if has_tool_calls and has_hallucination:
+            # start prompt prefilling if hallcuination is found in tool calls
+            logger.info(f"[Hallucination]: {hallucination_state.error_message}")
+            response = client.chat.completions.create(
+                messages=self._prefill_message(messages, self.clarify_prefix),
+                model=model_name,
+                stream=False,
+                extra_body=self.generation_params,
+            )
+            model_response = response.choices[0].message.content
+        else:
+            model_response = "".join(hallucination_state.tokens)
 
         # Extract tool calls from model response
         response_dict = self._parse_model_response(model_response)
         logger.info(f"[arch-fc]: raw model response: {response_dict['raw_response']}")
 
+        escalation_reason = None
+
+        # the response is built from parsed values, so its models skip validation
         # General model response
         if response_dict.get("response", ""):
-            model_message = Message(content="", tool_calls=[])
+            model_message = Message.model_construct(content="", tool_calls=[])
         # Parameter gathering
         elif response_dict.get("required_functions", []):
-            if not use_agent_orchestrator:
-                clarification = response_dict.get("clarification", "")
-                model_message = Message(content=clarification, tool_calls=[])
-            else:
-                model_message = Message(content="", tool_calls=[])
+            clarification = response_dict.get("clarification", "")
+            model_message = Message.model_construct(
+                content=clarification, tool_calls=[]
+            )
         # Function Calling
         elif response_dict.get("tool_calls", []):
             if response_dict["is_valid"]:
-                if not use_agent_orchestrator:
-                    verification_dict = self._verify_tool_calls(
-                        tools=req.tools, tool_calls=response_dict["tool_calls"]
-                    )
+                verification_dict = self._verify_tool_calls(
+                    tools=req.tools, tool_calls=response_dict["tool_calls"]
+                )
 
-                    if verification_dict["is_valid"]:
-                        logger.info(
-                            f"[Tool calls]: {json.dumps([tool_call['function'] for tool_call in response_dict['tool_calls']])}"
-                        )
-                        model_message = Message(
-                            content="", tool_calls=response_dict["tool_calls"]
-                        )
-                    else:
-                        logger.error(
-                            f"Invalid tool call - {verification_dict['error_message']}"
-                        )
-                        model_message = Message(content="", tool_calls=[])
-                else:
-                    # skip tool call verification if using agent orchestrator
+                if verification_dict["is_valid"]:
                     logger.info(
                         f"[Tool calls]: {json.dumps([tool_call['function'] for tool_call in response_dict['tool_calls']])}"
                     )
-                    model_message = Message(
+                    model_message = Message.model_construct(
                         content="", tool_calls=response_dict["tool_calls"]
                     )
-
+                else:
+                    logger.error(
+                        f"Invalid tool call - {verification_dict['error_message']}"
+                    )
+                    model_message = Message.model_construct(content="", tool_calls=[])
+                    escalation_reason = "verification"
             else:
                 # Response with tool calls but invalid
-                model_message = Message(content="", tool_calls=[])
+                model_message = Message.model_construct(content="", tool_calls=[])
+                escalation_reason = "invalid_json"
         # Response not in the desired format
         else:
             logger.error(f"Invalid model response - {model_response}")
-            model_message = Message(content="", tool_calls=[])
+            model_message = Message.model_construct(content="", tool_calls=[])
+            escalation_reason = "invalid_json"
+
+        if escalate and escalation_reason is not None:
+            return None, escalation_reason
+
+        metadata = {
+            "x-arch-fc-model-response": response_dict["raw_response"],
+            "hallucination": str(hallucination_state.hallucination),
+        }
+
+        chat_completion_response = ChatCompletionResponse.model_construct(
+            choices=[Choice.model_construct(message=model_message)],
+            model=self.model_name,
+            metadata=metadata,
+            role="assistant",
+        )
+
+        logger.info(
+            f"[response arch-fc]: {chat_completion_response.model_dump_json(exclude_none=True)}"
+        )
+
+        return chat_completion_response, escalation_reason
+
+    def _generate_routing(
+        self, messages: List[Dict[str, Any]]
+    ) -> ChatCompletionResponse:
+        """
+        Generates the routing decision of the agent orchestrator.
+
+        The orchestrator only forwards tool calls, so the stream is closed as soon as the first tool
+        call is complete or the response turns out not to be a tool call.
+
+        Args:
+            messages (List[Dict[str, Any]]): The processed messages of the request.
+
+        Returns:
+            ChatCompletionResponse: The first tool call of the model, or no tool call.
+        """
+
+        generation_params = self.generation_params | {
+            "max_tokens": self.routing_max_tokens
+        }
+
+        logger.info(
+            f"[request to arch-fc]: model: {self.model_name}, extra_body: {generation_params}, body: {json.dumps(messages)}"
+        )
+
+        response = self.client.chat.completions.create(
+            messages=self._prefill_message(messages, self.default_prefix),
+            model=self.model_name,
+            stream=True,
+            extra_body=generation_params,
+        )
+
+        model_response, decision = "", None
+        try:
+            for chunk in response:
+                content = get_stream_content(chunk)
+                if content:
+                    model_response += content
+                    decision = get_routing_decision(model_response)
+                    if decision is not None:
+                        break
+        finally:
+            # stop the upstream from generating the rest of the response
+            if hasattr(response, "close"):
+                response.close()
+
+        logger.info(
+            f"[Agent Orchestrator]: response received: {model_response}, decision: {decision}"
+        )
 
-        chat_completion_response = ChatCompletionResponse(
-            choices=[Choice(message=model_message)],
+        branch, tool_call = decision or (None, None)
+        if tool_call is not None:
+            model_response = f'{{"tool_calls": [{tool_call}]}}'
+
+        # the response is parsed as a whole if the stream ended before a decision
+        if branch in (None, "tool_calls"):
+            response_dict = self._parse_model_response(model_response)
+            raw_response = response_dict["raw_response"]
+            tool_calls = (
+                response_dict["tool_calls"] if response_dict["is_valid"] else []
+            )
+        else:
+            raw_response, tool_calls = model_response, []
+
+        if tool_calls:
+            # skip tool call verification if using agent orchestrator
+            logger.info(
+                f"[Tool calls]: {json.dumps([tool_call['function'] for tool_call in tool_calls])}"
+            )
+
+        # a stream stopped at the decision only holds the start of the model response, so it is
+        # omitted, unless the response was rebuilt from the first tool call
+        if decision is None:
+            metadata = {"x-arch-fc-model-response": raw_response}
+        elif tool_call is not None:
+            metadata = {
+                "x-arch-fc-model-response": raw_response,
+                "x-arch-fc-model-response-partial": "true",
+            }
+        else:
+            metadata = {"x-arch-fc-model-response-partial": "true"}
+
+        chat_completion_response = ChatCompletionResponse.model_construct(
+            choices=[
+                Choice.model_construct(
+                    message=Message.model_construct(content="", tool_calls=tool_calls)
+                )
+            ],
             model=self.model_name,
-            metadata={"x-arch-fc-model-response": response_dict["raw_response"]},
+            metadata=metadata,
             role="assistant",
         )
 
         logger.info(
-            f"[response arch-fc]: {json.dumps(chat_completion_response.model_dump(exclude_none=True))}"
+            f"[response arch-fc]: {chat_completion_response.model_dump_json(exclude_none=True)}"
         )
 
         return chat_completion_response
@@ -506,7 +895,7 @@ class ArchAgentHandler(ArchFunctionHandler):
 
         converted = []
         # delete parameters key if its empty in tool
-        for tool in tools:
+        for tool in sorted(tools, key=lambda tool: tool["function"]["name"]):
             if (
                 "parameters" in tool["function"]
                 and "properties" in tool["function"]["parameters"]
@@ -514,7 +903,7 @@ class ArchAgentHandler(ArchFunctionHandler):
             ):
                 tool_copy = copy.deepcopy(tool)
                 del tool_copy["function"]["parameters"]
-                converted.append(json.dumps(tool_copy["function"], ensure_ascii=False))
+                converted.append(self._serialize_function(tool_copy["function"]))
             else:
-                converted.append(json.dumps(tool["function"], ensure_ascii=False))
+                converted.append(self._serialize_function(tool["function"]))
         return "\n".join(converted)
@@ -0,0 +1,275 @@
+import os
+import queue
+import asyncio
+import itertools
+import threading
+import torch
+import torch.multiprocessing as mp
+import src.commons.utils as utils
+
+from concurrent.futures import Future
+from typing import Any, Dict, List
+from src.commons.metrics import REGISTRY
+from src.core.guardrails import ArchGuardHanlder
+from src.core.utils.model_utils import (
+    GuardBatchRequest,
+    GuardBatchResponse,
+    GuardRequest,
+    GuardResponse,
+)
+
+
+logger = utils.get_model_server_logger()
+
+
+GUARD_POOL_OUTSTANDING = REGISTRY.gauge(
+    "arch_guard_pool_outstanding_requests",
+    "Guard requests dispatched to each replica and not yet answered.",
+)
+GUARD_POOL_REQUESTS = REGISTRY.counter(
+    "arch_guard_pool_requests_total", "Guard requests served by each replica."
+)
+
+
+def _run_worker(
+    worker_id: int,
+    handler: ArchGuardHanlder,
+    num_threads: int,
+    cpus: List[int],
+    requests,
+    responses,
+):
+    """
+    Serves guard requests of one replica until it receives `None`.
+    """
+
+    torch.set_num_threads(num_threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    logger.info(
+        f"[Guard pool]: replica {worker_id} (pid {os.getpid()}) started with "
+        f"{num_threads} threads on cpus {cpus}"
+    )
+
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+
+        request_id, method, args = item
+        try:
+            responses.put((request_id, getattr(handler, method)(*args), None))
+        except Exception as e:
+            responses.put((request_id, None, e))
+
+
+class GuardProcessPool:
+    """
+    Runs replicas of a guard handler in worker processes and dispatches requests to the least loaded one.
+
+    The float weights of the models are moved to shared memory before the workers are started,
+    so the replicas map the same weights instead of each holding a copy. The packed weights of
+    int8 dynamically quantized layers are not tensors that can be shared; they are pickled by
+    value into each worker, so every replica holds its own copy of the quantized weights. Each
+    replica is given a fixed number of threads and, where supported, pinned to its own set of CPUs.
+
+    Stateful features of the handler, such as the per-message verdict cache, are kept per replica.
+    """
+
+    def __init__(
+        self,
+        handler: ArchGuardHanlder,
+        num_replicas: int,
+        threads_per_replica: int = None,
+        pin_cpus: bool = True,
+    ):
+        """
+        Initializes the pool and starts its replicas.
+
+        Args:
+            handler (ArchGuardHanlder): The handler to replicate, with its models on CPU.
+            num_replicas (int): The number of worker processes.
+            threads_per_replica (int, optional): The number of torch threads per replica. Defaults to the
+                number of available CPUs divided by `num_replicas`.
+            pin_cpus (bool, optional): Whether to pin each replica to its own CPUs. Defaults to True.
+        """
+
+        if hasattr(os, "sched_getaffinity"):
+            available_cpus = sorted(os.sched_getaffinity(0))
+        else:
+            available_cpus = list(range(os.cpu_count() or 1))
+
+        if threads_per_replica is None:
+            threads_per_replica = max(len(available_cpus) // num_replicas, 1)
+
+        self.num_replicas = num_replicas
+        self.threads_per_replica = threads_per_replica
+
+        for classifier_name, classifier in handler.classifiers.items():
+            classifier["model"].share_memory()
+            if any(
+                isinstance(module, torch.ao.nn.quantized.dynamic.Linear)
+                for module in classifier["model"].modules()
+            ):
+                logger.info(
+                    f"[Guard pool]: the quantized weights of {classifier_name} are copied into each of the {num_replicas} replicas"
+                )
+
+        context = mp.get_context("spawn")
+        self._responses = context.Queue()
+        self._requests = []
+        self._processes = []
+        self.outstanding = [0] * num_replicas
+
+        for worker_id in range(num_replicas):
+            cpus = []
+            if pin_cpus:
+                # replicas wrap around when there are fewer CPUs than requested threads
+                cpus = [
+                    available_cpus[
+                        (worker_id * threads_per_replica + i) % len(available_cpus)
+                    ]
+                    for i in range(threads_per_replica)
+                ]
+
+            requests = context.Queue()
+            process = context.Process(
+                target=_run_worker,
+                args=(
+                    worker_id,
+                    handler,
+                    threads_per_replica,
+                    sorted(set(cpus)),
+                    requests,
+                    self._responses,
+                ),
+                daemon=True,
+            )
+            process.start()
+
+            self._requests.append(requests)
+            self._processes.append(process)
+            GUARD_POOL_OUTSTANDING.set(0, replica=str(worker_id))
+
+        self._lock = threading.Lock()
+        self._pending: Dict[int, tuple] = {}
+        self._request_ids = itertools.count()
+        self._closed = False
+
+        self._collector = threading.Thread(
+            target=self._collect_responses, name="guard-pool-collector", daemon=True
+        )
+        self._collector.start()
+
+        logger.info(
+            f"[Guard pool]: started {num_replicas} replicas with {threads_per_replica} threads each"
+        )
+
+    def submit(self, method: str, *args) -> Future:
+        """
+        Dispatches a handler call to the replica with the fewest outstanding requests.
+
+        Args:
+            method (str): The name of the handler method to call.
+            *args: The arguments of the call, which must be picklable.
+
+        Returns:
+            Future: The future result of the call.
+        """
+
+        future = Future()
+        # a running future cannot be cancelled, so the collector can always resolve it
+        future.set_running_or_notify_cancel()
+
+        with self._lock:
+            # replicas that died are not dispatched to, their queues are never read
+            alive = [
+                worker_id
+                for worker_id, process in enumerate(self._processes)
+                if process.is_alive()
+            ]
+            if not alive:
+                future.set_exception(RuntimeError("no guard replica is alive"))
+                return future
+
+            worker_id = min(alive, key=self.outstanding.__getitem__)
+            request_id = next(self._request_ids)
+            self._pending[request_id] = (worker_id, future)
+            self.outstanding[worker_id] += 1
+            GUARD_POOL_OUTSTANDING.set(
+                self.outstanding[worker_id], replica=str(worker_id)
+            )
+
+        self._requests[worker_id].put((request_id, method, args))
+        return future
+
+    async def predict(self, req: GuardRequest) -> GuardResponse:
+        return await asyncio.wrap_future(self.submit("predict", req))
+
+    async def predict_batch(self, req: GuardBatchRequest) -> GuardBatchResponse:
+        return await asyncio.wrap_future(self.submit("predict_batch", req))
+
+    def _finish(self, request_id: int) -> Any:
+        with self._lock:
+            worker_id, future = self._pending.pop(request_id)
+            self.outstanding[worker_id] -= 1
+            GUARD_POOL_OUTSTANDING.set(
+                self.outstanding[worker_id], replica=str(worker_id)
+            )
+
+        GUARD_POOL_REQUESTS.inc(replica=str(worker_id))
+        return future
+
+    def _collect_responses(self):
+        while not self._closed:
+            # checked on every iteration, since other replicas may keep the queue busy
+            self._fail_dead_workers()
+
+            try:
+                request_id, result, error = self._responses.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            future = self._finish(request_id)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _fail_dead_workers(self):
+        # requests of a replica that died would otherwise never be answered
+        with self._lock:
+            dead_workers = {
+                worker_id
+                for worker_id, process in enumerate(self._processes)
+                if self.outstanding[worker_id] and not process.is_alive()
+            }
+            if not dead_workers:
+                return
+
+            dead_requests = [
+                request_id
+                for request_id, (worker_id, _) in self._pending.items()
+                if worker_id in dead_workers
+            ]
+
+        for request_id in dead_requests:
+            self._finish(request_id).set_exception(
+                RuntimeError("guard replica exited unexpectedly")
+            )
+
+    def close(self):
+        """
+        Stops the replicas.
+        """
+
+        self._closed = True
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
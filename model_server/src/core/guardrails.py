@@ -1,14 +1,61 @@
+import os
+import re
+import time
+import uuid
 import torch
-import numpy as np
+import bisect
+import hashlib
+import collections
 import src.commons.utils as utils
 
+from typing import Dict, List, Tuple
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from src.core.utils.model_utils import GuardRequest, GuardResponse
+from src.core.utils import quantization_utils
+from src.core.utils.model_utils import (
+    GuardBatchRequest,
+    GuardBatchResponse,
+    GuardRequest,
+    GuardResponse,
+    GuardSessionResponse,
+    GuardTaskResult,
+    GuardWindowResult,
+)
 
 
 logger = utils.get_model_server_logger()
 
 
+# upper bounds (in tokens) of the length buckets that guard batches never straddle
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+# a session flushes its trailing partial word once it grows beyond this many characters
+MAX_SESSION_PENDING_CHARS = 1024
+
+
+class GuardSession:
+    """
+    The state of an incremental guard session.
+
+    The token stream of each tokenizer is only kept from the start of the next window, i.e.,
+    the overlap with the last scored window plus the tokens that do not fill a window yet.
+    """
+
+    def __init__(self, session_id: str, tasks: List[str], tokenizer_names: List[str]):
+        self.session_id = session_id
+        self.task_results = {task: (0.0, False) for task in tasks}
+        # text after the last whitespace, which the next append may continue
+        self.pending_text = ""
+        self.buffers = {name: [] for name in tokenizer_names}
+        # the number of tokens at the start of each buffer that were already scored
+        self.num_scored = {name: 0 for name in tokenizer_names}
+        self.num_windows = {name: 0 for name in tokenizer_names}
+        self.last_active = time.monotonic()
+
+    @property
+    def pending_tasks(self) -> List[str]:
+        return [task for task, (_, verdict) in self.task_results.items() if not verdict]
+
+
 class ArchGuardHanlder:
     def __init__(self, model_dict):
         """
@@ -16,14 +63,58 @@ class ArchGuardHanlder:
 
         Args:
             model_dict (dict): A dictionary containing the model, tokenizer, and device information.
+                Additional classifiers can be provided under `classifiers`, keyed by model name, each
+                with its `model`, `tokenizer`, `tokenizer_name` and the `tasks` it supports.
         """
 
         self.model = model_dict["model"]
         self.model_name = model_dict["model_name"]
         self.tokenizer = model_dict["tokenizer"]
         self.device = model_dict["device"]
+        self.max_batch_tokens = model_dict.get("max_batch_tokens", 8192)
+        self.length_buckets = sorted(
+            model_dict.get("length_buckets", DEFAULT_LENGTH_BUCKETS)
+        )
+
+        self.session_window_size = model_dict.get("session_window_size", 256)
+        self.session_window_overlap = model_dict.get("session_window_overlap", 32)
+        self.max_sessions = model_dict.get("max_sessions", 1024)
+        self.session_ttl = model_dict.get("session_ttl", 600)
+        self.sessions = collections.OrderedDict()
+        self._special_tokens = {}
+
+        # verdicts of previously seen messages, keyed by task and content hash
+        self.verdict_cache_size = model_dict.get("verdict_cache_size", 4096)
+        self.verdict_cache = collections.OrderedDict()
+
+        if not 0 <= self.session_window_overlap < self.session_window_size:
+            raise ValueError("Session window overlap must be smaller than the window")
+
+        # Arch-Guard classifies prompts into benign (0), injection (1) and jailbreak (2)
+        self.classifiers = {
+            self.model_name: {
+                "model": self.model,
+                "tokenizer": self.tokenizer,
+                "tokenizer_name": self.model_name,
+            }
+        }
+        self.support_tasks = {
+            "jailbreak": {
+                "classifier": self.model_name,
+                "positive_class": 2,
+                "threshold": 0.5,
+            },
+            "prompt_injection": {
+                "classifier": self.model_name,
+                "positive_class": 1,
+                "threshold": 0.5,
+            },
+        }
 
-        self.support_tasks = {"jailbreak": {"positive_class": 2, "threshold": 0.5}}
+        for classifier_name, classifier in model_dict.get("classifiers", {}).items():
+            self.classifiers[classifier_name] = classifier
+            for task, task_config in classifier["tasks"].items():
+                self.support_tasks[task] = {"classifier": classifier_name} | task_config
 
     def _split_text_into_chunks(self, text, max_num_words=300):
         """
@@ -46,18 +137,228 @@ class ArchGuardHanlder:
 
         return chunks
 
-    @staticmethod
-    def softmax(x):
+    def _group_tasks(self, tasks: List[str]) -> Dict[str, Dict[str, List[str]]]:
         """
-        Computes the softmax of the input array.
+        Groups tasks by classifier and classifiers by tokenizer.
 
         Args:
-            x (np.ndarray): The input array.
+            tasks (List[str]): The tasks to perform.
+
+        Returns:
+            Dict[str, Dict[str, List[str]]]: The tasks of each classifier, keyed by tokenizer name.
+        """
+
+        tokenizer_groups = {}
+        for task in tasks:
+            classifier_name = self.support_tasks[task]["classifier"]
+            tokenizer_name = self.classifiers[classifier_name]["tokenizer_name"]
+            classifier_tasks = tokenizer_groups.setdefault(tokenizer_name, {})
+            classifier_tasks.setdefault(classifier_name, []).append(task)
+
+        return tokenizer_groups
+
+    def _make_batches(self, lengths: List[int]) -> List[List[int]]:
+        """
+        Groups sequences into length buckets and each bucket into batches within the batch token budget.
+
+        A batch only holds sequences of the same bucket, so it is padded to at most the bucket's
+        upper bound rather than to the longest sequence of all pending inputs.
+
+        Args:
+            lengths (List[int]): The number of tokens of each sequence.
+
+        Returns:
+            List[List[int]]: Batches of sequence indices. Every batch pads to at most `max_batch_tokens` tokens.
+        """
+
+        buckets = {}
+        for idx in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+            bucket = bisect.bisect_left(self.length_buckets, lengths[idx])
+            buckets.setdefault(bucket, []).append(idx)
+
+        batches = []
+        for bucket in sorted(buckets):
+            batch = []
+            for idx in buckets[bucket]:
+                # sequences are sorted, so the current one is the longest in the batch
+                if batch and (len(batch) + 1) * lengths[idx] > self.max_batch_tokens:
+                    batches.append(batch)
+                    batch = []
+                batch.append(idx)
+            batches.append(batch)
+
+        return batches
+
+    def _predict_batch(
+        self, tasks: List[str], texts: List[str], max_length=512
+    ) -> List[Dict[str, Tuple[float, bool]]]:
+        """
+        Predicts the results of several tasks for a list of texts.
+
+        Texts are tokenized once per distinct tokenizer, sorted by length and padded per batch.
+        Each classifier runs a single forward pass per batch, from which the probabilities of
+        all of its tasks are read.
+
+        Args:
+            tasks (List[str]): The tasks to perform (e.g., ["jailbreak", "prompt_injection"]).
+            texts (List[str]): The input texts to classify.
+            max_length (int, optional): The maximum length for tokenization. Defaults to 512.
 
         Returns:
-            np.ndarray: The softmax of the input.
+            List[Dict[str, Tuple[float, bool]]]: The probability and verdict of each task, in the order of `texts`.
         """
-        return np.exp(x) / np.exp(x).sum(axis=0)
+
+        results = [{} for _ in texts]
+
+        for classifier_tasks in self._group_tasks(tasks).values():
+            tokenizer = self.classifiers[next(iter(classifier_tasks))]["tokenizer"]
+            encodings = tokenizer(texts, truncation=True, max_length=max_length)
+            features = [
+                {key: encodings[key][idx] for key in encodings.keys()}
+                for idx in range(len(texts))
+            ]
+
+            self._predict_features(classifier_tasks, tokenizer, features, results)
+
+        return results
+
+    def _predict_features(
+        self,
+        classifier_tasks: Dict[str, List[str]],
+        tokenizer,
+        features: List[Dict[str, List[int]]],
+        results: List[Dict[str, Tuple[float, bool]]],
+    ):
+        """
+        Runs the classifiers that share `tokenizer` on already tokenized sequences.
+
+        Args:
+            classifier_tasks (Dict[str, List[str]]): The tasks of each classifier.
+            tokenizer: The tokenizer used to pad the sequences.
+            features (List[Dict[str, List[int]]]): The tokenized sequences, with their `input_ids` and `attention_mask`.
+            results (List[Dict[str, Tuple[float, bool]]]): The results of each sequence, updated in place.
+        """
+
+        for batch in self._make_batches(
+            [len(feature["input_ids"]) for feature in features]
+        ):
+            inputs = tokenizer.pad(
+                [features[idx] for idx in batch], return_tensors="pt"
+            ).to(self.device)
+
+            for classifier_name, classifier_task_list in classifier_tasks.items():
+                model = self.classifiers[classifier_name]["model"]
+
+                # softmax runs in-graph so only the probabilities leave the device
+                with torch.inference_mode():
+                    logits = model(**inputs).logits
+                    probs = torch.softmax(logits.float(), dim=-1).cpu().numpy()
+
+                for row, idx in enumerate(batch):
+                    for task in classifier_task_list:
+                        task_config = self.support_tasks[task]
+                        prob = probs[row][task_config["positive_class"]].item()
+                        results[idx][task] = (prob, prob > task_config["threshold"])
+
+    def _make_synthetic_texts(self, num_tokens: int, num_texts: int) -> List[str]:
+        # special tokens take two positions, and each repeated word is one token
+        return [" ".join(["hello"] * max(num_tokens - 2, 1))] * num_texts
+
+    def warmup(self):
+        """
+        Runs every classifier on synthetic inputs of each length bucket.
+
+        Compiled models are traced on their first calls, so warming them up at startup keeps
+        compilation out of the latency of the first requests.
+        """
+
+        start_time = time.perf_counter()
+
+        texts = []
+        for bucket in self.length_buckets or [DEFAULT_LENGTH_BUCKETS[-1]]:
+            texts.extend(self._make_synthetic_texts(bucket, 1))
+
+        # batches of one and of several sequences so that the batch dimension is dynamic
+        for num_texts in (1, 2):
+            self._predict_batch(list(self.support_tasks), texts * num_texts)
+
+        logger.info(
+            f"[Arch-Guard]: warm-up took {time.perf_counter() - start_time:.3f}s"
+        )
+
+    def tune_num_threads(
+        self,
+        candidates: List[int] = None,
+        num_tokens: int = 64,
+        num_texts: int = 8,
+        num_runs: int = 3,
+    ) -> int:
+        """
+        Benchmarks the intra-op thread counts in `candidates` and keeps the fastest one.
+
+        Args:
+            candidates (List[int], optional): The thread counts to try. Defaults to the powers of two up to the number of CPUs, and the number of CPUs.
+            num_tokens (int, optional): The number of tokens of each synthetic input. Defaults to 64.
+            num_texts (int, optional): The number of synthetic inputs per run. Defaults to 8.
+            num_runs (int, optional): The number of timed runs per candidate, the fastest of which is kept. Defaults to 3.
+
+        Returns:
+            int: The selected number of threads.
+        """
+
+        if candidates is None:
+            num_cpus = os.cpu_count() or 1
+            candidates = sorted(
+                {2**i for i in range(num_cpus.bit_length()) if 2**i <= num_cpus}
+                | {num_cpus}
+            )
+
+        tasks = list(self.support_tasks)
+        texts = self._make_synthetic_texts(num_tokens, num_texts)
+
+        latencies = {}
+        for num_threads in candidates:
+            torch.set_num_threads(num_threads)
+            # untimed run to settle the thread pool
+            self._predict_batch(tasks, texts)
+
+            latency = float("inf")
+            for _ in range(num_runs):
+                start_time = time.perf_counter()
+                self._predict_batch(tasks, texts)
+                latency = min(latency, time.perf_counter() - start_time)
+            latencies[num_threads] = latency
+
+        num_threads = min(latencies, key=latencies.get)
+        torch.set_num_threads(num_threads)
+
+        logger.info(
+            "[Arch-Guard]: thread auto-tune "
+            + ", ".join(
+                f"{threads}: {latency * 1000:.1f}ms"
+                for threads, latency in latencies.items()
+            )
+            + f", selected {num_threads} threads"
+        )
+
+        return num_threads
+
+    def _predict_tasks(
+        self, tasks: List[str], text: str, max_length=512
+    ) -> Dict[str, Tuple[float, bool]]:
+        """
+        Predicts the results for the provided text for several tasks at once.
+
+        Args:
+            tasks (List[str]): The tasks to perform (e.g., ["jailbreak", "prompt_injection"]).
+            text (str): The input text to classify.
+            max_length (int, optional): The maximum length for tokenization. Defaults to 512.
+
+        Returns:
+            Dict[str, Tuple[float, bool]]: The probability and verdict of each task.
+        """
+
+        return self._predict_batch(tasks, [text], max_length)[0]
 
     def _predict_text(self, task, text, max_length=512) -> GuardResponse:
         """
@@ -72,74 +373,668 @@ class ArchGuardHanlder:
             GuardResponse: A GuardResponse object containing the prediction.
         """
 
-        inputs = self.tokenizer(
-            text, truncation=True, max_length=max_length, return_tensors="pt"
-        ).to(self.device)
-
-        with torch.no_grad():
-            logits = self.model(**inputs).logits.cpu().detach().numpy()[0]
-            prob = ArchGuardHanlder.softmax(logits)[
-                self.support_tasks[task]["positive_class"]
-            ].item()
-
-        verdict = prob > self.support_tasks[task]["threshold"]
+        prob, verdict = self._predict_tasks([task], text, max_length)[task]
 
-        return GuardResponse(task=task, input=text, prob=prob, verdict=verdict)
+        # responses are built from model outputs, so their models skip validation
+        return GuardResponse.model_construct(
+            task=task, input=text, prob=prob, verdict=verdict
+        )
 
     def predict(self, req: GuardRequest, max_num_words=300) -> GuardResponse:
         """
         Makes a prediction based on the GuardRequest input.
 
         Args:
-            req (GuardRequest): The GuardRequest object containing the input text and task.
+            req (GuardRequest): The GuardRequest object containing the input text (or messages) and task (or tasks).
             max_num_words (int, optional): The maximum number of words in each chunk if splitting is needed. Defaults to 300.
 
         Returns:
-            GuardResponse: A GuardResponse object containing the prediction.
-
-        Note:
-            currently only support jailbreak check
+            GuardResponse: A GuardResponse object containing the prediction. For requests with `tasks`,
+                `results` holds the verdict of each task and the top-level fields describe the most
+                likely task.
         """
 
-        if req.task not in self.support_tasks:
-            raise NotImplementedError(f"{req.task} is not supported!")
+        tasks = req.tasks if req.tasks else [req.task]
+
+        for task in tasks:
+            if task not in self.support_tasks:
+                raise NotImplementedError(f"{task} is not supported!")
 
         logger.info("[Arch-Guard] - Prediction")
         logger.info(f"[request arch-guard]: {req.input}")
 
-        if len(req.input.split()) < max_num_words:
-            result = self._predict_text(req.task, req.input)
+        if req.messages is not None:
+            task_results = self._predict_messages(
+                tasks,
+                [message.content for message in req.messages if message.content],
+                max_num_words,
+            )
+        elif len(req.input.split()) < max_num_words:
+            task_results = self._predict_tasks(tasks, req.input)
         else:
-            prob, verdict = 0.0, False
+            task_results = {task: (0.0, False) for task in tasks}
 
-            # split into chunks if text is long
+            # split into chunks if text is long, and stop once every task is positive
             text_chunks = self._split_text_into_chunks(req.input)
 
             for chunk in text_chunks:
-                chunk_result = self._predict_text(req.task, chunk)
-
-                if chunk_result.verdict:
-                    prob = chunk_result.prob
-                    verdict = True
+                pending_tasks = [task for task in tasks if not task_results[task][1]]
+                if not pending_tasks:
                     break
 
-            result = GuardResponse(
+                for task, (prob, verdict) in self._predict_tasks(
+                    pending_tasks, chunk
+                ).items():
+                    if verdict:
+                        task_results[task] = (prob, verdict)
+
+        if req.tasks:
+            result = self._build_multi_task_response(req.input, task_results)
+        else:
+            prob, verdict = task_results[req.task]
+            result = GuardResponse.model_construct(
                 task=req.task, input=req.input, prob=prob, verdict=verdict
             )
 
+        for task, (prob, verdict) in task_results.items():
+            logger.info(
+                f"[response]: {task}: {'True' if verdict else 'False'} (prob: {prob:.2f})"
+            )
+
+        return result
+
+    def _build_multi_task_response(
+        self, text: str, task_results: Dict[str, Tuple[float, bool]]
+    ) -> GuardResponse:
+        """
+        Builds the response of a multi-task prediction.
+
+        Args:
+            text (str): The input text.
+            task_results (Dict[str, Tuple[float, bool]]): The probability and verdict of each task.
+
+        Returns:
+            GuardResponse: A GuardResponse object whose `results` holds the verdict of each task and whose
+                top-level fields describe the most likely task.
+        """
+
+        results = [
+            GuardTaskResult.model_construct(task=task, prob=prob, verdict=verdict)
+            for task, (prob, verdict) in task_results.items()
+        ]
+        top_result = max(results, key=lambda result: result.prob)
+
+        return GuardResponse.model_construct(
+            task=top_result.task,
+            input=text,
+            prob=top_result.prob,
+            verdict=any(result.verdict for result in results),
+            results=results,
+        )
+
+    def predict_batch(
+        self, req: GuardBatchRequest, max_num_words=300
+    ) -> GuardBatchResponse:
+        """
+        Makes predictions for a batch of independent inputs.
+
+        Long inputs are split into chunks like in `predict`; an input is positive for a task if any of
+        its chunks is. All chunks of all inputs are classified together in padded batches.
+
+        Args:
+            req (GuardBatchRequest): The GuardBatchRequest object containing the input texts and tasks.
+            max_num_words (int, optional): The maximum number of words in each chunk if splitting is needed. Defaults to 300.
+
+        Returns:
+            GuardBatchResponse: A GuardBatchResponse object with one GuardResponse per input, in order.
+        """
+
+        for task in req.tasks:
+            if task not in self.support_tasks:
+                raise NotImplementedError(f"{task} is not supported!")
+
+        logger.info(f"[Arch-Guard] - Batch prediction of {len(req.inputs)} inputs")
+
+        task_results = self._predict_inputs(req.tasks, req.inputs, max_num_words)
+
+        return GuardBatchResponse.model_construct(
+            results=[
+                self._build_multi_task_response(text, text_results)
+                for text, text_results in zip(req.inputs, task_results)
+            ]
+        )
+
+    def _predict_inputs(
+        self, tasks: List[str], texts: List[str], max_num_words=300
+    ) -> List[Dict[str, Tuple[float, bool]]]:
+        """
+        Predicts the results of several tasks for independent inputs, splitting long inputs into chunks.
+
+        Args:
+            tasks (List[str]): The tasks to perform.
+            texts (List[str]): The input texts to classify.
+            max_num_words (int, optional): The maximum number of words in each chunk if splitting is needed. Defaults to 300.
+
+        Returns:
+            List[Dict[str, Tuple[float, bool]]]: The probability and verdict of each task, in the order of `texts`.
+        """
+
+        chunk_owners, chunk_texts, num_chunks = [], [], []
+        for idx, text in enumerate(texts):
+            if len(text.split()) < max_num_words:
+                chunks = [text]
+            else:
+                chunks = self._split_text_into_chunks(text, max_num_words)
+
+            chunk_owners.extend([idx] * len(chunks))
+            chunk_texts.extend(chunks)
+            num_chunks.append(len(chunks))
+
+        task_results = [{task: (0.0, False) for task in tasks} for _ in texts]
+        chunk_results = self._predict_batch(tasks, chunk_texts)
+
+        for idx, chunk_result in zip(chunk_owners, chunk_results):
+            for task, (prob, verdict) in chunk_result.items():
+                # like `predict`, long inputs report their first positive chunk
+                if num_chunks[idx] == 1 or (verdict and not task_results[idx][task][1]):
+                    task_results[idx][task] = (prob, verdict)
+
+        return task_results
+
+    def _predict_messages(
+        self, tasks: List[str], contents: List[str], max_num_words=300
+    ) -> Dict[str, Tuple[float, bool]]:
+        """
+        Predicts the results of several tasks for the messages of a conversation.
+
+        Verdicts are cached per task and message content hash, so only new or changed messages
+        are classified. Like the chunks of a long input, the conversation is positive for a task
+        if any of its messages is.
+
+        Args:
+            tasks (List[str]): The tasks to perform.
+            contents (List[str]): The contents of the messages.
+            max_num_words (int, optional): The maximum number of words in each chunk if splitting is needed. Defaults to 300.
+
+        Returns:
+            Dict[str, Tuple[float, bool]]: The probability and verdict of each task.
+        """
+
+        keys = [
+            hashlib.sha256(content.encode("utf-8")).hexdigest() for content in contents
+        ]
+
+        message_results = {}
+        for key, content in zip(keys, contents):
+            if key in message_results:
+                continue
+
+            cached = {task: self.verdict_cache.get((task, key)) for task in tasks}
+            if all(result is not None for result in cached.values()):
+                for task in tasks:
+                    self.verdict_cache.move_to_end((task, key))
+                message_results[key] = cached
+
+        # identical messages are only classified once
+        missed = {
+            key: content
+            for key, content in zip(keys, contents)
+            if key not in message_results
+        }
+
         logger.info(
-            f"[response]: {req.task}: {'True' if result.verdict else 'False'} (prob: {result.prob:.2f})"
+            f"[Arch-Guard]: classifying {len(missed)} of {len(contents)} messages"
         )
 
-        return result
+        if missed:
+            for key, results in zip(
+                missed,
+                self._predict_inputs(tasks, list(missed.values()), max_num_words),
+            ):
+                message_results[key] = results
+                for task, result in results.items():
+                    self.verdict_cache[(task, key)] = result
+
+            while len(self.verdict_cache) > self.verdict_cache_size:
+                self.verdict_cache.popitem(last=False)
+
+        task_results = {task: (0.0, False) for task in tasks}
+        for key in keys:
+            for task, (prob, verdict) in message_results[key].items():
+                if len(keys) == 1 or (verdict and not task_results[task][1]):
+                    task_results[task] = (prob, verdict)
+
+        return task_results
+
+    def open_session(self, tasks: List[str]) -> GuardSessionResponse:
+        """
+        Opens an incremental guard session.
+
+        Args:
+            tasks (List[str]): The tasks to perform on the session's text.
+
+        Returns:
+            GuardSessionResponse: The response holding the id of the new session.
+        """
+
+        for task in tasks:
+            if task not in self.support_tasks:
+                raise NotImplementedError(f"{task} is not supported!")
+
+        self._expire_sessions()
+        while len(self.sessions) >= self.max_sessions:
+            session_id, _ = self.sessions.popitem(last=False)
+            logger.warning(f"[Arch-Guard]: too many sessions, evicted {session_id}")
+
+        session = GuardSession(uuid.uuid4().hex, tasks, list(self._group_tasks(tasks)))
+        self.sessions[session.session_id] = session
+
+        return self._build_session_response(session, [])
+
+    def append_session(self, session_id: str, text: str) -> GuardSessionResponse:
+        """
+        Appends text to a session and scores every token window it completes.
+
+        Once every task is positive, the session stops scoring and drops its buffered tokens.
+
+        Args:
+            session_id (str): The id of the session.
+            text (str): The text to append.
+
+        Returns:
+            GuardSessionResponse: The verdicts of the newly completed windows and of the session so far.
+        """
+
+        session = self._get_session(session_id)
+        if not session.pending_tasks:
+            return self._build_session_response(session, [])
+
+        text = session.pending_text + text
+
+        # hold back the trailing partial word, its tokens depend on what comes next
+        match = re.search(r"\s\S*\Z", text)
+        split = match.start() if match else 0
+        if len(text) - split > MAX_SESSION_PENDING_CHARS:
+            split = len(text)
+        session.pending_text = text[split:]
+
+        windows = self._score_session(session, text[:split])
+
+        return self._build_session_response(session, windows)
+
+    def close_session(self, session_id: str) -> GuardSessionResponse:
+        """
+        Closes a session, scoring the tokens that do not fill a complete window yet.
+
+        Args:
+            session_id (str): The id of the session.
+
+        Returns:
+            GuardSessionResponse: The verdicts of the last window and the final verdicts of the session.
+        """
+
+        session = self._get_session(session_id)
+        del self.sessions[session_id]
+
+        windows = []
+        if session.pending_tasks:
+            windows = self._score_session(session, session.pending_text, final=True)
+
+        return self._build_session_response(session, windows, closed=True)
+
+    def _get_session(self, session_id: str) -> GuardSession:
+        self._expire_sessions()
+        if session_id not in self.sessions:
+            raise KeyError(f"session {session_id} not found")
+
+        session = self.sessions[session_id]
+        session.last_active = time.monotonic()
+        self.sessions.move_to_end(session_id)
+
+        return session
+
+    def _expire_sessions(self):
+        # sessions are ordered by activity, so expired ones are at the front
+        now = time.monotonic()
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.last_active < self.session_ttl:
+                break
+            self.sessions.popitem(last=False)
+            logger.info(f"[Arch-Guard]: session {session.session_id} expired")
+
+    def _score_session(
+        self, session: GuardSession, text: str, final: bool = False
+    ) -> List[GuardWindowResult]:
+        """
+        Tokenizes appended text into the session's buffers and scores the completed windows.
+
+        Windows are scored in batches within the batch token budget, and scoring stops after
+        the first batch in which every task turned positive.
+
+        Args:
+            session (GuardSession): The session.
+            text (str): The appended text, which ends at a word boundary.
+            final (bool, optional): Whether to also score the incomplete last window. Defaults to False.
+
+        Returns:
+            List[GuardWindowResult]: The results of the scored windows.
+        """
+
+        window_size = self.session_window_size
+        stride = window_size - self.session_window_overlap
+        windows_per_batch = max(self.max_batch_tokens // (window_size + 2), 1)
+
+        windows = []
+        for tokenizer_name in list(session.buffers):
+            tokenizer = None
+            buffer = session.buffers[tokenizer_name]
+
+            while True:
+                classifier_tasks = self._group_tasks(session.pending_tasks).get(
+                    tokenizer_name
+                )
+                if classifier_tasks is None:
+                    break
+
+                if tokenizer is None:
+                    tokenizer = self.classifiers[next(iter(classifier_tasks))][
+                        "tokenizer"
+                    ]
+                    if text:
+                        buffer.extend(
+                            tokenizer([text], add_special_tokens=False)["input_ids"][0]
+                        )
+
+                window_ids = []
+                while (
+                    len(buffer) >= window_size and len(window_ids) < windows_per_batch
+                ):
+                    window_ids.append(buffer[:window_size])
+                    del buffer[:stride]
+                    session.num_scored[tokenizer_name] = self.session_window_overlap
+
+                if not window_ids and final:
+                    if len(buffer) > session.num_scored[tokenizer_name]:
+                        window_ids.append(list(buffer))
+                    buffer.clear()
+
+                if not window_ids:
+                    break
+
+                windows.extend(
+                    self._score_windows(
+                        session, tokenizer_name, classifier_tasks, tokenizer, window_ids
+                    )
+                )
+
+        if not session.pending_tasks:
+            # every task is positive, the remaining text does not change the verdict
+            for buffer in session.buffers.values():
+                buffer.clear()
+            session.pending_text = ""
+
+        return windows
 
+    def _get_special_tokens(
+        self, tokenizer_name: str, tokenizer
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Returns the special tokens the tokenizer adds before and after a single sequence.
+        """
+
+        if tokenizer_name not in self._special_tokens:
+            input_ids = tokenizer(["a"])["input_ids"][0]
+            content_ids = tokenizer(["a"], add_special_tokens=False)["input_ids"][0]
+            start = next(
+                i
+                for i in range(len(input_ids) - len(content_ids) + 1)
+                if input_ids[i : i + len(content_ids)] == content_ids
+            )
+            self._special_tokens[tokenizer_name] = (
+                input_ids[:start],
+                input_ids[start + len(content_ids) :],
+            )
+
+        return self._special_tokens[tokenizer_name]
+
+    def _score_windows(
+        self,
+        session: GuardSession,
+        tokenizer_name: str,
+        classifier_tasks: Dict[str, List[str]],
+        tokenizer,
+        window_ids: List[List[int]],
+    ) -> List[GuardWindowResult]:
+        prefix, suffix = self._get_special_tokens(tokenizer_name, tokenizer)
+
+        features = []
+        for ids in window_ids:
+            input_ids = prefix + ids + suffix
+            features.append(
+                {"input_ids": input_ids, "attention_mask": [1] * len(input_ids)}
+            )
+
+        results = [{} for _ in features]
+        self._predict_features(classifier_tasks, tokenizer, features, results)
+
+        windows = []
+        for window_results in results:
+            for task, (prob, verdict) in window_results.items():
+                # like `predict`, a positive task reports its first positive window
+                if verdict or prob > session.task_results[task][0]:
+                    if not session.task_results[task][1]:
+                        session.task_results[task] = (prob, verdict)
+
+            windows.append(
+                GuardWindowResult.model_construct(
+                    window=session.num_windows[tokenizer_name],
+                    results=[
+                        GuardTaskResult.model_construct(
+                            task=task, prob=prob, verdict=verdict
+                        )
+                        for task, (prob, verdict) in window_results.items()
+                    ],
+                )
+            )
+            session.num_windows[tokenizer_name] += 1
+
+        return windows
+
+    def _build_session_response(
+        self, session: GuardSession, windows: List[GuardWindowResult], closed=False
+    ) -> GuardSessionResponse:
+        return GuardSessionResponse.model_construct(
+            session_id=session.session_id,
+            verdict=any(verdict for _, verdict in session.task_results.values()),
+            results=[
+                GuardTaskResult.model_construct(task=task, prob=prob, verdict=verdict)
+                for task, (prob, verdict) in session.task_results.items()
+            ],
+            windows=windows,
+            closed=closed,
+        )
+
+
+def configure_threads(num_threads: int = None, num_interop_threads: int = None):
+    """
+    Sets the number of threads torch uses for CPU inference.
+
+    Args:
+        num_threads (int, optional): The number of threads used within an op. Defaults to None (torch default).
+        num_interop_threads (int, optional): The number of threads used across independent ops. Defaults to None (torch default).
+    """
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work has started
+            logger.warning(
+                f"[Arch-Guard]: cannot set inter-op threads to {num_interop_threads}, "
+                f"keeping {torch.get_num_interop_threads()}"
+            )
+
+    logger.info(
+        f"[Arch-Guard]: using {torch.get_num_threads()} intra-op and "
+        f"{torch.get_num_interop_threads()} inter-op threads"
+    )
+
+
+def compare_guard_models(
+    model_name: str, tokenizer, reference, candidate, texts: List[str]
+) -> Tuple[List[Dict[str, Tuple[float, bool]]], List[Dict[str, Tuple[float, bool]]]]:
+    """
+    Predicts the Arch-Guard tasks for the given texts with a reference and a candidate model on CPU.
+
+    Args:
+        model_name (str): The name of the guard model.
+        tokenizer: The tokenizer of the guard model.
+        reference: The reference (float32) model.
+        candidate: The candidate (e.g., quantized) model.
+        texts (List[str]): The input texts.
+
+    Returns:
+        Tuple[List[Dict[str, Tuple[float, bool]]], List[Dict[str, Tuple[float, bool]]]]: The results of the reference
+            and of the candidate model.
+    """
+
+    results = []
+    for model in (reference, candidate):
+        handler = ArchGuardHanlder(
+            {
+                "model": model,
+                "model_name": model_name,
+                "tokenizer": tokenizer,
+                "device": "cpu",
+            }
+        )
+        results.append(handler._predict_inputs(list(handler.support_tasks), texts))
 
-def get_guardrail_handler(model_name: str = "katanemo/Arch-Guard", device: str = None):
+    return results[0], results[1]
+
+
+def load_quantized_model(
+    model_name: str,
+    tokenizer,
+    cache_dir: str = None,
+    eval_path: str = None,
+    min_agreement: float = 0.99,
+):
+    """
+    Loads the int8 variant of the guard model if its verdicts agree with the float32 model.
+
+    A cached quantized model is used if the agreement recorded with it reaches `min_agreement`.
+    Otherwise the model is quantized at load time and compared against the float32 model on the
+    inputs of the evaluation dataset. The quantized model is refused, and the float32 model
+    returned instead, if there is no evaluation dataset or the agreement is below `min_agreement`.
+
+    Args:
+        model_name (str): The name of the guard model.
+        tokenizer: The tokenizer of the guard model.
+        cache_dir (str, optional): The directory of cached quantized models. Defaults to None (no caching).
+        eval_path (str, optional): The JSONL evaluation dataset, see `quantization_utils.load_labeled_dataset`. Defaults to None.
+        min_agreement (float, optional): The minimum share of matching verdicts. Defaults to 0.99.
+
+    Returns:
+        The model to serve, on CPU.
+    """
+
+    cache_path = None
+    if cache_dir:
+        cache_path = quantization_utils.get_cache_path(cache_dir, model_name)
+        if os.path.exists(cache_path):
+            model, report = quantization_utils.load_quantized_model(cache_path)
+            if report["agreement"] >= min_agreement:
+                logger.info(
+                    f"[Arch-Guard]: loaded int8 model from {cache_path} "
+                    f"(agreement: {report['agreement']:.4f})"
+                )
+                return model
+
+    reference = AutoModelForSequenceClassification.from_pretrained(
+        model_name, device_map="cpu", low_cpu_mem_usage=True
+    )
+
+    if eval_path is None:
+        logger.warning(
+            "[Arch-Guard]: int8 model refused, no evaluation dataset to check its agreement"
+        )
+        return reference
+
+    quantized = quantization_utils.quantize_model(reference)
+
+    texts = [
+        example["input"]
+        for example in quantization_utils.load_labeled_dataset(eval_path)
+    ]
+    report = quantization_utils.compare_results(
+        *compare_guard_models(model_name, tokenizer, reference, quantized, texts)
+    )
+
+    if report["agreement"] < min_agreement:
+        logger.error(
+            f"[Arch-Guard]: int8 model refused, agreement {report['agreement']:.4f} "
+            f"is below {min_agreement} ({report})"
+        )
+        return reference
+
+    logger.info(f"[Arch-Guard]: int8 model admitted ({report})")
+    if cache_path:
+        quantization_utils.save_quantized_model(quantized, cache_path, report)
+
+    return quantized
+
+
+def get_guardrail_handler(
+    model_name: str = "katanemo/Arch-Guard",
+    device: str = None,
+    classifiers: List[Dict] = None,
+    max_batch_tokens: int = 8192,
+    length_buckets: List[int] = DEFAULT_LENGTH_BUCKETS,
+    num_threads: int = None,
+    num_interop_threads: int = None,
+    compile_model: bool = False,
+    bf16: bool = False,
+    auto_tune_threads: bool = False,
+    session_window_size: int = 256,
+    session_window_overlap: int = 32,
+    max_sessions: int = 1024,
+    verdict_cache_size: int = 4096,
+    quantize: bool = False,
+    quantized_cache_dir: str = None,
+    quantize_eval_path: str = None,
+    quantize_min_agreement: float = 0.99,
+):
     """
     Initializes and returns an instance of ArchGuardHanlder based on the specified device.
 
     Args:
+        model_name (str, optional): The name of the guard model. Defaults to "katanemo/Arch-Guard".
         device (str, optional): The device to use for model inference (e.g., "cpu" or "cuda"). Defaults to None.
+        classifiers (List[Dict], optional): Additional classifier models, each with a `model_name`, an optional
+            `tokenizer_name` and the `tasks` it supports, e.g.,
+            `{"model_name": "...", "tasks": {"toxicity": {"positive_class": 1, "threshold": 0.5}}}`. Defaults to None.
+        max_batch_tokens (int, optional): The maximum number of padded tokens per inference batch. Defaults to 8192.
+        length_buckets (List[int], optional): Upper bounds of the length buckets used to group batches. Defaults to DEFAULT_LENGTH_BUCKETS.
+        num_threads (int, optional): The number of intra-op CPU threads. Defaults to None (torch default).
+        num_interop_threads (int, optional): The number of inter-op CPU threads. Defaults to None (torch default).
+        compile_model (bool, optional): Whether to compile the models with `torch.compile` and warm them up. Defaults to False.
+        bf16 (bool, optional): Whether to run the models in bfloat16 if the device supports it. Defaults to False.
+        auto_tune_threads (bool, optional): Whether to benchmark thread counts at startup and keep the fastest
+            (CPU only, overrides `num_threads`). Defaults to False.
+        session_window_size (int, optional): The number of tokens of each window scored by guard sessions. Defaults to 256.
+        session_window_overlap (int, optional): The number of tokens consecutive session windows share. Defaults to 32.
+        max_sessions (int, optional): The maximum number of open sessions, beyond which the least recently used is evicted. Defaults to 1024.
+        verdict_cache_size (int, optional): The maximum number of cached per-message verdicts. Defaults to 4096.
+        quantize (bool, optional): Whether to serve the guard model with dynamically quantized int8 Linear layers
+            (CPU only), see `load_quantized_model`. Defaults to False.
+        quantized_cache_dir (str, optional): The directory of cached quantized models. Defaults to None.
+        quantize_eval_path (str, optional): The JSONL dataset the quantized model is evaluated on. Defaults to None.
+        quantize_min_agreement (float, optional): The minimum verdict agreement with the float32 model. Defaults to 0.99.
 
     Returns:
         ArchGuardHanlder: An instance of ArchGuardHanlder configured for the specified device.
@@ -148,13 +1043,80 @@ def get_guardrail_handler(model_name: str = "katanemo/Arch-Guard", device: str =
     if device is None:
         device = utils.get_device()
 
+    if device == "cpu":
+        configure_threads(num_threads, num_interop_threads)
+
+    model_kwargs = {"device_map": device, "low_cpu_mem_usage": True}
+    if bf16:
+        if utils.is_bf16_supported(device):
+            model_kwargs["torch_dtype"] = torch.bfloat16
+        else:
+            logger.warning(
+                f"[Arch-Guard]: bfloat16 is not supported on {device}, using float32"
+            )
+
+    def load_model(name):
+        model = AutoModelForSequenceClassification.from_pretrained(name, **model_kwargs)
+        if compile_model:
+            # sequence lengths vary per batch, so trace with dynamic shapes
+            model = torch.compile(model, dynamic=True)
+        return model
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+
+    if quantize and device != "cpu":
+        logger.warning(f"[Arch-Guard]: int8 quantization is not supported on {device}")
+        quantize = False
+
+    if quantize:
+        model = load_quantized_model(
+            model_name,
+            tokenizer,
+            cache_dir=quantized_cache_dir,
+            eval_path=quantize_eval_path,
+            min_agreement=quantize_min_agreement,
+        )
+        if compile_model:
+            model = torch.compile(model, dynamic=True)
+    else:
+        model = load_model(model_name)
+
     guardrail_dict = {
         "device": device,
         "model_name": model_name,
-        "tokenizer": AutoTokenizer.from_pretrained(model_name, trust_remote_code=True),
-        "model": AutoModelForSequenceClassification.from_pretrained(
-            model_name, device_map=device, low_cpu_mem_usage=True
-        ),
+        "tokenizer": tokenizer,
+        "model": model,
+        "classifiers": {},
+        "max_batch_tokens": max_batch_tokens,
+        "length_buckets": length_buckets,
+        "session_window_size": session_window_size,
+        "session_window_overlap": session_window_overlap,
+        "max_sessions": max_sessions,
+        "verdict_cache_size": verdict_cache_size,
     }
 
-    return ArchGuardHanlder(model_dict=guardrail_dict)
+    # classifiers sharing a tokenizer reuse the same tokenized inputs
+    tokenizers = {model_name: guardrail_dict["tokenizer"]}
+    for classifier in classifiers or []:
+        tokenizer_name = classifier.get("tokenizer_name", classifier["model_name"])
+        if tokenizer_name not in tokenizers:
+            tokenizers[tokenizer_name] = AutoTokenizer.from_pretrained(
+                tokenizer_name, trust_remote_code=True
+            )
+
+        guardrail_dict["classifiers"][classifier["model_name"]] = {
+            "model": load_model(classifier["model_name"]),
+            "tokenizer": tokenizers[tokenizer_name],
+            "tokenizer_name": tokenizer_name,
+            "tasks": classifier["tasks"],
+        }
+
+    handler = ArchGuardHanlder(model_dict=guardrail_dict)
+
+    if compile_model:
+        handler.warmup()
+
+    if auto_tune_threads and device == "cpu":
+        handler.tune_num_threads()
+
+    return handler
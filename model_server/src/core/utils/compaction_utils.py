@@ -0,0 +1,136 @@
+import json
+
+from typing import Any, Iterable
+
+
+# keys that describe how a result was produced rather than the result itself
+DEFAULT_VERBOSE_KEYS = frozenset(
+    [
+        "_links",
+        "_metadata",
+        "debug",
+        "headers",
+        "html",
+        "links",
+        "query_time",
+        "raw",
+        "request_id",
+        "trace",
+    ]
+)
+
+
+def _size(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def truncate_text(text: str, max_bytes: int) -> str:
+    """
+    Truncates text to at most `max_bytes` bytes, noting how much was cut.
+    """
+
+    if _size(text) <= max_bytes:
+        return text
+
+    encoded = text.encode("utf-8")
+    marker = f"... [truncated {len(encoded)} bytes]"
+    keep = max(max_bytes - _size(marker), 0)
+    return encoded[:keep].decode("utf-8", errors="ignore") + marker
+
+
+def drop_keys(value: Any, keys: Iterable[str]) -> Any:
+    """
+    Removes the given keys from every object in a JSON value.
+    """
+
+    if isinstance(value, dict):
+        return {k: drop_keys(v, keys) for k, v in value.items() if k not in keys}
+    if isinstance(value, list):
+        return [drop_keys(item, keys) for item in value]
+    return value
+
+
+def truncate_arrays(value: Any, max_items: int) -> Any:
+    """
+    Keeps the first `max_items` items of every array, followed by a note of how many were dropped.
+
+    The kept items preserve the shape of the array's elements.
+    """
+
+    if isinstance(value, dict):
+        return {k: truncate_arrays(v, max_items) for k, v in value.items()}
+    if isinstance(value, list):
+        items = [truncate_arrays(item, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"... {len(value) - max_items} more items")
+        return items
+    return value
+
+
+def truncate_strings(value: Any, max_chars: int) -> Any:
+    """
+    Shortens every string longer than `max_chars` characters.
+    """
+
+    if isinstance(value, dict):
+        return {k: truncate_strings(v, max_chars) for k, v in value.items()}
+    if isinstance(value, list):
+        return [truncate_strings(item, max_chars) for item in value]
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "..."
+    return value
+
+
+def compact_tool_response(
+    content: str,
+    max_bytes: int,
+    max_items: int = 3,
+    verbose_keys: Iterable[str] = DEFAULT_VERBOSE_KEYS,
+) -> str:
+    """
+    Compacts a tool response to fit into `max_bytes` bytes.
+
+    JSON responses are compacted with increasingly lossy strategies until they fit: verbose keys
+    are dropped, arrays are cut to their first `max_items` items (then to one item) and long
+    strings are shortened. The keys and nesting of the response are preserved so the model still
+    sees the shape of the result. Responses that still do not fit, or are not JSON, are truncated.
+
+    Args:
+        content (str): The tool response.
+        max_bytes (int): The budget of the response in bytes.
+        max_items (int, optional): The number of array items kept. Defaults to 3.
+        verbose_keys (Iterable[str], optional): The keys dropped from objects. Defaults to DEFAULT_VERBOSE_KEYS.
+
+    Returns:
+        str: The compacted response.
+    """
+
+    if _size(content) <= max_bytes:
+        return content
+
+    try:
+        value = json.loads(content)
+    except (TypeError, ValueError):
+        return truncate_text(content, max_bytes)
+
+    value = drop_keys(value, frozenset(verbose_keys))
+
+    # every candidate is compacted from the response without verbose keys, so that the
+    # counts of dropped array items stay exact
+    candidates = [
+        lambda: value,
+        lambda: truncate_arrays(value, max_items),
+        lambda: truncate_arrays(value, 1),
+        lambda: truncate_strings(truncate_arrays(value, 1), 64),
+    ]
+
+    for candidate in candidates:
+        compacted = _dumps(candidate())
+        if _size(compacted) <= max_bytes:
+            return compacted
+
+    return truncate_text(compacted, max_bytes)
@@ -0,0 +1,128 @@
+from typing import Any, Dict, List
+
+
+# tools declare Python type names, which are mapped to JSON schema types
+JSON_SCHEMA_TYPES = {
+    "int": "integer",
+    "float": "number",
+    "bool": "boolean",
+    "str": "string",
+    "list": "array",
+    "tuple": "array",
+    "set": "array",
+    "dict": "object",
+    "integer": "integer",
+    "number": "number",
+    "boolean": "boolean",
+    "string": "string",
+    "array": "array",
+    "object": "object",
+}
+
+
+def get_parameter_schema(parameter: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converts the declaration of a tool parameter into a JSON schema.
+
+    Parameters of unknown types are left unconstrained.
+    """
+
+    schema = {}
+    if parameter.get("type") in JSON_SCHEMA_TYPES:
+        schema["type"] = JSON_SCHEMA_TYPES[parameter["type"]]
+    if parameter.get("enum"):
+        schema["enum"] = list(parameter["enum"])
+    return schema
+
+
+def get_tool_call_schema(function: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the JSON schema of a call to a function, which only admits its declared parameters.
+    """
+
+    parameters = function.get("parameters") or {}
+    properties = parameters.get("properties") or {}
+
+    return {
+        "type": "object",
+        "properties": {
+            "name": {"const": function["name"]},
+            "arguments": {
+                "type": "object",
+                "properties": {
+                    name: get_parameter_schema(parameter)
+                    for name, parameter in properties.items()
+                },
+                "required": [
+                    name
+                    for name in parameters.get("required", [])
+                    if name in properties
+                ],
+                "additionalProperties": False,
+            },
+        },
+        "required": ["name", "arguments"],
+        "additionalProperties": False,
+    }
+
+
+def get_response_schema(tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Builds the JSON schema of a model response for guided decoding.
+
+    The schema admits the three response formats of the format prompt: a plain response, a
+    clarification for missing parameters of declared functions, and calls to declared functions.
+
+    Args:
+        tools (List[Dict[str, Any]]): The tools of the request.
+
+    Returns:
+        Dict[str, Any]: The JSON schema, e.g., for vLLM's `guided_json`.
+    """
+
+    functions = [tool["function"] for tool in tools]
+    names = [function["name"] for function in functions]
+
+    response_formats = [
+        {
+            "type": "object",
+            "properties": {"response": {"type": "string"}},
+            "required": ["response"],
+            "additionalProperties": False,
+        }
+    ]
+
+    if functions:
+        response_formats += [
+            {
+                "type": "object",
+                "properties": {
+                    "required_functions": {
+                        "type": "array",
+                        "items": {"enum": names},
+                        "minItems": 1,
+                    },
+                    "clarification": {"type": "string"},
+                },
+                "required": ["required_functions", "clarification"],
+                "additionalProperties": False,
+            },
+            {
+                "type": "object",
+                "properties": {
+                    "tool_calls": {
+                        "type": "array",
+                        "items": {
+                            "anyOf": [
+                                get_tool_call_schema(function) for function in functions
+                            ]
+                        },
+                        "minItems": 1,
+                    }
+                },
+                "required": ["tool_calls"],
+                "additionalProperties": False,
+            },
+        ]
+
+    return {"anyOf": response_formats}
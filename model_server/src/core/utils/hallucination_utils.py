@@ -1,9 +1,11 @@
+import sys
 import json
 import math
 import torch
 import itertools
 
 
+from array import array
 from typing import Dict, List, Tuple
 from enum import Enum
 import string
@@ -25,6 +27,9 @@ PARAMETER_VALUE_END_TOKEN = ('",', '"}')
 
 BRACKETS = {"(": ")", "{": "}", "[": "]"}
 
+# the patterns above are matched against the end of the response, which is kept this long
+CONTENT_TAIL_LENGTH = 32
+
 
 # Thresholds
 class MaskToken(Enum):
@@ -35,6 +40,11 @@ class MaskToken(Enum):
     TOOL_CALL = "t"
 
 
+# masks are stored as one byte per token
+MASK_CODES = {token: ord(token.value) for token in MaskToken}
+MASK_TOKENS = {code: token for token, code in MASK_CODES.items()}
+
+
 HALLUCINATION_THRESHOLD_DICT = {
     "entropy": 0.0001,
     "varentropy": 0.0001,
@@ -133,16 +143,46 @@ class HallucinationState:
         hallucination_message (str): Message describing the hallucination.
         parameter_name (list): List of extracted parameter names.
         token_probs_map (list): List mapping tokens to their entropy and variance of entropy.
+
+    Tokens are interned, so that concurrent requests share the strings of common tokens. The
+    log probabilities are kept in a flat float32 array and the mask in a bytearray; `logprobs`
+    and `mask` build the per-token lists on access.
     """
 
+    __slots__ = (
+        "tokens",
+        "_logprobs",
+        "_logprob_offsets",
+        "_content",
+        "state",
+        "_mask",
+        "parameter_name_done",
+        "hallucination",
+        "error_message",
+        "parameter_name",
+        "token_probs_map",
+        "response_iterator",
+        "function",
+        "function_properties",
+        "open_bracket",
+        "bracket",
+        "function_name",
+        "check_parameter_name",
+        "HALLUCINATION_THRESHOLD_DICT",
+    )
+
     def __init__(self, response_iterator=None, function=None):
         """
         Initializes the HallucinationState with default values.
         """
         self.tokens: List[str] = []
-        self.logprobs: List[float] = []
+        # the log probabilities of token i are _logprobs[_logprob_offsets[i] : _logprob_offsets[i + 1]]
+        self._logprobs = array("f")
+        self._logprob_offsets = array("I", [0])
+        # the end of the response without spaces, to match the patterns against
+        self._content = ""
         self.state: str = None
-        self.mask: List[str] = []
+        self._mask = bytearray()
         self.parameter_name_done: bool = False
         self.hallucination: bool = False
         self.error_message: str = ""
@@ -156,6 +196,20 @@ class HallucinationState:
         self.check_parameter_name = {}
         self.HALLUCINATION_THRESHOLD_DICT = HALLUCINATION_THRESHOLD_DICT
 
+    @property
+    def logprobs(self) -> List[List[float]]:
+        return [self._get_logprobs(idx) for idx in range(len(self.tokens))]
+
+    @property
+    def mask(self) -> List[MaskToken]:
+        return [MASK_TOKENS[code] for code in self._mask]
+
+    def _get_logprobs(self, idx: int) -> List[float]:
+        idx = idx % len(self.tokens)
+        start, end = self._logprob_offsets[idx], self._logprob_offsets[idx + 1]
+        # tokens without log probabilities keep the placeholder of the stream
+        return self._logprobs[start:end].tolist() if end > start else [None]
+
     def _process_function(self, function):
         self.function = function
         if self.function is None:
@@ -187,8 +241,11 @@ class HallucinationState:
         Returns:
             bool: True if the token is hallucinated, False otherwise.
         """
-        self.tokens.append(token)
-        self.logprobs.append(logprob)
+        self.tokens.append(sys.intern(token))
+        if logprob and logprob[0] is not None:
+            self._logprobs.extend(logprob)
+        self._logprob_offsets.append(len(self._logprobs))
+        self._content = (self._content + token.replace(" ", ""))[-CONTENT_TAIL_LENGTH:]
         self._process_token()
         return self.hallucination
 
@@ -199,6 +256,13 @@ class HallucinationState:
         if self.response_iterator is not None:
             try:
                 r = next(self.response_iterator)
+                if type(r) is tuple:
+                    # a flat (token, top logprobs) pair from `RawStreamClient`
+                    token_content, logprobs = r
+                    self.append_and_check_token_hallucination(
+                        token_content, logprobs if logprobs is not None else [None]
+                    )
+                    return token_content
                 if hasattr(r.choices[0].delta, "content"):
                     token_content = r.choices[0].delta.content
                     if token_content != "":
@@ -224,7 +288,7 @@ class HallucinationState:
         Processes the current token and updates the state and mask accordingly.
         Detects hallucinations based on the token type and log probabilities.
         """
-        content = "".join(self.tokens).replace(" ", "")
+        content = self._content
 
         # Function name extraction logic
         # If the state is function name and the token is not an end token, add to the mask
@@ -233,7 +297,7 @@ class HallucinationState:
 
         if self.state == "function_name":
             if self.tokens[-1] not in FUNC_NAME_END_TOKEN:
-                self.mask.append(MaskToken.FUNCTION_NAME)
+                self._mask.append(MASK_CODES[MaskToken.FUNCTION_NAME])
             else:
                 self.state = None
                 self._get_function_name()
@@ -247,7 +311,7 @@ class HallucinationState:
         if self.state == "parameter_name" and not content.endswith(
             PARAMETER_NAME_END_TOKENS
         ):
-            self.mask.append(MaskToken.PARAMETER_NAME)
+            self._mask.append(MASK_CODES[MaskToken.PARAMETER_NAME])
         # if the state is parameter name and the token is an end token, change the state, check hallucination and set the flag parameter name done
         # The need for parameter name done is to allow the check of parameter value pattern
         elif self.state == "parameter_name" and content.endswith(
@@ -291,14 +355,14 @@ class HallucinationState:
                 )
                 and self.tokens[-1].strip() != ""
             ):
-                self.mask.append(MaskToken.PARAMETER_VALUE)
+                self._mask.append(MASK_CODES[MaskToken.PARAMETER_VALUE])
 
                 # checking if the parameter doesn't have enum and the token is the first parameter value token
                 # check if function name is in function properties
                 if self.function_name in self.function_properties:
                     if (
-                        len(self.mask) > 1
-                        and self.mask[-2] != MaskToken.PARAMETER_VALUE
+                        len(self._mask) > 1
+                        and self._mask[-2] != MASK_CODES[MaskToken.PARAMETER_VALUE]
                         and is_parameter_required(
                             self.function_properties[self.function_name],
                             self.parameter_name[-1],
@@ -319,7 +383,7 @@ class HallucinationState:
                         f"Function name {self.function_name} not found in function properties"
                     )
             else:
-                self.mask.append(MaskToken.NOT_USED)
+                self._mask.append(MASK_CODES[MaskToken.NOT_USED])
         # if the state is parameter value and the token is an end token, change the state
         elif (
             self.state == "parameter_value"
@@ -335,15 +399,15 @@ class HallucinationState:
 
         # Maintain consistency between stack and mask
         # If the mask length is less than tokens, add an not used (e) token to the mask
-        if len(self.mask) != len(self.tokens):
-            self.mask.append(MaskToken.NOT_USED)
+        if len(self._mask) != len(self.tokens):
+            self._mask.append(MASK_CODES[MaskToken.NOT_USED])
 
     def _check_logprob(self):
         """
         Checks the log probability of the current token and updates the token probability map.
         Detects hallucinations based on entropy and variance of entropy.
         """
-        probs = self.logprobs[-1]
+        probs = self._get_logprobs(-1)
         entropy, varentropy, probability = calculate_uncertainty(probs)
         self.token_probs_map.append((self.tokens[-1], entropy, varentropy, probability))
 
@@ -365,9 +429,10 @@ class HallucinationState:
         Returns:
             int: The number of consecutive occurrences of the token.
         """
+        code = MASK_CODES[token]
         return (
-            len(list(itertools.takewhile(lambda x: x == token, reversed(self.mask))))
-            if self.mask and self.mask[-1] == token
+            len(list(itertools.takewhile(lambda x: x == code, reversed(self._mask))))
+            if self._mask and self._mask[-1] == code
             else 0
         )
 
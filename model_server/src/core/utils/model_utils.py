@@ -1,10 +1,25 @@
+import abc
 import json
+import hashlib
+import collections
 import src.commons.utils as utils
 
 from openai import OpenAI
 from pydantic import BaseModel
-from typing import Any, Dict, List, Optional
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
 from overrides import final
+from src.commons.metrics import REGISTRY
+from src.core.utils.compaction_utils import compact_tool_response
+
+
+logger = utils.get_model_server_logger()
+
+
+PROCESSED_MESSAGES = REGISTRY.counter(
+    "arch_processed_messages_total",
+    "Conversation messages formatted for the prompt, by whether they came from the prefix cache.",
+)
 
 
 class Message(BaseModel):
@@ -36,8 +51,17 @@ class ChatCompletionResponse(BaseModel):
 
 
 class GuardRequest(BaseModel):
-    input: str
-    task: str
+    input: Optional[str] = ""
+    task: Optional[str] = ""
+    tasks: Optional[List[str]] = None
+    # conversation to guard instead of `input`, verdicts of seen messages are reused
+    messages: Optional[List[Message]] = None
+
+
+class GuardTaskResult(BaseModel):
+    task: str = ""
+    prob: float = 0.0
+    verdict: bool = False
 
 
 class GuardResponse(BaseModel):
@@ -45,12 +69,79 @@ class GuardResponse(BaseModel):
     input: str = ""
     prob: float = 0.0
     verdict: bool = False
+    results: Optional[List[GuardTaskResult]] = None
+    metadata: Optional[Dict[str, str]] = {}
+
+
+class GuardBatchRequest(BaseModel):
+    inputs: List[str]
+    tasks: List[str]
+
+
+class GuardBatchResponse(BaseModel):
+    results: List[GuardResponse] = []
+    metadata: Optional[Dict[str, str]] = {}
+
+
+class GuardSessionRequest(BaseModel):
+    tasks: List[str] = ["jailbreak"]
+
+
+class GuardSessionAppendRequest(BaseModel):
+    text: str
+
+
+class GuardWindowResult(BaseModel):
+    window: int = 0
+    results: List[GuardTaskResult] = []
+
+
+class GuardSessionResponse(BaseModel):
+    session_id: str = ""
+    verdict: bool = False
+    results: List[GuardTaskResult] = []
+    windows: List[GuardWindowResult] = []
+    closed: bool = False
     metadata: Optional[Dict[str, str]] = {}
 
 
 # ================================================================================================
 
 
+def get_request_key(request: Dict[str, Any]) -> str:
+    """
+    Computes a stable fingerprint for an upstream chat completion request.
+
+    Args:
+        request (Dict[str, Any]): The keyword arguments passed to `chat.completions.create`.
+
+    Returns:
+        str: A hex digest identifying the request.
+    """
+
+    # per-request transport options such as `timeout` do not identify a response
+    request = {k: v for k, v in request.items() if k != "timeout"}
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class OpenAIClientProxy(abc.ABC):
+    """
+    Base class for drop-in replacements of the OpenAI client used by the handlers.
+
+    Subclasses implement `_create`, which receives the keyword arguments of `chat.completions.create`.
+    """
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    @abc.abstractmethod
+    def _create(self, **kwargs):
+        """
+        Abstract method for creating chat completions, with the arguments of `chat.completions.create`.
+        """
+
+
 class ArchBaseHandler:
     def __init__(
         self,
@@ -59,6 +150,7 @@ class ArchBaseHandler:
         task_prompt: str,
         format_prompt: str,
         generation_params: Dict,
+        message_cache_size: int = 256,
     ):
         """
         Initializes the base handler.
@@ -69,15 +161,28 @@ class ArchBaseHandler:
             task_prompt (str): The main task prompt for the system.
             format_prompt (str): A prompt specifying the desired output format.
             generation_params (Dict): Generation parameters for the model.
+            message_cache_size (int, optional): The number of processed conversation prefixes kept, 0 disables the cache. Defaults to 256.
         """
         self.client = client
         self.model_name = model_name
 
+        # prompts are cached by prefix upstream, so volatile content must follow the stable tool block
+        if "{today_date}" in task_prompt and task_prompt.index(
+            "{today_date}"
+        ) < task_prompt.index("{tools}"):
+            raise ValueError(
+                "{today_date} must be placed after {tools} in the task prompt"
+            )
+
         self.task_prompt = task_prompt
         self.format_prompt = format_prompt
 
         self.generation_params = generation_params
 
+        # processed messages of recent conversations, keyed by their length and last raw message
+        self.message_cache_size = message_cache_size
+        self.message_cache = collections.OrderedDict()
+
     def _convert_tools(self, tools: List[Dict[str, Any]]) -> str:
         """
         Converts a list of tools into the desired internal representation.
@@ -96,6 +201,9 @@ class ArchBaseHandler:
         """
         Formats the system prompt using provided tools.
 
+        The tool block comes before any volatile content (e.g., today's date), so that requests
+        with the same tools share a byte-identical prompt prefix.
+
         Args:
             tools (List[Dict[str, Any]]): A list of tools represented as dictionaries.
 
@@ -113,6 +221,118 @@ class ArchBaseHandler:
 
         return system_prompt
 
+    @staticmethod
+    def _get_message_digest(message: Message) -> str:
+        """
+        Hashes a single raw message.
+
+        Args:
+            message (Message): A message object.
+
+        Returns:
+            str: A hex digest of the message.
+        """
+
+        payload = json.dumps(
+            [message.role, message.content, message.tool_calls], ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _get_truncation_idx(
+        messages: List[Dict[str, Any]], max_tokens: int
+    ) -> Tuple[int, int]:
+        """
+        Finds where a conversation exceeding the token limit is cut.
+
+        The first system message is kept, and the conversation is shifted to start at a user
+        message.
+
+        Args:
+            messages (List[Dict[str, Any]]): A list of processed messages.
+            max_tokens (int): Maximum allowed token count, assuming ~4 characters per token on average.
+
+        Returns:
+            Tuple[int, int]: The number of leading messages kept and the index the rest of the conversation starts at.
+        """
+
+        num_tokens, conversation_idx = 0, 0
+        if messages[0]["role"] == "system":
+            num_tokens += len(messages[0]["content"]) // 4
+            conversation_idx = 1
+
+        for message_idx in range(len(messages) - 1, conversation_idx - 1, -1):
+            num_tokens += len(messages[message_idx]["content"]) // 4
+            if num_tokens >= max_tokens:
+                if messages[message_idx]["role"] == "user":
+                    break
+
+        return conversation_idx, message_idx
+
+    @final
+    def _process_message(
+        self,
+        messages: List[Message],
+        idx: int,
+        optimize_context_window: bool,
+        max_tool_response_bytes: int,
+    ) -> Dict[str, str]:
+        """
+        Formats a single message of a conversation for the prompt.
+
+        Only the message and the one before it, which holds the call of a tool response, are read.
+
+        Args:
+            messages (List[Message]): A list of message objects.
+            idx (int): The index of the message to format.
+            optimize_context_window (bool): Whether tool responses are left empty.
+            max_tool_response_bytes (int): The budget of each tool response in bytes, 0 keeps them whole.
+
+        Returns:
+            Dict[str, str]: The processed message.
+        """
+
+        message = messages[idx]
+        role, content, tool_calls = (
+            message.role,
+            message.content,
+            message.tool_calls,
+        )
+
+        if tool_calls:
+            # TODO: Extend to support multiple function calls
+            role = "assistant"
+            content = (
+                f"<tool_call>\n{json.dumps(tool_calls[0]['function'])}\n</tool_call>"
+            )
+        elif role == "tool":
+            role = "user"
+            if optimize_context_window:
+                content = f"<tool_response>\n\n</tool_response>"
+            else:
+                # sample response below
+                # "content": "<tool_response>\n{'name': 'get_stock_price', 'result': '$196.66'}\n</tool_response>"
+                # msg[idx-1] contains tool call = '{"tool_calls": [{"name": "currency_exchange", "arguments": {"currency_symbol": "NZD"}}]}'
+                tool_call_msg = messages[idx - 1].content
+                if tool_call_msg.startswith("```") and tool_call_msg.endswith("```"):
+                    tool_call_msg = tool_call_msg.strip("```").strip()
+                    if tool_call_msg.startswith("json"):
+                        tool_call_msg = tool_call_msg[4:].strip()
+                func_name = json.loads(tool_call_msg)["tool_calls"][0].get(
+                    "name", "no_name"
+                )
+                if max_tool_response_bytes:
+                    content = compact_tool_response(content, max_tool_response_bytes)
+                tool_response = {
+                    "name": func_name,
+                    "result": content,
+                }
+                content = (
+                    f"<tool_response>\n{json.dumps(tool_response)}\n</tool_response>"
+                )
+
+        return {"role": role, "content": content}
+
     @final
     def _process_messages(
         self,
@@ -121,6 +341,7 @@ class ArchBaseHandler:
         extra_instruction: str = None,
         max_tokens=4096,
         metadata: Dict[str, str] = {},
+        max_tool_response_bytes: int = None,
     ):
         """
         Processes a list of messages and formats them appropriately.
@@ -130,6 +351,8 @@ class ArchBaseHandler:
             tools (List[Dict[str, Any]], optional): A list of tools to include in the system prompt.
             extra_instruction (str, optional): Additional instructions to append to the last user message.
             max_tokens (int): Maximum allowed token count, assuming ~4 characters per token on average.
+            max_tool_response_bytes (int, optional): The budget of each tool response in bytes, see `compact_tool_response`.
+                Can be overridden per request with the `max_tool_response_bytes` metadata.
 
         Returns:
             List[Dict[str, Any]]: A list of processed message dictionaries.
@@ -137,69 +360,99 @@ class ArchBaseHandler:
 
         processed_messages = []
 
+        # the metadata comes from the client, so an invalid budget falls back to the default
+        max_tool_response_bytes = max_tool_response_bytes or 0
+        if "max_tool_response_bytes" in metadata:
+            try:
+                max_tool_response_bytes = max(
+                    int(metadata["max_tool_response_bytes"]), 0
+                )
+            except (TypeError, ValueError):
+                logger.warning(
+                    f"[Compaction]: ignoring invalid max_tool_response_bytes metadata: {metadata['max_tool_response_bytes']!r}"
+                )
+
         if tools:
             processed_messages.append(
                 {"role": "system", "content": self._format_system_prompt(tools)}
             )
 
-        for idx, message in enumerate(messages):
-            role, content, tool_calls = (
-                message.role,
-                message.content,
-                message.tool_calls,
-            )
+        optimize_context_window = (
+            metadata.get("optimize_context_window", "false").lower() == "true"
+        )
 
-            if tool_calls:
-                # TODO: Extend to support multiple function calls
-                role = "assistant"
-                content = f"<tool_call>\n{json.dumps(tool_calls[0]['function'])}\n</tool_call>"
-            elif role == "tool":
-                role = "user"
-                if metadata.get("optimize_context_window", "false").lower() == "true":
-                    content = f"<tool_response>\n\n</tool_response>"
-                else:
-                    # sample response below
-                    # "content": "<tool_response>\n{'name': 'get_stock_price', 'result': '$196.66'}\n</tool_response>"
-                    # msg[idx-1] contains tool call = '{"tool_calls": [{"name": "currency_exchange", "arguments": {"currency_symbol": "NZD"}}]}'
-                    tool_call_msg = messages[idx - 1].content
-                    if tool_call_msg.startswith("```") and tool_call_msg.endswith(
-                        "```"
-                    ):
-                        tool_call_msg = tool_call_msg.strip("```").strip()
-                        if tool_call_msg.startswith("json"):
-                            tool_call_msg = tool_call_msg[4:].strip()
-                    func_name = json.loads(tool_call_msg)["tool_calls"][0].get(
-                        "name", "no_name"
-                    )
-                    tool_response = {
-                        "name": func_name,
-                        "result": content,
-                    }
-                    content = f"<tool_response>\n{json.dumps(tool_response)}\n</tool_response>"
-
-            processed_messages.append({"role": role, "content": content})
+        # a follow-up turn resends the whole conversation, so only the messages appended since
+        # the longest cached prefix are hashed and processed. A prefix is keyed by its length and
+        # the digest of its last message, and its raw messages are compared to rule out collisions.
+        options = f"{optimize_context_window}:{max_tool_response_bytes}"
+        raw_messages = tuple(
+            (message.role, message.content, message.tool_calls) for message in messages
+        )
 
-        assert processed_messages[-1]["role"] == "user"
+        conversation, start_idx, entry, last_key = [], 0, None, None
+        for idx in range(len(messages), 0, -1):
+            key = f"{options}:{idx}:{self._get_message_digest(messages[idx - 1])}"
+            if last_key is None:
+                last_key = key
+
+            cached = self.message_cache.get(key)
+            if cached is not None and cached[0] == raw_messages[:idx]:
+                self.message_cache.move_to_end(key)
+                conversation = list(cached[1])
+                start_idx = idx
+                if idx == len(messages):
+                    entry = cached
+                break
+
+        for idx in range(start_idx, len(messages)):
+            conversation.append(
+                self._process_message(
+                    messages, idx, optimize_context_window, max_tool_response_bytes
+                )
+            )
 
-        if extra_instruction:
-            processed_messages[-1]["content"] += "\n" + extra_instruction
+        PROCESSED_MESSAGES.inc(start_idx, cached="true")
+        PROCESSED_MESSAGES.inc(len(messages) - start_idx, cached="false")
 
-        # keep the first system message and shift conversation if the total token length exceeds the limit
-        def truncate_messages(messages: List[Dict[str, Any]]):
-            num_tokens, conversation_idx = 0, 0
-            if messages[0]["role"] == "system":
-                num_tokens += len(messages[0]["content"]) // 4
-                conversation_idx = 1
+        if entry is None and messages and self.message_cache_size > 0:
+            entry = (raw_messages, tuple(conversation), {})
+            self.message_cache[last_key] = entry
+            if len(self.message_cache) > self.message_cache_size:
+                self.message_cache.popitem(last=False)
 
-            for message_idx in range(len(messages) - 1, conversation_idx - 1, -1):
-                num_tokens += len(messages[message_idx]["content"]) // 4
-                if num_tokens >= max_tokens:
-                    if messages[message_idx]["role"] == "user":
-                        break
+        processed_messages.extend(conversation)
 
-            return messages[:conversation_idx] + messages[message_idx:]
+        assert processed_messages[-1]["role"] == "user"
 
-        processed_messages = truncate_messages(processed_messages)
+        if extra_instruction:
+            processed_messages[-1] = dict(processed_messages[-1])
+            processed_messages[-1]["content"] += "\n" + extra_instruction
+            conversation_idx, message_idx = self._get_truncation_idx(
+                processed_messages, max_tokens
+            )
+        else:
+            # without an extra instruction, the cut only depends on the token budget left by the
+            # system prompt and is cached along with the conversation
+            budget = (
+                len(processed_messages[0]["content"]) // 4 if tools else None,
+                max_tokens,
+            )
+            if entry is not None and budget in entry[2]:
+                conversation_idx, message_idx = entry[2][budget]
+            else:
+                conversation_idx, message_idx = self._get_truncation_idx(
+                    processed_messages, max_tokens
+                )
+                if entry is not None:
+                    entry[2][budget] = (conversation_idx, message_idx)
+
+        # cached messages are shared between requests, so each request gets its own copies of
+        # the messages kept after truncation
+        processed_messages = [
+            dict(message)
+            for message in processed_messages[:conversation_idx]
+            + processed_messages[message_idx:]
+        ]
 
         return processed_messages
 
@@ -0,0 +1,139 @@
+import os
+import json
+import torch
+
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def quantize_model(model):
+    """
+    Returns a copy of the model whose Linear layers use dynamically quantized int8 weights.
+
+    Args:
+        model (torch.nn.Module): The float32 model.
+
+    Returns:
+        torch.nn.Module: The quantized model, which runs on CPU only.
+    """
+
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def get_cache_path(cache_dir: str, model_name: str) -> str:
+    """
+    Returns the path of the cached quantized model.
+
+    Quantized modules are pickled, so the cache is only valid for the torch version that wrote it.
+    """
+
+    file_name = (
+        f"{model_name.strip('/').replace('/', '--')}-int8-torch{torch.__version__}.pt"
+    )
+    return os.path.join(cache_dir, file_name)
+
+
+def save_quantized_model(model, path: str, report: Dict[str, Any]):
+    """
+    Saves a quantized model along with the evaluation report that admitted it.
+
+    Args:
+        model (torch.nn.Module): The quantized model.
+        path (str): The path of the cache file.
+        report (Dict[str, Any]): The result of `compare_results`.
+    """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.save({"model": model, "report": report}, path)
+
+
+def load_quantized_model(path: str) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Loads a quantized model and its evaluation report saved by `save_quantized_model`.
+    """
+
+    checkpoint = torch.load(path, weights_only=False)
+    return checkpoint["model"], checkpoint["report"]
+
+
+def load_labeled_dataset(path: str) -> List[Dict[str, str]]:
+    """
+    Loads a JSONL dataset whose lines hold an `input` and, optionally, a `label`.
+
+    Labels are the name of the positive task (e.g., "jailbreak") or "benign".
+    """
+
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_results(
+    reference: List[Dict[str, Tuple[float, bool]]],
+    candidate: List[Dict[str, Tuple[float, bool]]],
+) -> Dict[str, Any]:
+    """
+    Compares the per-task predictions of a candidate model against a reference model.
+
+    Args:
+        reference (List[Dict[str, Tuple[float, bool]]]): The probability and verdict of each task per input.
+        candidate (List[Dict[str, Tuple[float, bool]]]): The same for the candidate model, in the same order.
+
+    Returns:
+        Dict[str, Any]: The overall and per-task verdict agreement, and the mean and max absolute
+            probability differences.
+    """
+
+    matches, prob_diffs, task_matches = [], [], {}
+    for reference_result, candidate_result in zip(reference, candidate):
+        for task, (prob, verdict) in reference_result.items():
+            candidate_prob, candidate_verdict = candidate_result[task]
+            matches.append(verdict == candidate_verdict)
+            task_matches.setdefault(task, []).append(verdict == candidate_verdict)
+            prob_diffs.append(abs(prob - candidate_prob))
+
+    if not matches:
+        raise ValueError("No predictions to compare")
+
+    return {
+        "num_inputs": len(reference),
+        "agreement": sum(matches) / len(matches),
+        "task_agreement": {
+            task: sum(task_match) / len(task_match)
+            for task, task_match in task_matches.items()
+        },
+        "mean_prob_diff": sum(prob_diffs) / len(prob_diffs),
+        "max_prob_diff": max(prob_diffs),
+    }
+
+
+def get_label_accuracy(
+    dataset: List[Dict[str, str]], results: List[Dict[str, Tuple[float, bool]]]
+) -> Optional[Dict[str, float]]:
+    """
+    Computes the accuracy and the recall of each task against the labels of a dataset.
+
+    Returns:
+        Optional[Dict[str, float]]: The accuracy and per-task recall, or None if the dataset has no labels.
+    """
+
+    labeled = [
+        (example["label"], result)
+        for example, result in zip(dataset, results)
+        if example.get("label")
+    ]
+    if not labeled:
+        return None
+
+    correct, recalls = 0, {}
+    for label, result in labeled:
+        positives = {task for task, (_, verdict) in result.items() if verdict}
+        correct += positives == ({label} & set(result))
+        if label in result:
+            recalls.setdefault(label, []).append(label in positives)
+
+    metrics = {"accuracy": correct / len(labeled)}
+    for task, hits in recalls.items():
+        metrics[f"{task}_recall"] = sum(hits) / len(hits)
+
+    return metrics
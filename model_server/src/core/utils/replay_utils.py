@@ -0,0 +1,236 @@
+import json
+import time
+import itertools
+import threading
+import src.commons.utils as utils
+
+from typing import Any, Dict, List, Optional
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from src.core.utils.model_utils import OpenAIClientProxy, get_request_key
+
+
+logger = utils.get_model_server_logger()
+
+
+# recording clients of different upstreams append to the same file through one handle
+_record_files = {}
+_record_files_lock = threading.Lock()
+
+
+def _open_record_file(record_path: str):
+    with _record_files_lock:
+        if record_path not in _record_files:
+            _record_files[record_path] = (
+                open(record_path, "a", encoding="utf-8"),
+                threading.Lock(),
+            )
+        return _record_files[record_path]
+
+
+class RecordingClient(OpenAIClientProxy):
+    """
+    Wraps an OpenAI client and records every upstream response to a JSONL file.
+
+    Each line holds one response. Streaming responses are stored as a list of
+    `[delay, content, top_logprobs]` chunks, where `delay` is the time in seconds
+    since the previous chunk (or since the request was sent for the first chunk).
+    """
+
+    def __init__(self, client, record_path: str):
+        """
+        Initializes the recording client.
+
+        Args:
+            client (OpenAI): The OpenAI client to forward requests to.
+            record_path (str): Path of the JSONL file to append recordings to.
+        """
+
+        super().__init__()
+
+        self.client = client
+        self.record_path = record_path
+
+        self._file, self._lock = _open_record_file(record_path)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def _create(self, **kwargs):
+        key = get_request_key(kwargs)
+        start_time = time.perf_counter()
+        response = self.client.chat.completions.create(**kwargs)
+
+        if not kwargs.get("stream", False):
+            self._write(
+                {
+                    "key": key,
+                    "model": kwargs.get("model", ""),
+                    "stream": False,
+                    "latency": round(time.perf_counter() - start_time, 6),
+                    "content": response.choices[0].message.content,
+                }
+            )
+            return response
+
+        return self._record_stream(key, kwargs.get("model", ""), response, start_time)
+
+    def _record_stream(self, key, model, response, start_time):
+        chunks = []
+        last_time = start_time
+
+        try:
+            for chunk in response:
+                if type(chunk) is tuple:
+                    # a flat (token, top logprobs) pair from `RawStreamClient`
+                    now = time.perf_counter()
+                    chunks.append([round(now - last_time, 6), *chunk])
+                    last_time = now
+                # chunks without choices (e.g., usage) carry nothing to replay
+                elif len(chunk.choices) > 0:
+                    now = time.perf_counter()
+
+                    content, top_logprobs = chunk.choices[0].delta.content, None
+                    logprobs = chunk.choices[0].logprobs
+                    if logprobs is not None and logprobs.content:
+                        top_logprobs = [
+                            p.logprob for p in logprobs.content[0].top_logprobs
+                        ]
+
+                    chunks.append([round(now - last_time, 6), content, top_logprobs])
+                    last_time = now
+
+                yield chunk
+        finally:
+            # also reached when the consumer stops reading early (e.g., hallucination)
+            self._write({"key": key, "model": model, "stream": True, "chunks": chunks})
+
+
+class ReplayClient(OpenAIClientProxy):
+    """
+    A drop-in replacement for the OpenAI client that serves responses recorded by `RecordingClient`.
+
+    Recordings are matched by request fingerprint. Requests without a matching recording
+    are served the recordings in file order, so a capture can be replayed against a
+    modified prompt layout as well.
+    """
+
+    def __init__(self, record_path: str, speed: float = 1.0):
+        """
+        Initializes the replay client.
+
+        Args:
+            record_path (str): Path of the JSONL file produced by `RecordingClient`.
+            speed (float, optional): Playback speed relative to the recorded timing. `0` replays as fast as possible. Defaults to 1.0.
+        """
+
+        super().__init__()
+
+        self.record_path = record_path
+        self.speed = speed
+
+        self.records: List[Dict[str, Any]] = []
+        with open(record_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self.records.append(json.loads(line))
+
+        if not self.records:
+            raise ValueError(f"No recordings found in {record_path}")
+
+        self._lock = threading.Lock()
+        self._records_by_key: Dict[str, itertools.cycle] = {}
+        for key in {record["key"] for record in self.records}:
+            self._records_by_key[key] = itertools.cycle(
+                [record for record in self.records if record["key"] == key]
+            )
+        self._fallback_records = {
+            stream: itertools.cycle(
+                [record for record in self.records if record["stream"] == stream]
+                or [None]
+            )
+            for stream in (True, False)
+        }
+
+        logger.info(
+            f"[Replay]: loaded {len(self.records)} recordings from {record_path} (speed: {speed})"
+        )
+
+    def _sleep(self, delay: float):
+        if self.speed > 0 and delay > 0:
+            time.sleep(delay / self.speed)
+
+    def _find_record(self, key: str, stream: bool) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key in self._records_by_key:
+                return next(self._records_by_key[key])
+            return next(self._fallback_records[stream])
+
+    def _create(self, **kwargs):
+        stream = kwargs.get("stream", False)
+        model = kwargs.get("model", "")
+
+        record = self._find_record(get_request_key(kwargs), stream)
+        if record is None:
+            raise ValueError(
+                f"No {'streaming' if stream else 'non-streaming'} recording to replay"
+            )
+
+        if not stream:
+            self._sleep(record["latency"])
+            return ChatCompletion.model_validate(
+                {
+                    "id": "replay",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {
+                                "role": "assistant",
+                                "content": record["content"],
+                            },
+                        }
+                    ],
+                }
+            )
+
+        return self._replay_stream(record, model)
+
+    def _replay_stream(self, record: Dict[str, Any], model: str):
+        created = int(time.time())
+
+        for delay, content, top_logprobs in record["chunks"]:
+            self._sleep(delay)
+
+            choice = {"index": 0, "delta": {"content": content}}
+            if top_logprobs is not None:
+                choice["logprobs"] = {
+                    "content": [
+                        {
+                            "token": content or "",
+                            "logprob": top_logprobs[0],
+                            "top_logprobs": [
+                                {"token": "", "logprob": logprob}
+                                for logprob in top_logprobs
+                            ],
+                        }
+                    ]
+                }
+
+            yield ChatCompletionChunk.model_validate(
+                {
+                    "id": "replay",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [choice],
+                }
+            )
@@ -0,0 +1,77 @@
+import re
+
+from typing import Optional, Tuple
+
+
+# the response shapes of the format prompt, identified by their first key
+ROUTING_BRANCH_PATTERN = re.compile(
+    r'"?(tool_calls|required_functions|clarification|response)"\s*:'
+)
+
+
+def find_object_end(text: str, start: int) -> int:
+    """
+    Finds the end of the JSON object that opens at `text[start]`.
+
+    Args:
+        text (str): The text containing the object.
+        start (int): The index of the opening brace.
+
+    Returns:
+        int: The index following the closing brace, or -1 if the object is not complete yet.
+    """
+
+    depth, in_string, escaped = 0, False, False
+    for idx in range(start, len(text)):
+        char = text[idx]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return idx + 1
+    return -1
+
+
+def get_routing_decision(text: str) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    Decides the routing of a partial model response as early as possible.
+
+    The response shape is known from its first key. For tool calls the decision is only made
+    once the first call, including its arguments object, is complete.
+
+    Args:
+        text (str): The model response received so far.
+
+    Returns:
+        Optional[Tuple[str, Optional[str]]]: The first key of the response and the text of the first
+            tool call (None for other shapes or an empty call list), or None if more text is needed.
+    """
+
+    match = ROUTING_BRANCH_PATTERN.search(text)
+    if match is None:
+        return None
+
+    branch = match.group(1)
+    if branch != "tool_calls":
+        return branch, None
+
+    calls = re.compile(r"\s*\[\s*(\{|\])").match(text, match.end())
+    if calls is None:
+        return None
+    if calls.group(1) == "]":
+        return branch, None
+
+    end = find_object_end(text, calls.start(1))
+    if end == -1:
+        return None
+    return branch, text[calls.start(1) : end]
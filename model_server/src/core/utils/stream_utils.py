@@ -0,0 +1,117 @@
+import orjson
+
+from typing import Iterable, Iterator, List, Optional, Tuple
+from openai import APIError
+from src.core.utils.model_utils import OpenAIClientProxy
+
+
+# a streamed token and the log probabilities of its top candidates
+StreamToken = Tuple[str, Optional[List[float]]]
+
+
+def parse_sse_lines(lines: Iterable[str]) -> Iterator[StreamToken]:
+    """
+    Parses the server-sent events of a streamed chat completion into flat tokens.
+
+    Only the content and the top log probabilities of the first choice are read, so no
+    per-chunk response objects are built.
+
+    Args:
+        lines (Iterable[str]): The lines of the event stream.
+
+    Yields:
+        StreamToken: The content of each non-empty chunk and its top log probabilities, or None if
+            the upstream did not return log probabilities.
+    """
+
+    for line in lines:
+        if not line.startswith("data:"):
+            continue
+
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+
+        chunk = orjson.loads(data)
+        if "error" in chunk:
+            raise APIError(
+                message=str(chunk["error"].get("message", "")),
+                request=None,
+                body=chunk["error"],
+            )
+
+        choices = chunk.get("choices")
+        if not choices:
+            continue
+
+        content = (choices[0].get("delta") or {}).get("content")
+        if not content:
+            continue
+
+        top_logprobs = None
+        logprobs = choices[0].get("logprobs")
+        if logprobs and logprobs.get("content"):
+            top_logprobs = [
+                p["logprob"] for p in logprobs["content"][0]["top_logprobs"]
+            ]
+
+        yield content, top_logprobs
+
+
+def get_stream_content(chunk) -> Optional[str]:
+    """
+    Returns the content of a streamed chunk, either a `StreamToken` or an OpenAI chunk.
+    """
+
+    if type(chunk) is tuple:
+        return chunk[0]
+    if len(chunk.choices) > 0:
+        return chunk.choices[0].delta.content
+    return None
+
+
+class RawStreamClient(OpenAIClientProxy):
+    """
+    A drop-in replacement for the OpenAI client whose streams yield `StreamToken` tuples.
+
+    Streamed responses are read as raw server-sent events and parsed with `parse_sse_lines`
+    instead of being validated into an OpenAI chunk object (with one object per top log
+    probability) for every token. Requests are still built and sent by the wrapped client,
+    and other requests are forwarded to it unchanged.
+    """
+
+    def __init__(self, client):
+        """
+        Initializes the raw stream client.
+
+        Args:
+            client (OpenAI): The OpenAI client to send requests with.
+        """
+
+        super().__init__()
+
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _create(self, **kwargs):
+        if not kwargs.get("stream", False):
+            return self.client.chat.completions.create(**kwargs)
+
+        # the request is sent before returning, so that connection errors are raised here
+        response = self.client.chat.completions.with_streaming_response.create(
+            **kwargs
+        ).__enter__()
+        stream = self._stream(response)
+        # enter the generator, so that closing or dropping it before reading it still closes the response
+        next(stream)
+        return stream
+
+    def _stream(self, response) -> Iterator[StreamToken]:
+        try:
+            yield
+            yield from parse_sse_lines(response.iter_lines())
+        finally:
+            # also reached when the consumer stops reading early, which closes the connection
+            response.close()
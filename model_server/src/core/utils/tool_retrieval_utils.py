@@ -0,0 +1,211 @@
+import re
+import json
+import collections
+import numpy as np
+import src.commons.utils as utils
+
+from typing import Any, Dict, List, Set
+from src.core.utils.model_utils import Message, get_request_key
+
+
+logger = utils.get_model_server_logger()
+
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do for from get i in is it me my of on or the to "
+    "what with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lowercase terms, breaking up snake_case and camelCase identifiers.
+    """
+
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text).lower()
+    return [term for term in re.findall(r"[a-z0-9]+", text) if term not in STOP_WORDS]
+
+
+def get_tool_text(tool: Dict[str, Any]) -> str:
+    """
+    Returns the searchable text of a tool: its name, description, and the names,
+    descriptions and enum values of its parameters.
+    """
+
+    function = tool.get("function", tool)
+    parts = [function.get("name", ""), function.get("description", "")]
+
+    properties = (function.get("parameters") or {}).get("properties") or {}
+    for name, schema in properties.items():
+        parts.append(name)
+        if isinstance(schema, dict):
+            parts.append(str(schema.get("description", "")))
+            parts.extend(str(value) for value in schema.get("enum", []))
+
+    return " ".join(parts)
+
+
+class BM25ToolIndex:
+    """
+    A BM25 index over a tool catalog, scored with NumPy.
+
+    The BM25 weight of every (tool, term) pair is precomputed, so a query only sums the
+    columns of its terms.
+    """
+
+    def __init__(self, tools: List[Dict[str, Any]], k1: float = 1.2, b: float = 0.75):
+        """
+        Builds the index.
+
+        Args:
+            tools (List[Dict[str, Any]]): The tools to index.
+            k1 (float, optional): The term frequency saturation. Defaults to 1.2.
+            b (float, optional): The document length normalization. Defaults to 0.75.
+        """
+
+        documents = [tokenize(get_tool_text(tool)) for tool in tools]
+
+        self.vocabulary = {}
+        for document in documents:
+            for term in document:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+
+        term_frequencies = np.zeros(
+            (len(documents), len(self.vocabulary)), dtype=np.float32
+        )
+        for row, document in enumerate(documents):
+            for term, count in collections.Counter(document).items():
+                term_frequencies[row, self.vocabulary[term]] = count
+
+        document_frequencies = (term_frequencies > 0).sum(axis=0)
+        idf = np.log(
+            1
+            + (len(documents) - document_frequencies + 0.5)
+            / (document_frequencies + 0.5)
+        )
+
+        lengths = term_frequencies.sum(axis=1, keepdims=True)
+        norms = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        self.weights = idf * term_frequencies * (k1 + 1) / (term_frequencies + norms)
+
+    def search(self, query: str, top_k: int) -> List[int]:
+        """
+        Returns the indices of the `top_k` tools that best match the query, best first.
+        """
+
+        terms = collections.Counter(
+            self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary
+        )
+        scores = np.zeros(self.weights.shape[0], dtype=np.float32)
+        for term_id, count in terms.items():
+            scores += count * self.weights[:, term_id]
+
+        # stable sort, so ties keep the order of the catalog
+        return np.argsort(-scores, kind="stable")[:top_k].tolist()
+
+
+def get_called_tool_names(messages: List[Message]) -> Set[str]:
+    """
+    Collects the names of the tools called by earlier assistant messages.
+
+    Tool calls are read from `tool_calls`, and from contents holding the model's own
+    `{"tool_calls": [...]}` response, optionally fenced as a JSON code block.
+
+    Args:
+        messages (List[Message]): The messages of the conversation.
+
+    Returns:
+        Set[str]: The names of the called tools.
+    """
+
+    names = set()
+    for message in messages:
+        if message.role != "assistant":
+            continue
+
+        for tool_call in message.tool_calls or []:
+            names.add(tool_call.get("function", {}).get("name"))
+
+        content = (message.content or "").strip()
+        if content.startswith("```") and content.endswith("```"):
+            content = content.strip("```").strip()
+            if content.startswith("json"):
+                content = content[4:].strip()
+        if not content.startswith("{"):
+            continue
+
+        try:
+            tool_calls = json.loads(content).get("tool_calls") or []
+        except (ValueError, AttributeError):
+            continue
+        for tool_call in tool_calls if isinstance(tool_calls, list) else []:
+            if isinstance(tool_call, dict):
+                names.add(tool_call.get("name"))
+
+    names.discard(None)
+    return names
+
+
+class ToolSelector:
+    """
+    Preselects the tools relevant to a conversation so that only those are put into the prompt.
+
+    Indices are built once per tool catalog and cached. Tools that were already called in the
+    conversation are always kept, so follow-up turns can still fill in their parameters.
+    """
+
+    def __init__(self, top_k: int, query_turns: int = 2, max_indices: int = 64):
+        """
+        Initializes the selector.
+
+        Args:
+            top_k (int): The number of retrieved tools.
+            query_turns (int, optional): The number of most recent user messages used as the query. Defaults to 2.
+            max_indices (int, optional): The number of tool catalogs whose index is cached. Defaults to 64.
+        """
+
+        self.top_k = top_k
+        self.query_turns = query_turns
+        self.max_indices = max_indices
+        self._indices = collections.OrderedDict()
+
+    def _get_index(self, tools: List[Dict[str, Any]]) -> BM25ToolIndex:
+        key = get_request_key({"tools": tools})
+        if key in self._indices:
+            self._indices.move_to_end(key)
+        else:
+            self._indices[key] = BM25ToolIndex(tools)
+            if len(self._indices) > self.max_indices:
+                self._indices.popitem(last=False)
+        return self._indices[key]
+
+    def select(
+        self, messages: List[Message], tools: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Selects the tools to put into the prompt.
+
+        Args:
+            messages (List[Message]): The messages of the conversation.
+            tools (List[Dict[str, Any]]): The tool catalog of the request.
+
+        Returns:
+            List[Dict[str, Any]]: The selected tools, in catalog order.
+        """
+
+        if not tools or len(tools) <= self.top_k:
+            return tools
+
+        user_messages = [m.content for m in messages if m.role == "user" and m.content]
+        query = " ".join(user_messages[-self.query_turns :])
+        selected = set(self._get_index(tools).search(query, self.top_k))
+
+        # keep the tools called earlier in the conversation
+        called_tool_names = get_called_tool_names(messages)
+        for idx, tool in enumerate(tools):
+            if tool.get("function", tool).get("name") in called_tool_names:
+                selected.add(idx)
+
+        logger.info(f"[Tool selection]: selected {len(selected)} of {len(tools)} tools")
+
+        return [tool for idx, tool in enumerate(tools) if idx in selected]
@@ -0,0 +1,520 @@
+import time
+import httpx
+import threading
+import collections
+import src.commons.utils as utils
+
+from openai import OpenAI, APIConnectionError, InternalServerError
+from typing import List, Tuple
+from src.commons.metrics import REGISTRY
+from src.core.utils.model_utils import OpenAIClientProxy
+from src.core.utils.stream_utils import RawStreamClient
+
+
+logger = utils.get_model_server_logger()
+
+
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "arch_upstream_requests_total", "Upstream requests by endpoint and outcome."
+)
+UPSTREAM_OUTSTANDING = REGISTRY.gauge(
+    "arch_upstream_outstanding_requests", "Requests in flight per upstream endpoint."
+)
+UPSTREAM_HEALTHY = REGISTRY.gauge(
+    "arch_upstream_healthy", "Whether an upstream endpoint is receiving traffic."
+)
+UPSTREAM_TTFT = REGISTRY.histogram(
+    "arch_upstream_time_to_first_token_seconds",
+    "Time to the first streamed chunk per upstream endpoint.",
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "arch_upstream_latency_seconds", "Total response time per upstream endpoint."
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "arch_upstream_circuit_open", "Whether the upstream circuit breaker is open."
+)
+CIRCUIT_REJECTED = REGISTRY.counter(
+    "arch_upstream_circuit_rejected_total",
+    "Requests failed fast while the upstream circuit breaker is open.",
+)
+ADAPTIVE_TIMEOUT = REGISTRY.gauge(
+    "arch_upstream_adaptive_timeout_seconds",
+    "Current time to first token timeout for streaming upstream requests.",
+)
+
+# errors that indicate a degraded upstream rather than a bad request
+UPSTREAM_FAILURES = (APIConnectionError, InternalServerError, httpx.TransportError)
+
+
+def parse_endpoints(endpoints: str) -> List[Tuple[str, float]]:
+    """
+    Parses a comma separated list of upstream endpoints with optional weights.
+
+    Args:
+        endpoints (str): Endpoints in the form of `url[|weight],url[|weight],...`, e.g., `http://a:8000/v1|2,http://b:8000/v1`.
+
+    Returns:
+        List[Tuple[str, float]]: A list of (base url, weight) pairs.
+    """
+
+    parsed = []
+    for endpoint in endpoints.split(","):
+        endpoint = endpoint.strip()
+        if not endpoint:
+            continue
+
+        base_url, _, weight = endpoint.partition("|")
+        weight = float(weight) if weight else 1.0
+        if weight <= 0:
+            raise ValueError(f"Weight of {base_url} must be positive, got {weight}")
+        parsed.append((base_url.strip(), weight))
+
+    return parsed
+
+
+class UpstreamEndpoint:
+    def __init__(
+        self, base_url: str, weight: float, api_key: str, raw_stream: bool = False
+    ):
+        self.base_url = base_url
+        self.weight = weight
+        # retries are handled by the pool so that they can go to another replica
+        self.client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        if raw_stream:
+            self.client = RawStreamClient(self.client)
+
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+
+
+class UpstreamPool(OpenAIClientProxy):
+    """
+    A pool of OpenAI compatible upstream endpoints that can be used in place of an OpenAI client.
+
+    Requests are routed to the healthy endpoint with the fewest outstanding requests relative
+    to its weight. Endpoints are ejected after consecutive connection or health check failures
+    and are re-admitted once an active health check succeeds again. Connection errors that
+    happen before the first token are retried on another endpoint.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Tuple[str, float]],
+        api_key: str,
+        health_check_interval: float = 10.0,
+        max_failures: int = 3,
+        raw_stream: bool = False,
+    ):
+        """
+        Initializes the upstream pool.
+
+        Args:
+            endpoints (List[Tuple[str, float]]): A list of (base url, weight) pairs.
+            api_key (str): The API key used for all endpoints.
+            health_check_interval (float, optional): Seconds between active health checks, `0` disables them. Defaults to 10.0.
+            max_failures (int, optional): Consecutive failures before an endpoint is ejected. Defaults to 3.
+            raw_stream (bool, optional): Whether streams yield flat tokens, see `RawStreamClient`. Defaults to False.
+        """
+
+        if not endpoints:
+            raise ValueError("At least one upstream endpoint is required")
+
+        super().__init__()
+
+        self.endpoints = [
+            UpstreamEndpoint(base_url, weight, api_key, raw_stream)
+            for base_url, weight in endpoints
+        ]
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+
+        self._lock = threading.Lock()
+
+        for endpoint in self.endpoints:
+            UPSTREAM_HEALTHY.set(1, endpoint=endpoint.base_url)
+            UPSTREAM_OUTSTANDING.set(0, endpoint=endpoint.base_url)
+
+        if self.health_check_interval > 0:
+            threading.Thread(target=self._health_check_loop, daemon=True).start()
+
+    def _select_endpoint(self, excluded: List[UpstreamEndpoint]) -> UpstreamEndpoint:
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if ep not in excluded]
+            healthy = [ep for ep in candidates if ep.healthy]
+            # fall back to ejected endpoints rather than failing when none is healthy
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+
+            endpoint = min(candidates, key=lambda ep: (ep.outstanding + 1) / ep.weight)
+            endpoint.outstanding += 1
+
+        UPSTREAM_OUTSTANDING.inc(endpoint=endpoint.base_url)
+        return endpoint
+
+    def _release_endpoint(self, endpoint: UpstreamEndpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+        UPSTREAM_OUTSTANDING.dec(endpoint=endpoint.base_url)
+
+    def _record_success(self, endpoint: UpstreamEndpoint):
+        with self._lock:
+            endpoint.consecutive_failures = 0
+            if not endpoint.healthy:
+                logger.info(f"[Upstream]: {endpoint.base_url} is healthy again")
+            endpoint.healthy = True
+        UPSTREAM_HEALTHY.set(1, endpoint=endpoint.base_url)
+
+    def _record_failure(self, endpoint: UpstreamEndpoint, error: Exception):
+        with self._lock:
+            endpoint.consecutive_failures += 1
+            ejected = (
+                endpoint.healthy and endpoint.consecutive_failures >= self.max_failures
+            )
+            if ejected:
+                endpoint.healthy = False
+
+        if ejected:
+            logger.warning(f"[Upstream]: ejecting {endpoint.base_url}: {error}")
+            UPSTREAM_HEALTHY.set(0, endpoint=endpoint.base_url)
+
+    def _health_check_loop(self):
+        while True:
+            time.sleep(self.health_check_interval)
+            for endpoint in self.endpoints:
+                self.check_health(endpoint)
+
+    def check_health(self, endpoint: UpstreamEndpoint) -> bool:
+        """
+        Actively probes an endpoint by listing its models.
+
+        Returns:
+            bool: True if the endpoint responded successfully, False otherwise.
+        """
+
+        try:
+            endpoint.client.with_options(timeout=5.0).models.list()
+        except Exception as e:
+            self._record_failure(endpoint, e)
+            return False
+
+        self._record_success(endpoint)
+        return True
+
+    def _create(self, **kwargs):
+        stream = kwargs.get("stream", False)
+        tried, last_error = [], None
+
+        while True:
+            endpoint = self._select_endpoint(tried)
+            if endpoint is None:
+                raise last_error
+
+            start_time = time.perf_counter()
+            try:
+                response = endpoint.client.chat.completions.create(**kwargs)
+                if stream:
+                    # connection errors before the first token are safe to retry
+                    chunks = iter(response)
+                    first_chunk = next(chunks, None)
+            except (APIConnectionError, httpx.TransportError) as e:
+                self._release_endpoint(endpoint)
+                self._record_failure(endpoint, e)
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint.base_url, status="retry")
+                logger.warning(
+                    f"[Upstream]: connection to {endpoint.base_url} failed, retrying on another endpoint: {e}"
+                )
+                tried.append(endpoint)
+                last_error = e
+                continue
+            except Exception:
+                self._release_endpoint(endpoint)
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint.base_url, status="error")
+                raise
+
+            self._record_success(endpoint)
+
+            if not stream:
+                self._release_endpoint(endpoint)
+                UPSTREAM_LATENCY.observe(
+                    time.perf_counter() - start_time, endpoint=endpoint.base_url
+                )
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint.base_url, status="success")
+                return response
+
+            UPSTREAM_TTFT.observe(
+                time.perf_counter() - start_time, endpoint=endpoint.base_url
+            )
+            stream = self._stream(endpoint, first_chunk, response, chunks, start_time)
+            # enter the generator, so that closing it before reading it still releases the endpoint
+            next(stream)
+            return stream
+
+    def _stream(
+        self, endpoint: UpstreamEndpoint, first_chunk, response, chunks, start_time
+    ):
+        status = "error"
+        try:
+            yield
+            if first_chunk is not None:
+                yield first_chunk
+            yield from chunks
+            status = "success"
+        except GeneratorExit:
+            # the consumer stopped reading early (e.g., hallucination), so stop the upstream generation.
+            # `response` is the stream returned by the client, whose iterator does not own the connection
+            status = "success"
+            if hasattr(response, "close"):
+                response.close()
+            raise
+        finally:
+            self._release_endpoint(endpoint)
+            UPSTREAM_LATENCY.observe(
+                time.perf_counter() - start_time, endpoint=endpoint.base_url
+            )
+            UPSTREAM_REQUESTS.inc(endpoint=endpoint.base_url, status=status)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a request is rejected because the upstream circuit breaker is open.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            f"upstream circuit breaker is open, retry after {retry_after:.1f}s"
+        )
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    A consecutive-failure circuit breaker.
+
+    The circuit opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds. It then lets a single trial call through (half-open),
+    closing again on success or re-opening on failure. A trial that reports no outcome
+    within `trial_timeout` seconds re-opens the circuit as well.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        trial_timeout: float = None,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = reset_timeout if trial_timeout is None else trial_timeout
+
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Checks whether a call may proceed.
+
+        Raises:
+            CircuitOpenError: If the circuit is open or a half-open trial call is already in flight.
+        """
+
+        with self._lock:
+            if self.state == "closed":
+                return
+
+            now = time.monotonic()
+            if (
+                self.state == "half_open"
+                and now - self.trial_started_at >= self.trial_timeout
+            ):
+                logger.warning(
+                    "[Circuit breaker]: trial call did not complete, opening circuit"
+                )
+                self.state = "open"
+                self.opened_at = now
+
+            elapsed = now - self.opened_at
+            if self.state == "open" and elapsed >= self.reset_timeout:
+                self.state = "half_open"
+                self.trial_started_at = now
+                return
+
+            retry_after = max(self.reset_timeout - elapsed, 1.0)
+
+        CIRCUIT_REJECTED.inc()
+        raise CircuitOpenError(retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("[Circuit breaker]: upstream recovered, closing circuit")
+            self.state = "closed"
+            self.consecutive_failures = 0
+        CIRCUIT_STATE.set(0)
+
+    def cancel_trial(self):
+        """
+        Lets the next call through as the trial if the trial call ended without an outcome,
+        e.g., because its stream was closed before the first chunk.
+        """
+
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed"
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+
+        if opened:
+            logger.warning(f"[Circuit breaker]: opening circuit: {error}")
+            CIRCUIT_STATE.set(1)
+
+
+class AdaptiveTimeout:
+    """
+    A timeout derived from a percentile of recently observed time-to-first-token samples.
+
+    The timeout is `multiplier * percentile(samples)`, clamped to `[min_timeout, max_timeout]`.
+    `max_timeout` is used until `min_samples` observations have been collected.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.99,
+        multiplier: float = 2.0,
+        min_timeout: float = 1.0,
+        max_timeout: float = 8.0,
+        window_size: int = 200,
+        min_samples: int = 20,
+    ):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+
+        self._samples = collections.deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+        ADAPTIVE_TIMEOUT.set(max_timeout)
+
+    def observe(self, ttft: float):
+        with self._lock:
+            self._samples.append(ttft)
+        ADAPTIVE_TIMEOUT.set(self.get_timeout())
+
+    def get_timeout(self) -> float:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.max_timeout
+            samples = sorted(self._samples)
+
+        index = min(int(self.percentile * len(samples)), len(samples) - 1)
+        timeout = samples[index] * self.multiplier
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+
+class ResilientClient(OpenAIClientProxy):
+    """
+    Wraps an OpenAI client with a circuit breaker and a latency-adaptive timeout.
+
+    Streaming requests wait at most `AdaptiveTimeout.get_timeout()` seconds for each chunk,
+    so a stalled upstream fails within a few multiples of its usual time to first token.
+    While the circuit is open, requests fail fast with `CircuitOpenError`.
+    """
+
+    def __init__(
+        self,
+        client,
+        circuit_breaker: CircuitBreaker,
+        adaptive_timeout: AdaptiveTimeout,
+        request_timeout: float = 60.0,
+    ):
+        """
+        Initializes the resilient client.
+
+        Args:
+            client (OpenAI): The OpenAI client to forward requests to.
+            circuit_breaker (CircuitBreaker): The circuit breaker guarding upstream calls.
+            adaptive_timeout (AdaptiveTimeout): The time-to-first-token based timeout for streaming requests.
+            request_timeout (float, optional): Timeout in seconds for non-streaming requests. Defaults to 60.0.
+        """
+
+        super().__init__()
+
+        self.client = client
+        self.circuit_breaker = circuit_breaker
+        self.adaptive_timeout = adaptive_timeout
+        self.request_timeout = request_timeout
+
+    def _create(self, **kwargs):
+        self.circuit_breaker.before_call()
+
+        stream = kwargs.get("stream", False)
+        timeout = (
+            self.adaptive_timeout.get_timeout() if stream else self.request_timeout
+        )
+
+        start_time = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(
+                **kwargs, timeout=httpx.Timeout(timeout)
+            )
+        except UPSTREAM_FAILURES as e:
+            self.circuit_breaker.record_failure(e)
+            raise
+        except Exception:
+            # any other error (e.g., a rejected request) means that the upstream responded
+            self.circuit_breaker.record_success()
+            raise
+
+        if not stream:
+            self.circuit_breaker.record_success()
+            return response
+
+        stream = self._stream(response, start_time)
+        # enter the generator, so that closing it before reading it still settles the call
+        next(stream)
+        return stream
+
+    def _stream(self, response, start_time):
+        settled = False
+        try:
+            yield
+            for chunk in response:
+                if not settled:
+                    settled = True
+                    self.adaptive_timeout.observe(time.perf_counter() - start_time)
+                    self.circuit_breaker.record_success()
+                yield chunk
+
+            if not settled:
+                settled = True
+                self.circuit_breaker.record_success()
+        except GeneratorExit:
+            if hasattr(response, "close"):
+                response.close()
+            raise
+        except UPSTREAM_FAILURES as e:
+            settled = True
+            self.circuit_breaker.record_failure(e)
+            raise
+        finally:
+            if not settled:
+                self.circuit_breaker.cancel_trial()
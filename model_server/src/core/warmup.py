@@ -0,0 +1,204 @@
+import copy
+import time
+import asyncio
+import collections
+import src.commons.utils as utils
+
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+from typing import Any, Dict, List
+from src.core.function_calling import ArchFunctionHandler
+from src.core.guard_pool import GuardProcessPool
+from src.core.guardrails import ArchGuardHanlder
+from src.core.utils.model_utils import ChatMessage, Message
+
+
+logger = utils.get_model_server_logger()
+
+
+# a tiny function calling request, which the probe sends through the handler
+PROBE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "get_current_time",
+        "description": "Get the current time in a timezone.",
+        "parameters": {
+            "type": "object",
+            "properties": {"timezone": {"type": "str"}},
+            "required": ["timezone"],
+        },
+    },
+}
+PROBE_MESSAGE = "What time is it in UTC?"
+
+
+def get_upstream_clients(client) -> List[OpenAI]:
+    """
+    Unwraps a handler's client down to the OpenAI clients that hold the upstream connections.
+
+    Args:
+        client: An OpenAI client or one of the proxies wrapping it, e.g., `ResilientClient` or `UpstreamPool`.
+
+    Returns:
+        List[OpenAI]: The OpenAI clients, none for clients without an upstream such as `ReplayClient`.
+    """
+
+    if isinstance(client, OpenAI):
+        return [client]
+
+    if hasattr(client, "endpoints"):
+        return [
+            upstream_client
+            for endpoint in client.endpoints
+            for upstream_client in get_upstream_clients(endpoint.client)
+        ]
+
+    # proxies keep the client they wrap as `client`
+    if "client" in getattr(client, "__dict__", {}):
+        return get_upstream_clients(client.client)
+
+    return []
+
+
+def open_upstream_connections(client: OpenAI, num_connections: int = 4):
+    """
+    Opens connections to an upstream, which its client keeps alive for the first requests.
+
+    Args:
+        client (OpenAI): The client of the upstream.
+        num_connections (int, optional): The number of concurrent connections to open. Defaults to 4.
+    """
+
+    # concurrent requests each need their own connection
+    with ThreadPoolExecutor(num_connections) as executor:
+        list(
+            executor.map(
+                lambda _: client.with_options(timeout=5.0).models.list(),
+                range(num_connections),
+            )
+        )
+
+
+def warm_up_guard(handler: ArchGuardHanlder, guard_pool: GuardProcessPool = None):
+    """
+    Runs synthetic guard batches of each length bucket in the handler, and in every replica if
+    the guard is served by a pool.
+
+    The batches are classified directly, so the verdict cache is left untouched.
+    """
+
+    # the handler also serves the guard sessions when the guard is served by a pool
+    handler.warmup()
+
+    if guard_pool is None:
+        return
+
+    # the pool dispatches to the least loaded replica, so each replica gets one warm-up
+    futures = [guard_pool.submit("warmup") for _ in range(guard_pool.num_replicas)]
+    for future in futures:
+        future.result()
+
+
+def probe_function_calling(handler: ArchFunctionHandler, client: OpenAI):
+    """
+    Sends a function calling request through the handler's prompt processing, generation and
+    parsing, directly to an upstream.
+
+    The probe runs on a copy of the handler that talks to the upstream client without its
+    proxies, so it is not recorded and does not count towards the circuit breaker or adaptive
+    timeout, and that does not cache the processed messages.
+
+    Args:
+        handler (ArchFunctionHandler): The function calling handler.
+        client (OpenAI): The client of one of the handler's upstreams.
+    """
+
+    probe_handler = copy.copy(handler)
+    probe_handler.client = client.with_options(max_retries=0)
+    probe_handler.cascade_model_name = None
+    probe_handler.message_cache_size = 0
+    probe_handler.message_cache = collections.OrderedDict()
+
+    req = ChatMessage(
+        messages=[Message(role="user", content=PROBE_MESSAGE)], tools=[PROBE_TOOL]
+    )
+    messages = probe_handler._process_messages(req.messages, req.tools)
+    probe_handler._generate(req, messages)
+
+
+async def warm_up(
+    handler_map: Dict[str, Any],
+    guard_pool: GuardProcessPool = None,
+    num_connections: int = 4,
+    timeout: float = 30.0,
+) -> float:
+    """
+    Warms up the model server before it reports readiness.
+
+    The first requests after a restart would otherwise pay for connecting to the upstreams,
+    the lazy initialization of the guard models and tokenizers, and the first function calling
+    request. Failed steps are logged and skipped, so an unavailable upstream does not keep the
+    server from starting.
+
+    Args:
+        handler_map (Dict[str, Any]): The model handlers.
+        guard_pool (GuardProcessPool, optional): The guard replicas, if the guard is served by a pool. Defaults to None.
+        num_connections (int, optional): The number of connections opened to each upstream. Defaults to 4.
+        timeout (float, optional): The maximum duration of each step in seconds. Defaults to 30.0.
+
+    Returns:
+        float: The duration of the warm-up in seconds.
+    """
+
+    start_time = time.perf_counter()
+
+    async def run_step(name, awaitable):
+        step_start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(awaitable, timeout)
+        except Exception as e:
+            logger.warning(f"[Warm-up]: {name} failed: {e!r}")
+            return
+        logger.info(
+            f"[Warm-up]: {name} took {time.perf_counter() - step_start_time:.3f}s"
+        )
+
+    # handlers may share their clients, whose connections are only opened once
+    upstream_clients = []
+    for handler in handler_map.values():
+        for client in (
+            getattr(handler, "client", None),
+            getattr(handler, "cascade_client", None),
+        ):
+            for upstream_client in get_upstream_clients(client):
+                if upstream_client not in upstream_clients:
+                    upstream_clients.append(upstream_client)
+
+    for upstream_client in upstream_clients:
+        await run_step(
+            f"connecting to {upstream_client.base_url}",
+            asyncio.to_thread(
+                open_upstream_connections, upstream_client, num_connections
+            ),
+        )
+
+    guard_handler = handler_map.get("Arch-Guard")
+    if isinstance(guard_handler, ArchGuardHanlder):
+        await run_step(
+            "guard batches",
+            asyncio.to_thread(warm_up_guard, guard_handler, guard_pool),
+        )
+
+    function_handler = handler_map.get("Arch-Function")
+    if isinstance(function_handler, ArchFunctionHandler):
+        for upstream_client in get_upstream_clients(function_handler.client):
+            await run_step(
+                f"function calling probe to {upstream_client.base_url}",
+                asyncio.to_thread(
+                    probe_function_calling, function_handler, upstream_client
+                ),
+            )
+
+    duration = time.perf_counter() - start_time
+    logger.info(f"[Warm-up]: took {duration:.3f}s")
+    return duration
@@ -1,19 +1,39 @@
-import json
+import math
 import os
 import time
 import logging
 import src.commons.utils as utils
 
-from src.commons.globals import ARCH_ENDPOINT, handler_map
+from contextlib import asynccontextmanager
+from src.commons.admission import QueueFullError
+from src.commons.globals import (
+    ARCH_ENDPOINTS,
+    ARCH_WARMUP,
+    ARCH_WARMUP_CONNECTIONS,
+    ARCH_WARMUP_TIMEOUT,
+    admission_controller,
+    guard_pool,
+    handler_map,
+)
+from src.commons.metrics import REGISTRY
+from src.commons.serialization import json_response
 from src.core.function_calling import ArchFunctionHandler
+from src.core.warmup import warm_up
+from src.core.utils.upstream_utils import CircuitOpenError
 from src.core.utils.model_utils import (
     ChatMessage,
     ChatCompletionResponse,
+    GuardBatchRequest,
+    GuardBatchResponse,
     GuardRequest,
     GuardResponse,
+    GuardSessionAppendRequest,
+    GuardSessionRequest,
+    GuardSessionResponse,
 )
 
 from fastapi import FastAPI, Response
+from fastapi.responses import PlainTextResponse
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
@@ -49,29 +69,80 @@ logging.getLogger("opentelemetry.exporter.otlp.proto.grpc.exporter").setLevel(
     logging.ERROR
 )
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # uvicorn only starts listening after the startup, so the health check passes once warm
+    if ARCH_WARMUP:
+        await warm_up(
+            handler_map,
+            guard_pool,
+            num_connections=ARCH_WARMUP_CONNECTIONS,
+            timeout=ARCH_WARMUP_TIMEOUT,
+        )
+    yield
+    # in-flight requests have been drained when the app shuts down
+    if guard_pool is not None:
+        guard_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
 FastAPIInstrumentor().instrument_app(app)
 
-logger.info(f"using archfc endpoint: {ARCH_ENDPOINT}")
+logger.info(
+    f"using archfc endpoints: {', '.join(base_url for base_url, _ in ARCH_ENDPOINTS)}"
+)
 
 
 @app.get("/healthz")
-async def healthz():
-    return {"status": "ok"}
+async def healthz(res: Response):
+    # a restarted server shares its port with the previous one, see `src.cli.restart_server`
+    res.headers["x-model-server-pid"] = str(os.getpid())
+    return json_response({"status": "ok"}, res)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return REGISTRY.render()
 
 
 @app.get("/models")
 async def models():
-    return {
-        "object": "list",
-        "data": [{"id": model_name, "object": "model"} for model_name in handler_map],
-    }
+    return json_response(
+        {
+            "object": "list",
+            "data": [
+                {"id": model_name, "object": "model"} for model_name in handler_map
+            ],
+        }
+    )
 
 
-@app.post("/function_calling")
+# responses are returned as `FastJSONResponse`, the response models only document the endpoints
+@app.post("/function_calling", response_model=ChatCompletionResponse)
 async def function_calling(req: ChatMessage, res: Response):
+    if admission_controller is None:
+        return json_response(await _function_calling(req, res), res)
+
+    priority = req.metadata.get("priority", admission_controller.default_priority)
+    try:
+        await admission_controller.acquire(priority)
+    except QueueFullError as e:
+        res.status_code = 429
+        res.headers["Retry-After"] = str(e.retry_after)
+        logger.warning(f"[Admission]: rejected {priority} request: {e}")
+        return json_response(ChatCompletionResponse(metadata={"error": str(e)}), res)
+
+    start_time = time.perf_counter()
+    try:
+        return json_response(await _function_calling(req, res), res)
+    finally:
+        admission_controller.release(time.perf_counter() - start_time)
+
+
+async def _function_calling(req: ChatMessage, res: Response):
     logger.info("[Endpoint: /function_calling]")
-    logger.info(f"[request body]: {json.dumps(req.model_dump(exclude_none=True))}")
+    logger.info(f"[request body]: {req.model_dump_json(exclude_none=True)}")
 
     final_response: ChatCompletionResponse = None
     error_messages = None
@@ -96,11 +167,6 @@ async def function_calling(req: ChatMessage, res: Response):
         # Function Calling
         elif final_response.choices[0].message.tool_calls:
             final_response.metadata["function_latency"] = str(round(latency * 1000, 3))
-
-            if not use_agent_orchestrator:
-                final_response.metadata["hallucination"] = str(
-                    model_handler.hallucination_state.hallucination
-                )
         # No intent detected
         else:
             final_response.metadata["intent_latency"] = str(round(latency * 1000, 3))
@@ -108,10 +174,11 @@ async def function_calling(req: ChatMessage, res: Response):
         if not use_agent_orchestrator:
             final_response.metadata["intent_latency"] = str(round(latency * 1000, 3))
 
-            final_response.metadata["hallucination"] = str(
-                model_handler.hallucination_state.hallucination
-            )
-
+    except CircuitOpenError as e:
+        # fail fast instead of waiting on a degraded upstream
+        res.status_code = 503
+        res.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        error_messages = f"[{handler_name}] - Upstream unavailable: {e}"
     except ValueError as e:
         res.statuscode = 503
         error_messages = f"[{handler_name}] - Error in tool call extraction: {e}"
@@ -132,17 +199,20 @@ async def function_calling(req: ChatMessage, res: Response):
     return final_response
 
 
-@app.post("/guardrails")
+@app.post("/guardrails", response_model=GuardResponse)
 async def guardrails(req: GuardRequest, res: Response, max_num_words=300):
     logger.info("[Endpoint: /guardrails] - Gateway")
-    logger.info(f"[request body]: {json.dumps(req.model_dump(exclude_none=True))}")
+    logger.info(f"[request body]: {req.model_dump_json(exclude_none=True)}")
 
     final_response: GuardResponse = None
     error_messages = None
 
     try:
         guard_start_time = time.perf_counter()
-        final_response = handler_map["Arch-Guard"].predict(req)
+        if guard_pool is not None:
+            final_response = await guard_pool.predict(req)
+        else:
+            final_response = handler_map["Arch-Guard"].predict(req)
         guard_latency = time.perf_counter() - guard_start_time
         final_response.metadata = {
             "guard_latency": round(guard_latency * 1000, 3),
@@ -155,4 +225,70 @@ async def guardrails(req: GuardRequest, res: Response, max_num_words=300):
         logger.error(error_messages)
         final_response = GuardResponse(metadata={"error": error_messages})
 
-    return final_response
+    return json_response(final_response, res)
+
+
+@app.post("/guardrails/batch", response_model=GuardBatchResponse)
+async def guardrails_batch(req: GuardBatchRequest, res: Response):
+    logger.info("[Endpoint: /guardrails/batch]")
+    logger.info(f"[request body]: {len(req.inputs)} inputs, tasks: {req.tasks}")
+
+    final_response: GuardBatchResponse = None
+    error_messages = None
+
+    try:
+        guard_start_time = time.perf_counter()
+        if guard_pool is not None:
+            final_response = await guard_pool.predict_batch(req)
+        else:
+            final_response = handler_map["Arch-Guard"].predict_batch(req)
+        guard_latency = time.perf_counter() - guard_start_time
+        final_response.metadata = {
+            "guard_latency": round(guard_latency * 1000, 3),
+        }
+    except Exception as e:
+        res.status_code = 500
+        error_messages = f"[Arch-Guard]: {e}"
+
+    if error_messages is not None:
+        logger.error(error_messages)
+        final_response = GuardBatchResponse(metadata={"error": error_messages})
+
+    return json_response(final_response, res)
+
+
+def _guard_session_call(res: Response, func, *args) -> Response:
+    try:
+        return json_response(func(*args), res)
+    except KeyError as e:
+        res.status_code = 404
+        error_messages = f"[Arch-Guard]: {e}"
+    except Exception as e:
+        res.status_code = 500
+        error_messages = f"[Arch-Guard]: {e}"
+
+    logger.error(error_messages)
+    return json_response(GuardSessionResponse(metadata={"error": error_messages}), res)
+
+
+@app.post("/guardrails/sessions", response_model=GuardSessionResponse)
+async def open_guard_session(req: GuardSessionRequest, res: Response):
+    logger.info(f"[Endpoint: /guardrails/sessions] - open, tasks: {req.tasks}")
+
+    return _guard_session_call(res, handler_map["Arch-Guard"].open_session, req.tasks)
+
+
+@app.post("/guardrails/sessions/{session_id}", response_model=GuardSessionResponse)
+async def append_guard_session(
+    session_id: str, req: GuardSessionAppendRequest, res: Response
+):
+    return _guard_session_call(
+        res, handler_map["Arch-Guard"].append_session, session_id, req.text
+    )
+
+
+@app.delete("/guardrails/sessions/{session_id}", response_model=GuardSessionResponse)
+async def close_guard_session(session_id: str, res: Response):
+    logger.info(f"[Endpoint: /guardrails/sessions] - close {session_id}")
+
+    return _guard_session_call(res, handler_map["Arch-Guard"].close_session, session_id)
@@ -0,0 +1,59 @@
+import socket
+import argparse
+import uvicorn
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """
+    Binds the socket the model server listens on.
+
+    The socket is bound with `SO_REUSEPORT` where supported, so that a restarted server can
+    bind the same port while the previous one is still serving, see `src.cli.restart_server`.
+
+    Args:
+        host (str): The host to bind.
+        port (int): The port to bind.
+
+    Returns:
+        socket.socket: The bound socket, which is not listening yet.
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def run_server(host: str = "0.0.0.0", port: int = 51000, drain_timeout: float = 30):
+    """
+    Runs the model server until it receives SIGTERM or SIGINT.
+
+    The socket only starts listening once the app has started, so no connection waits on a
+    server that is still loading models or warming up. On SIGTERM, the server stops accepting
+    connections and lets in-flight requests finish for up to `drain_timeout` seconds.
+
+    Args:
+        host (str, optional): The host to bind. Defaults to "0.0.0.0".
+        port (int, optional): The port to bind. Defaults to 51000.
+        drain_timeout (float, optional): The seconds in-flight requests are given to finish on shutdown. Defaults to 30.
+    """
+
+    config = uvicorn.Config(
+        "src.main:app", host=host, port=port, timeout_graceful_shutdown=drain_timeout
+    )
+    uvicorn.Server(config).run(sockets=[bind_socket(host, port)])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the model server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=51000)
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_server(args.host, args.port, args.drain_timeout)
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+
+from src.commons.admission import AdmissionController, QueueFullError
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_and_priorities():
+    controller = AdmissionController(1, max_queue_size=1)
+    admitted = []
+
+    async def request(name, priority):
+        await controller.acquire(priority)
+        admitted.append(name)
+
+    await controller.acquire("normal")
+
+    low = asyncio.create_task(request("low", "low"))
+    high = asyncio.create_task(request("high", "high"))
+    await asyncio.sleep(0)
+
+    # the low priority lane is full
+    with pytest.raises(QueueFullError) as e:
+        await controller.acquire("low")
+    assert e.value.retry_after >= 1
+
+    controller.release(0.1)
+    await high
+    assert admitted == ["high"]
+
+    controller.release(0.1)
+    await low
+    assert admitted == ["high", "low"]
+
+    controller.release(0.1)
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    controller = AdmissionController(1)
+    await controller.acquire("normal")
+
+    waiter = asyncio.create_task(controller.acquire("normal"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    controller.release()
+    assert controller.in_flight == 0
+    assert len(controller.lanes["normal"]) == 0
+
+
+def test_adaptive_limit():
+    controller = AdmissionController(
+        8, adaptive=True, target_latency=1.0, decrease_factor=0.5
+    )
+    controller.in_flight = 2
+
+    controller.release(5.0)
+    assert int(controller.limit) == 4
+
+    # decreases are spaced out by the target latency
+    controller.release(5.0)
+    assert int(controller.limit) == 4
+
+    # additive increase by 1 / limit per request within the target latency
+    for _ in range(40):
+        controller.in_flight += 1
+        controller.release(0.1)
+    assert int(controller.limit) == 8
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+
+from src.commons.coalescing import COALESCING_FOLLOWERS, SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_are_coalesced():
+    single_flight = SingleFlight("test-coalesced")
+    calls = 0
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"content": "hello"}
+
+    results = await asyncio.gather(
+        *[single_flight.do("same", generate) for _ in range(5)],
+        single_flight.do("other", generate),
+    )
+
+    assert calls == 2
+    assert all(result == {"content": "hello"} for result in results)
+    # followers receive copies, so callers can mutate their results independently
+    assert len({id(result) for result in results}) == 6
+    assert COALESCING_FOLLOWERS.get(name="test-coalesced") == 4
+
+    # once the leader finished, the next request generates again
+    await single_flight.do("same", generate)
+    assert calls == 3
+
+
+@pytest.mark.asyncio
+async def test_leader_error_is_shared():
+    single_flight = SingleFlight("test-error")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream error")
+
+    results = await asyncio.gather(
+        single_flight.do("same", fail),
+        single_flight.do("same", fail),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_leader_disconnect_does_not_cancel_followers():
+    single_flight = SingleFlight("test-disconnect")
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def generate():
+        started.set()
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return {"content": "hello"}
+
+    leader = asyncio.create_task(single_flight.do("same", generate))
+    await started.wait()
+    follower = asyncio.create_task(single_flight.do("same", generate))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    assert await follower == {"content": "hello"}
+    assert leader.cancelled()
+    assert not cancelled.is_set()
+
+    # the call is cancelled once no request waits on it anymore
+    started.clear()
+    leader = asyncio.create_task(single_flight.do("same", generate))
+    await started.wait()
+    leader.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
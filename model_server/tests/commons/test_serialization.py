@@ -0,0 +1,52 @@
+import json
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+from src.commons.serialization import json_response
+from src.core.utils.model_utils import (
+    ChatCompletionResponse,
+    Choice,
+    GuardResponse,
+    Message,
+)
+
+
+def test_json_response_matches_default_encoding():
+    tool_calls = [
+        {
+            "id": "call_1",
+            "type": "function",
+            "function": {"name": "f", "arguments": {"a": 1}},
+        }
+    ]
+    response = ChatCompletionResponse.model_construct(
+        choices=[
+            Choice.model_construct(
+                message=Message.model_construct(content="", tool_calls=tool_calls)
+            )
+        ],
+        model="Arch-Function",
+        metadata={"x-arch-fc-model-response": '```json\n{"é": 1}\n```'},
+    )
+
+    assert json.loads(json_response(response).body) == response.model_dump(mode="json")
+
+
+def test_json_response_keeps_status_and_headers():
+    app = FastAPI()
+
+    @app.post("/guardrails")
+    async def guardrails(res: Response):
+        res.status_code = 503
+        res.headers["Retry-After"] = "3"
+        response = GuardResponse.model_construct(task="jailbreak", prob=0.5)
+        # the latency is a number, although metadata is declared with string values
+        response.metadata = {"guard_latency": 1.5}
+        return json_response(response, res)
+
+    response = TestClient(app).post("/guardrails")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert response.json()["metadata"] == {"guard_latency": 1.5}
+    assert response.json()["task"] == "jailbreak"
@@ -0,0 +1,54 @@
+import json
+
+from src.core.utils.compaction_utils import compact_tool_response, truncate_text
+
+
+WEATHER_RESPONSE = json.dumps(
+    {
+        "location": "Chicago, Illinois",
+        "temperature": [
+            {
+                "date": f"2025-04-{day}",
+                "temperature": {"min": 53, "max": 65},
+                "units": "Farenheit",
+                "query_time": "2025-04-14 17:01:52.432817+00:00",
+            }
+            for day in range(10, 30)
+        ],
+        "units": "Farenheit",
+    }
+)
+
+
+def test_small_responses_are_kept():
+    assert compact_tool_response(WEATHER_RESPONSE, 10_000) == WEATHER_RESPONSE
+
+
+def test_compaction_keeps_the_response_shape():
+    compacted = compact_tool_response(WEATHER_RESPONSE, 600)
+    assert len(compacted.encode("utf-8")) <= 600
+
+    # verbose keys are dropped and arrays keep their first items
+    result = json.loads(compacted)
+    assert result["location"] == "Chicago, Illinois"
+    assert result["temperature"][0] == {
+        "date": "2025-04-10",
+        "temperature": {"min": 53, "max": 65},
+        "units": "Farenheit",
+    }
+    assert result["temperature"][-1] == "... 17 more items"
+
+    result = json.loads(compact_tool_response(WEATHER_RESPONSE, 200))
+    assert result["temperature"][-1] == "... 19 more items"
+
+
+def test_text_responses_are_truncated():
+    text = "a" * 1000
+    compacted = compact_tool_response(text, 100)
+    assert len(compacted) <= 100
+    assert compacted.endswith("[truncated 1000 bytes]")
+
+    # multi-byte characters are not split
+    truncated = truncate_text("é" * 100, 50)
+    assert len(truncated.encode("utf-8")) <= 50
+    assert truncated == "é" * 12 + "... [truncated 200 bytes]"
@@ -1,6 +1,18 @@
+import json
+import asyncio
+import httpx
 import pytest
 import time
+from openai import BadRequestError
+from types import SimpleNamespace
 from src.commons.globals import handler_map
+from src.core.function_calling import (
+    CASCADE_ESCALATIONS,
+    ArchAgentConfig,
+    ArchAgentHandler,
+    ArchFunctionConfig,
+    ArchFunctionHandler,
+)
 from src.core.utils.model_utils import ChatMessage, Message
 
 
@@ -112,4 +124,279 @@ async def test_function_calling(get_data_func):
 
     assert intent == (len(final_response.choices[0].message.tool_calls) >= 1)
 
-    assert hallucination == model_handler.hallucination_state.hallucination
+    assert final_response.metadata["hallucination"] == str(hallucination)
+
+
+def test_canonical_tool_layout():
+    handler = ArchFunctionHandler(None, "Arch-Function", ArchFunctionConfig)
+
+    get_stock_price_api = {
+        "type": "function",
+        "function": {
+            "parameters": {
+                "required": ["ticker"],
+                "type": "object",
+                "properties": {"ticker": {"type": "str", "description": "The ticker"}},
+            },
+            "description": "Get the latest price of a stock.",
+            "name": "get_stock_price",
+        },
+    }
+
+    # the tool block does not depend on the order of tools or keys in the request
+    prompt = handler._format_system_prompt([get_weather_api, get_stock_price_api])
+    assert prompt == handler._format_system_prompt(
+        [get_stock_price_api, get_weather_api]
+    )
+    assert (
+        '<tools>\n{"name": "get_current_weather", "description": "Get current weather at a location.", '
+        '"parameters": {"properties": {"days": ' in prompt
+    )
+    assert prompt.index("get_current_weather") < prompt.index("get_stock_price")
+
+
+def test_agent_routing_stops_at_first_tool_call():
+    tokens = ['tool_calls": [{"name": "weather_agent", ', '"arguments": {}}', ", {"]
+    tokens += ['"name": "other_agent"}]}'] * 100
+    streamed, closed = [], []
+
+    def stream():
+        try:
+            for token in tokens:
+                streamed.append(token)
+                delta = SimpleNamespace(content=token)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+        finally:
+            closed.append(True)
+
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return stream()
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    handler = ArchAgentHandler(client, "Arch-Agent", ArchAgentConfig)
+    response = handler._generate(
+        ChatMessage(metadata={"use_agent_orchestrator": "true"}),
+        [{"role": "user", "content": "weather in seattle"}],
+    )
+
+    assert len(streamed) == 2
+    assert closed == [True]
+    assert requests[0]["extra_body"]["max_tokens"] == ArchAgentConfig.ROUTING_MAX_TOKENS
+    # the response only holds the first tool call of the model
+    assert response.metadata["x-arch-fc-model-response-partial"] == "true"
+    tool_calls = response.choices[0].message.tool_calls
+    assert [tool_call["function"]["name"] for tool_call in tool_calls] == [
+        "weather_agent"
+    ]
+
+
+def test_guided_decoding_falls_back_when_rejected():
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        if "guided_json" in kwargs["extra_body"]:
+            response = httpx.Response(400, request=httpx.Request("POST", "http://test"))
+            raise BadRequestError(
+                "guided_json is not supported", response=response, body=None
+            )
+        delta = SimpleNamespace(content='```json\n{"response": "Hi!"}\n```')
+        return iter(
+            [SimpleNamespace(choices=[SimpleNamespace(delta=delta, logprobs=None)])]
+        )
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    handler = ArchFunctionHandler(
+        client, "Arch-Function", ArchFunctionConfig, guided_decoding=True
+    )
+    messages = [{"role": "user", "content": "hello"}]
+    handler._generate(ChatMessage(tools=[get_weather_api]), messages)
+
+    # the guided request is sent without prefilling, the fallback with it
+    assert requests[0]["messages"] == messages
+    assert requests[0]["extra_body"]["add_generation_prompt"] is True
+    assert "tool_calls" in json.dumps(requests[0]["extra_body"]["guided_json"])
+    assert requests[1]["messages"][-1]["role"] == "assistant"
+    assert "guided_json" not in requests[1]["extra_body"]
+
+    # guided decoding can be turned off per request
+    assert not handler._use_guided_decoding(
+        ChatMessage(metadata={"guided_decoding": "false"})
+    )
+
+
+def test_cascade_escalates_failed_tool_calls():
+    responses = {
+        # the small model misses the required `days` parameter
+        "Arch-Function-Small": '{"tool_calls": [{"name": "get_current_weather", "arguments": {"location": "Seattle, WA"}}]}',
+        "Arch-Function": '{"tool_calls": [{"name": "get_current_weather", "arguments": {"location": "Seattle, WA", "days": "7"}}]}',
+    }
+    models = []
+
+    def create(**kwargs):
+        models.append(kwargs["model"])
+        delta = SimpleNamespace(content=responses[kwargs["model"]])
+        return iter(
+            [SimpleNamespace(choices=[SimpleNamespace(delta=delta, logprobs=None)])]
+        )
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    handler = ArchFunctionHandler(
+        client,
+        "Arch-Function",
+        ArchFunctionConfig,
+        cascade_model_name="Arch-Function-Small",
+    )
+    messages = [{"role": "user", "content": "how is the weather in seattle?"}]
+    response = handler._generate(ChatMessage(tools=[get_weather_api]), messages)
+
+    assert models == ["Arch-Function-Small", "Arch-Function"]
+    assert response.choices[0].message.tool_calls[0]["function"]["arguments"] == {
+        "location": "Seattle, WA",
+        "days": "7",
+    }
+
+    # valid responses of the small model are not escalated
+    models.clear()
+    responses["Arch-Function-Small"] = responses["Arch-Function"]
+    response = handler._generate(ChatMessage(tools=[get_weather_api]), messages)
+
+    assert models == ["Arch-Function-Small"]
+    assert response.choices[0].message.tool_calls
+
+
+def test_cascade_escalates_when_the_small_model_fails():
+    def create_small(**kwargs):
+        raise httpx.ConnectError("connection refused")
+
+    def create(**kwargs):
+        delta = SimpleNamespace(
+            content='{"tool_calls": [{"name": "get_current_weather", "arguments": {"location": "Seattle, WA", "days": "7"}}]}'
+        )
+        return iter(
+            [SimpleNamespace(choices=[SimpleNamespace(delta=delta, logprobs=None)])]
+        )
+
+    handler = ArchFunctionHandler(
+        SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        ),
+        "Arch-Function",
+        ArchFunctionConfig,
+        cascade_model_name="Arch-Function-Small",
+        cascade_client=SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create_small))
+        ),
+    )
+    escalations = CASCADE_ESCALATIONS.get(reason="error")
+    response = handler._generate(
+        ChatMessage(tools=[get_weather_api]),
+        [{"role": "user", "content": "how is the weather in seattle?"}],
+    )
+
+    assert response.choices[0].message.tool_calls[0]["function"]["arguments"] == {
+        "location": "Seattle, WA",
+        "days": "7",
+    }
+    assert CASCADE_ESCALATIONS.get(reason="error") == escalations + 1
+
+
+@pytest.mark.asyncio
+async def test_guided_decoding_schema_only_covers_selected_tools():
+    get_stock_price_api = {
+        "type": "function",
+        "function": {
+            "name": "get_stock_price",
+            "description": "Get the latest price of a stock.",
+            "parameters": {
+                "type": "object",
+                "properties": {"ticker": {"type": "str", "description": "The ticker"}},
+                "required": ["ticker"],
+            },
+        },
+    }
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        delta = SimpleNamespace(content='```json\n{"response": "Hi!"}\n```')
+        return iter(
+            [SimpleNamespace(choices=[SimpleNamespace(delta=delta, logprobs=None)])]
+        )
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    handler = ArchFunctionHandler(
+        client,
+        "Arch-Function",
+        ArchFunctionConfig,
+        guided_decoding=True,
+        tool_top_k=1,
+    )
+    await handler.chat_completion(
+        ChatMessage(
+            messages=[Message(role="user", content="what is the stock price of MSFT?")],
+            tools=[get_weather_api, get_stock_price_api],
+        )
+    )
+
+    guided_json = json.dumps(requests[0]["extra_body"]["guided_json"])
+    assert "get_stock_price" in guided_json
+    assert "get_current_weather" not in guided_json
+
+
+@pytest.mark.asyncio
+async def test_requests_with_different_tool_catalogs_are_not_coalesced():
+    get_stock_price_api = {
+        "type": "function",
+        "function": {
+            "name": "get_stock_price",
+            "description": "Get the latest price of a stock.",
+            "parameters": {
+                "type": "object",
+                "properties": {"ticker": {"type": "str", "description": "The ticker"}},
+            },
+        },
+    }
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        time.sleep(0.05)
+        delta = SimpleNamespace(content='```json\n{"response": "Hi!"}\n```')
+        return iter(
+            [SimpleNamespace(choices=[SimpleNamespace(delta=delta, logprobs=None)])]
+        )
+
+    handler = ArchFunctionHandler(
+        SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        ),
+        "Arch-Function",
+        ArchFunctionConfig,
+        tool_top_k=1,
+    )
+    messages = [Message(role="user", content="how is the weather in seattle?")]
+
+    # both prompts only hold the weather tool
+    await asyncio.gather(
+        handler.chat_completion(
+            ChatMessage(messages=messages, tools=[get_weather_api])
+        ),
+        handler.chat_completion(
+            ChatMessage(messages=messages, tools=[get_weather_api, get_stock_price_api])
+        ),
+    )
+
+    assert len(requests) == 2
+    assert requests[0]["messages"] == requests[1]["messages"]
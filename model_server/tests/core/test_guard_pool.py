@@ -0,0 +1,62 @@
+import os
+import time
+import torch
+import asyncio
+import pytest
+
+from src.core.guard_pool import GuardProcessPool
+
+
+class FakeHandler:
+    def __init__(self):
+        self.classifiers = {"fake": {"model": torch.nn.Linear(4, 2)}}
+
+    def predict(self, req):
+        if req == "error":
+            raise NotImplementedError(f"{req} is not supported!")
+        return os.getpid(), torch.get_num_threads()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_guard_pool_dispatches_to_replicas():
+    handler = FakeHandler()
+    pool = GuardProcessPool(handler, 2, threads_per_replica=1)
+
+    try:
+        # the weights are shared with the replicas instead of copied
+        assert handler.classifiers["fake"]["model"].weight.is_shared()
+
+        # requests in flight are spread over the replicas
+        futures = [pool.submit("predict", "hello") for _ in range(4)]
+        assert pool.outstanding == [2, 2]
+
+        results = await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+        assert {pid for pid, _ in results} == {p.pid for p in pool._processes}
+        assert {num_threads for _, num_threads in results} == {1}
+        assert pool.outstanding == [0, 0]
+
+        with pytest.raises(NotImplementedError):
+            await pool.predict("error")
+    finally:
+        pool.close()
+
+
+@pytest.mark.asyncio
+async def test_guard_pool_skips_dead_replicas():
+    pool = GuardProcessPool(FakeHandler(), 2, threads_per_replica=1)
+
+    try:
+        # a request in flight on a replica that dies is failed
+        future = pool.submit("sleep", 5)
+        pool._processes[0].kill()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(asyncio.wrap_future(future), timeout=3)
+
+        # new requests only go to the live replica
+        results = await asyncio.gather(*[pool.predict("hello") for _ in range(3)])
+        assert {pid for pid, _ in results} == {pool._processes[1].pid}
+    finally:
+        pool.close()
@@ -0,0 +1,52 @@
+from src.core.utils.guided_decoding_utils import get_response_schema
+
+
+get_weather_api = {
+    "type": "function",
+    "function": {
+        "name": "get_current_weather",
+        "description": "Get current weather at a location.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "location": {"type": "str", "description": "The location"},
+                "days": {"type": "int", "description": "The number of days"},
+                "units": {"type": "str", "enum": ["celsius", "fahrenheit"]},
+                "extra": {"type": "custom"},
+            },
+            "required": ["location", "days"],
+        },
+    },
+}
+
+
+def test_response_schema_admits_the_three_formats():
+    response, clarification, tool_calls = get_response_schema([get_weather_api])[
+        "anyOf"
+    ]
+
+    assert response["required"] == ["response"]
+    assert clarification["properties"]["required_functions"]["items"] == {
+        "enum": ["get_current_weather"]
+    }
+    assert tool_calls["required"] == ["tool_calls"]
+
+
+def test_tool_call_schema_only_admits_declared_parameters():
+    tool_calls = get_response_schema([get_weather_api])["anyOf"][2]
+    (call,) = tool_calls["properties"]["tool_calls"]["items"]["anyOf"]
+
+    assert call["properties"]["name"] == {"const": "get_current_weather"}
+    arguments = call["properties"]["arguments"]
+    assert arguments["additionalProperties"] is False
+    assert arguments["required"] == ["location", "days"]
+    assert arguments["properties"] == {
+        "location": {"type": "string"},
+        "days": {"type": "integer"},
+        "units": {"type": "string", "enum": ["celsius", "fahrenheit"]},
+        "extra": {},
+    }
+
+
+def test_response_schema_without_tools():
+    assert len(get_response_schema([])["anyOf"]) == 1
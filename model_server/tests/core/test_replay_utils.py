@@ -0,0 +1,150 @@
+import json
+import pytest
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from src.core.utils.hallucination_utils import HallucinationState
+from src.core.utils.replay_utils import RecordingClient, ReplayClient
+
+
+tokens = ["```", "json", '\n{"', "response", '":', ' "', "Hi", '"}', "\n```"]
+tools = [
+    {
+        "type": "function",
+        "function": {"name": "get_weather", "parameters": {"properties": {}}},
+    }
+]
+
+
+def make_chunk(token):
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": "test",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "Arch-Function",
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": token},
+                    "logprobs": {
+                        "content": [
+                            {
+                                "token": token,
+                                "logprob": -0.1,
+                                "top_logprobs": [
+                                    {"token": token, "logprob": -0.1},
+                                    {"token": "x", "logprob": -2.5},
+                                ],
+                            }
+                        ]
+                    },
+                }
+            ],
+        }
+    )
+
+
+class FakeCompletions:
+    def create(self, **kwargs):
+        if kwargs.get("stream"):
+            return iter([make_chunk(token) for token in tokens])
+
+        return ChatCompletion.model_validate(
+            {
+                "id": "test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": kwargs["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "clarify"},
+                    }
+                ],
+            }
+        )
+
+
+class FakeChat:
+    completions = FakeCompletions()
+
+
+class FakeClient:
+    chat = FakeChat()
+
+
+def test_record_and_replay(tmp_path):
+    record_path = str(tmp_path / "recording.jsonl")
+    request = {
+        "messages": [{"role": "user", "content": "Hello!"}],
+        "model": "Arch-Function",
+        "extra_body": {"top_logprobs": 2},
+    }
+
+    recorder = RecordingClient(FakeClient(), record_path)
+    recorded = [
+        chunk.choices[0].delta.content
+        for chunk in recorder.chat.completions.create(stream=True, **request)
+    ]
+    recorder.chat.completions.create(stream=False, **request)
+
+    with open(record_path) as f:
+        records = [json.loads(line) for line in f]
+
+    assert recorded == tokens
+    assert [record["stream"] for record in records] == [True, False]
+    assert [chunk[1] for chunk in records[0]["chunks"]] == tokens
+    assert records[0]["chunks"][0][2] == [-0.1, -2.5]
+
+    replayer = ReplayClient(record_path, speed=0)
+    state = HallucinationState(
+        response_iterator=replayer.chat.completions.create(stream=True, **request),
+        function=tools,
+    )
+    for _ in state:
+        pass
+
+    assert "".join(state.tokens) == "".join(tokens)
+    assert state.logprobs[0] == pytest.approx([-0.1, -2.5])
+
+    response = replayer.chat.completions.create(stream=False, **request)
+    assert response.choices[0].message.content == "clarify"
+
+
+def test_replay_unknown_request_falls_back_to_recording_order(tmp_path):
+    record_path = str(tmp_path / "recording.jsonl")
+
+    recorder = RecordingClient(FakeClient(), record_path)
+    for _ in recorder.chat.completions.create(
+        stream=True, model="Arch-Function", messages=[]
+    ):
+        break
+
+    replayer = ReplayClient(record_path, speed=0)
+    chunks = list(
+        replayer.chat.completions.create(
+            stream=True, model="Arch-Function", messages=[{"role": "user"}]
+        )
+    )
+
+    # the consumer stopped after the first chunk, so only that chunk was recorded
+    assert [chunk.choices[0].delta.content for chunk in chunks] == tokens[:1]
+
+
+def test_recording_clients_share_the_record_file(tmp_path):
+    record_path = str(tmp_path / "recording.jsonl")
+
+    # e.g., the main and the cascade model each have their own upstream
+    for model in ("Arch-Function", "Arch-Function-Small"):
+        RecordingClient(FakeClient(), record_path).chat.completions.create(
+            stream=False, model=model, messages=[]
+        )
+
+    with open(record_path) as f:
+        records = [json.loads(line) for line in f]
+
+    assert [record["model"] for record in records] == [
+        "Arch-Function",
+        "Arch-Function-Small",
+    ]
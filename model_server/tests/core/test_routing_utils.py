@@ -0,0 +1,41 @@
+import json
+import pytest
+
+from src.core.utils.routing_utils import get_routing_decision
+
+
+TOOL_CALL = (
+    '{"name": "weather_agent", "arguments": {"query": "rain in {city}?", "days": 5}}'
+)
+
+
+@pytest.mark.parametrize("prefix", ['```json\n{"', ""])
+def test_tool_call_decided_when_first_call_is_complete(prefix):
+    response = prefix + f'tool_calls": [{TOOL_CALL}, {{"name": "other"}}]}}\n```'
+
+    # no decision until the arguments object of the first call is closed
+    for end in range(len(prefix) + len(TOOL_CALL) + 14):
+        assert get_routing_decision(response[:end]) is None
+
+    branch, tool_call = get_routing_decision(
+        response[: len(prefix) + len(TOOL_CALL) + 15]
+    )
+    assert branch == "tool_calls"
+    assert json.loads(tool_call)["arguments"]["query"] == "rain in {city}?"
+
+
+@pytest.mark.parametrize(
+    "response, branch",
+    [
+        ('```json\n{"response": "Hel', "response"),
+        ('required_functions": ["weather', "required_functions"),
+        ('tool_calls": []', "tool_calls"),
+    ],
+)
+def test_other_branches_decided_from_the_first_key(response, branch):
+    assert get_routing_decision(response) == (branch, None)
+
+
+def test_no_decision_before_first_key():
+    assert get_routing_decision('```json\n{"tool_ca') is None
+    assert get_routing_decision('```json\n{"tool_calls": ') is None
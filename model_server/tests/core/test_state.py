@@ -1,5 +1,6 @@
+from unittest.mock import patch
 from src.commons.globals import handler_map
-from src.core.function_calling import ArchFunctionHandler, Message
+from src.core.function_calling import ArchFunctionConfig, ArchFunctionHandler, Message
 
 
 test_input_history = [
@@ -34,3 +35,91 @@ def test_update_fc_history():
     assert len(updated_history) == 5
     # ensure that tool role does not exist anymore
     assert all([h["role"] != "tool" for h in updated_history])
+
+
+def test_tool_response_compaction():
+    message_history = [Message(**h) for h in test_input_history]
+
+    handler: ArchFunctionHandler = handler_map["Arch-Function"]
+    full_history = handler._process_messages(message_history)
+    compacted_history = handler._process_messages(
+        message_history, max_tool_response_bytes=300
+    )
+
+    # only the tool response is compacted, and it keeps the tool name
+    assert len(compacted_history[2]["content"]) < len(full_history[2]["content"])
+    assert '"name": "get_current_weather"' in compacted_history[2]["content"]
+    assert [h["content"] for i, h in enumerate(compacted_history) if i != 2] == [
+        h["content"] for i, h in enumerate(full_history) if i != 2
+    ]
+
+
+def test_incremental_message_processing():
+    message_history = [Message(**h) for h in test_input_history]
+
+    handler = ArchFunctionHandler(None, "Arch-Function", ArchFunctionConfig)
+    full_history = handler._process_messages(message_history)
+
+    next_turn = message_history + [
+        Message(role="assistant", content='{"response": "It is sunny."}'),
+        Message(role="user", content="and in boston?"),
+    ]
+    with patch.object(
+        handler, "_process_message", wraps=handler._process_message
+    ) as process_message:
+        next_history = handler._process_messages(next_turn)
+
+    # only the two appended messages are processed, the rest comes from the cache
+    assert [call.args[1] for call in process_message.call_args_list] == [5, 6]
+    assert next_history[:5] == full_history
+    assert next_history[-1] == {"role": "user", "content": "and in boston?"}
+
+    # a cached prefix is not shared with the messages returned to a request
+    handler._process_messages(message_history, extra_instruction="be brief")
+    assert handler._process_messages(message_history) == full_history
+
+
+def test_follow_up_turn_only_hashes_appended_messages():
+    message_history = [Message(**h) for h in test_input_history]
+
+    handler = ArchFunctionHandler(None, "Arch-Function", ArchFunctionConfig)
+    handler._process_messages(message_history, max_tokens=64)
+
+    next_turn = message_history + [
+        Message(role="assistant", content='{"response": "It is sunny."}'),
+        Message(role="user", content="and in boston?"),
+    ]
+    with patch.object(
+        handler, "_get_message_digest", wraps=handler._get_message_digest
+    ) as get_message_digest:
+        next_history = handler._process_messages(next_turn, max_tokens=64)
+
+    # the appended messages and the last message of the cached prefix
+    assert get_message_digest.call_count == 3
+
+    # the cut of a repeated request comes from the cache
+    with patch.object(
+        handler, "_get_truncation_idx", wraps=handler._get_truncation_idx
+    ) as get_truncation_idx:
+        assert handler._process_messages(next_turn, max_tokens=64) == next_history
+    assert get_truncation_idx.call_count == 0
+    assert len(next_history) < len(next_turn)
+
+
+def test_invalid_tool_response_budget_falls_back_to_default():
+    message_history = [Message(**h) for h in test_input_history]
+
+    handler = ArchFunctionHandler(None, "Arch-Function", ArchFunctionConfig)
+    compacted_history = handler._process_messages(
+        message_history, max_tool_response_bytes=300
+    )
+
+    for budget in ("lots", None):
+        assert (
+            handler._process_messages(
+                message_history,
+                metadata={"max_tool_response_bytes": budget},
+                max_tool_response_bytes=300,
+            )
+            == compacted_history
+        )
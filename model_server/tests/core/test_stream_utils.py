@@ -0,0 +1,115 @@
+import json
+import pytest
+
+from openai import OpenAI
+from types import SimpleNamespace
+from src.core.utils.hallucination_utils import HallucinationState
+from src.core.utils.stream_utils import RawStreamClient, parse_sse_lines
+
+
+tokens = ['{"', "tool_calls", '":', ' [{"', "name", '":', ' "', "get_weather", '",']
+tools = [
+    {
+        "type": "function",
+        "function": {"name": "get_weather", "parameters": {"properties": {}}},
+    }
+]
+
+
+def make_event(token, logprobs=(-0.1, -2.5)):
+    chunk = {
+        "id": "test",
+        "object": "chat.completion.chunk",
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"content": token},
+                "logprobs": {
+                    "content": [
+                        {
+                            "token": token,
+                            "logprob": logprobs[0],
+                            "top_logprobs": [
+                                {"token": token, "logprob": logprob}
+                                for logprob in logprobs
+                            ],
+                        }
+                    ]
+                },
+            }
+        ],
+    }
+    return f"data: {json.dumps(chunk)}"
+
+
+def test_parse_sse_lines():
+    lines = [make_event(token) for token in tokens]
+    lines += [": keep-alive", make_event(""), "data: [DONE]", make_event("late")]
+
+    assert list(parse_sse_lines(lines)) == [(token, [-0.1, -2.5]) for token in tokens]
+
+
+def test_raw_stream_client(httpserver):
+    body = "\n\n".join(make_event(token) for token in tokens) + "\n\ndata: [DONE]\n\n"
+    httpserver.expect_request("/v1/chat/completions").respond_with_data(
+        body, content_type="text/event-stream"
+    )
+
+    client = RawStreamClient(OpenAI(base_url=httpserver.url_for("/v1"), api_key="-"))
+    response = client.chat.completions.create(
+        messages=[{"role": "user", "content": "hi"}],
+        model="Arch-Function",
+        stream=True,
+    )
+
+    # the hallucination state reads the flat tokens like OpenAI chunks
+    state = HallucinationState(response_iterator=response, function=tools)
+    list(state)
+
+    assert state.tokens == tokens
+    assert state.logprobs == [pytest.approx([-0.1, -2.5])] * len(tokens)
+    assert state.function_name == "get_weather"
+    assert json.loads(httpserver.log[0][0].data)["stream"] is True
+
+
+def test_parse_sse_lines_raises_stream_errors():
+    with pytest.raises(Exception, match="overloaded"):
+        list(parse_sse_lines(['data: {"error": {"message": "overloaded"}}']))
+
+
+class FakeStreamingResponse:
+    def __init__(self):
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def iter_lines(self):
+        return iter([make_event(token) for token in tokens])
+
+    def close(self):
+        self.closed = True
+
+
+def test_raw_stream_client_closes_unread_response():
+    responses = []
+
+    def create(**kwargs):
+        responses.append(FakeStreamingResponse())
+        return responses[-1]
+
+    client = RawStreamClient(
+        SimpleNamespace(
+            chat=SimpleNamespace(
+                completions=SimpleNamespace(
+                    with_streaming_response=SimpleNamespace(create=create)
+                )
+            )
+        )
+    )
+
+    # the stream is closed, or dropped, before it is read
+    client.chat.completions.create(stream=True).close()
+    client.chat.completions.create(stream=True)
+
+    assert [response.closed for response in responses] == [True, True]
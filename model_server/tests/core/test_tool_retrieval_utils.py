@@ -0,0 +1,107 @@
+from src.core.utils.model_utils import Message
+from src.core.utils.tool_retrieval_utils import (
+    BM25ToolIndex,
+    ToolSelector,
+    get_called_tool_names,
+    tokenize,
+)
+
+
+def make_tool(name, description, **parameters):
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    key: {"type": "str", "description": value}
+                    for key, value in parameters.items()
+                },
+            },
+        },
+    }
+
+
+TOOLS = [
+    make_tool(
+        "get_current_weather",
+        "Get current weather at a location.",
+        location="City, State",
+    ),
+    make_tool(
+        "currency_exchange",
+        "Get the exchange rate of a currency.",
+        currency_symbol="The symbol",
+    ),
+    make_tool(
+        "get_stock_price", "Get the latest price of a stock.", ticker="Stock ticker"
+    ),
+    make_tool(
+        "reboot_network_device", "Reboot a switch or router.", device_id="The device"
+    ),
+]
+
+
+def test_tokenize():
+    assert tokenize("get_current_weather getStockPrice") == [
+        "current",
+        "weather",
+        "stock",
+        "price",
+    ]
+
+
+def test_bm25_tool_index():
+    index = BM25ToolIndex(TOOLS)
+
+    assert index.search("what is the weather in Seattle?", 1) == [0]
+    assert index.search("exchange rate for NZD", 1) == [1]
+    assert index.search("please reboot the router", 2)[0] == 3
+
+
+def test_tool_selector():
+    selector = ToolSelector(top_k=1, query_turns=1)
+
+    messages = [Message(role="user", content="what is the price of the AAPL stock?")]
+    assert selector.select(messages, TOOLS) == [TOOLS[2]]
+
+    # tools called earlier in the conversation are kept for follow-up turns
+    messages += [
+        Message(
+            role="assistant",
+            content='```json\n{"tool_calls": [{"name": "get_stock_price", "arguments": {"ticker": "AAPL"}}]}\n```',
+        ),
+        Message(role="tool", content="$196.66"),
+        Message(role="user", content="and the weather in Seattle?"),
+    ]
+    assert selector.select(messages, TOOLS) == [TOOLS[0], TOOLS[2]]
+
+    # small catalogs are passed through
+    assert ToolSelector(top_k=10).select(messages, TOOLS) == TOOLS
+
+
+def test_get_called_tool_names():
+    messages = [
+        Message(
+            role="assistant",
+            tool_calls=[{"function": {"name": "get_current_weather", "arguments": {}}}],
+        ),
+        Message(
+            role="assistant",
+            content='```json\n{"tool_calls": [{"name": "get_stock_price", "arguments": {}}]}\n```',
+        ),
+        # tool names merely mentioned, or substrings of a called tool, are not calls
+        Message(role="assistant", content="I can call currency_exchange for you."),
+        Message(
+            role="tool", content='{"tool_calls": [{"name": "reboot_network_device"}]}'
+        ),
+    ]
+
+    assert get_called_tool_names(messages) == {"get_current_weather", "get_stock_price"}
+
+    stock_price = make_tool("stock_price", "Get a price.", item="The item")
+    selector = ToolSelector(top_k=1, query_turns=1)
+    query = [Message(role="user", content="reboot the router")]
+    assert stock_price not in selector.select(messages + query, TOOLS + [stock_price])
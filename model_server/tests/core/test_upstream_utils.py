@@ -0,0 +1,203 @@
+import time
+import httpx
+import pytest
+
+from openai import APIConnectionError
+from types import SimpleNamespace
+from src.core.utils.upstream_utils import (
+    UPSTREAM_REQUESTS,
+    AdaptiveTimeout,
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientClient,
+    UpstreamPool,
+    parse_endpoints,
+)
+
+
+class FakeClient:
+    def __init__(self, chunks=None, error=None):
+        self.calls = 0
+        self.chunks = chunks or ["a", "b"]
+        self.error = error
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        self.last_kwargs = kwargs
+        if self.error is not None:
+            raise self.error
+        if kwargs.get("stream"):
+            return iter(self.chunks)
+        return "".join(self.chunks)
+
+
+def make_pool(endpoints, clients, **kwargs):
+    pool = UpstreamPool(endpoints, "EMPTY", health_check_interval=0, **kwargs)
+    for endpoint, client in zip(pool.endpoints, clients):
+        endpoint.client = client
+    return pool
+
+
+def test_parse_endpoints():
+    assert parse_endpoints("http://a:8000/v1|2, http://b:8000/v1") == [
+        ("http://a:8000/v1", 2.0),
+        ("http://b:8000/v1", 1.0),
+    ]
+    assert parse_endpoints("") == []
+
+    with pytest.raises(ValueError):
+        parse_endpoints("http://a:8000/v1|0")
+
+
+def test_least_outstanding_requests_with_weights():
+    clients = [FakeClient(), FakeClient()]
+    pool = make_pool([("http://a/v1", 2.0), ("http://b/v1", 1.0)], clients)
+
+    # keep the streams open so that the requests stay outstanding
+    streams = [pool.chat.completions.create(stream=True) for _ in range(3)]
+
+    assert [endpoint.outstanding for endpoint in pool.endpoints] == [2, 1]
+
+    for stream in streams:
+        assert list(stream) == ["a", "b"]
+
+    assert [endpoint.outstanding for endpoint in pool.endpoints] == [0, 0]
+
+
+def test_closing_stream_closes_upstream_response():
+    class FakeStream:
+        def __init__(self):
+            self.closed = False
+
+        def __iter__(self):
+            yield from ["a", "b"]
+
+        def close(self):
+            self.closed = True
+
+    stream = FakeStream()
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **_: stream))
+    )
+    pool = make_pool([("http://close-a/v1", 1.0)], [client])
+
+    # the consumer closes the stream without reading it
+    pool.chat.completions.create(stream=True).close()
+
+    assert stream.closed
+    assert pool.endpoints[0].outstanding == 0
+
+
+def test_retry_on_connection_error_before_first_token():
+    request = httpx.Request("POST", "http://a/v1/chat/completions")
+    clients = [FakeClient(error=APIConnectionError(request=request)), FakeClient()]
+    pool = make_pool(
+        [("http://retry-a/v1", 1.0), ("http://retry-b/v1", 1.0)],
+        clients,
+        max_failures=1,
+    )
+
+    assert list(pool.chat.completions.create(stream=True)) == ["a", "b"]
+    assert pool.chat.completions.create(stream=False) == "ab"
+
+    # the failing endpoint is ejected and no longer receives traffic
+    assert pool.endpoints[0].healthy is False
+    assert clients[0].calls == 1
+    assert clients[1].calls == 2
+    assert UPSTREAM_REQUESTS.get(endpoint="http://retry-a/v1", status="retry") == 1
+    assert UPSTREAM_REQUESTS.get(endpoint="http://retry-b/v1", status="success") == 2
+
+
+def test_raise_when_all_endpoints_fail():
+    request = httpx.Request("POST", "http://a/v1/chat/completions")
+    error = APIConnectionError(request=request)
+    pool = make_pool([("http://a/v1", 1.0)], [FakeClient(error=error)])
+
+    with pytest.raises(APIConnectionError):
+        pool.chat.completions.create(stream=True)
+
+    assert pool.endpoints[0].outstanding == 0
+
+
+def test_circuit_breaker_opens_and_recovers():
+    request = httpx.Request("POST", "http://a/v1/chat/completions")
+    client = FakeClient(error=APIConnectionError(request=request))
+    resilient = ResilientClient(
+        client,
+        CircuitBreaker(failure_threshold=2, reset_timeout=0.05),
+        AdaptiveTimeout(),
+    )
+
+    for _ in range(2):
+        with pytest.raises(APIConnectionError):
+            resilient.chat.completions.create(stream=True)
+
+    # the circuit is open, so requests fail fast without reaching the upstream
+    with pytest.raises(CircuitOpenError):
+        resilient.chat.completions.create(stream=True)
+    assert client.calls == 2
+
+    time.sleep(0.05)
+    client.error = None
+    assert list(resilient.chat.completions.create(stream=True)) == ["a", "b"]
+    assert resilient.circuit_breaker.state == "closed"
+
+
+def test_circuit_breaker_settles_abandoned_trial():
+    request = httpx.Request("POST", "http://a/v1/chat/completions")
+    client = FakeClient(error=APIConnectionError(request=request))
+    resilient = ResilientClient(
+        client,
+        CircuitBreaker(failure_threshold=1, reset_timeout=0.05),
+        AdaptiveTimeout(),
+    )
+
+    with pytest.raises(APIConnectionError):
+        resilient.chat.completions.create(stream=True)
+
+    # the trial stream is closed without being read, so the next call becomes the trial
+    time.sleep(0.05)
+    client.error = None
+    resilient.chat.completions.create(stream=True).close()
+    assert resilient.circuit_breaker.state == "open"
+
+    assert list(resilient.chat.completions.create(stream=True)) == ["a", "b"]
+    assert resilient.circuit_breaker.state == "closed"
+
+
+def test_circuit_breaker_reopens_after_trial_timeout():
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout=0.05, trial_timeout=0.05
+    )
+    circuit_breaker.record_failure(Exception("down"))
+
+    time.sleep(0.05)
+    circuit_breaker.before_call()
+    assert circuit_breaker.state == "half_open"
+
+    # the trial never reports back, so the circuit re-opens at its deadline
+    time.sleep(0.05)
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_call()
+    assert circuit_breaker.state == "open"
+
+
+def test_adaptive_timeout():
+    adaptive_timeout = AdaptiveTimeout(
+        percentile=0.9, multiplier=2.0, min_timeout=0.5, max_timeout=8.0, min_samples=10
+    )
+    assert adaptive_timeout.get_timeout() == 8.0
+
+    for _ in range(10):
+        adaptive_timeout.observe(0.1)
+    assert adaptive_timeout.get_timeout() == 0.5
+
+    for _ in range(10):
+        adaptive_timeout.observe(1.0)
+    assert adaptive_timeout.get_timeout() == 2.0
+
+    client = FakeClient()
+    resilient = ResilientClient(client, CircuitBreaker(), adaptive_timeout)
+    list(resilient.chat.completions.create(stream=True))
+    assert client.last_kwargs["timeout"].read == 2.0
@@ -0,0 +1,65 @@
+import pytest
+
+from openai import OpenAI
+from src.core.function_calling import ArchFunctionConfig, ArchFunctionHandler
+from src.core.utils.stream_utils import RawStreamClient
+from src.core.utils.upstream_utils import (
+    AdaptiveTimeout,
+    CircuitBreaker,
+    ResilientClient,
+    UpstreamPool,
+)
+from src.core.warmup import get_upstream_clients, warm_up
+
+
+def test_get_upstream_clients():
+    client = OpenAI(base_url="http://localhost:8000/v1", api_key="EMPTY")
+    wrapped = ResilientClient(
+        RawStreamClient(client), CircuitBreaker(), AdaptiveTimeout()
+    )
+    assert get_upstream_clients(wrapped) == [client]
+
+    pool = UpstreamPool(
+        [("http://10.0.0.1:8000/v1", 1.0), ("http://10.0.0.2:8000/v1", 1.0)],
+        "EMPTY",
+        health_check_interval=0,
+        raw_stream=True,
+    )
+    assert [str(c.base_url) for c in get_upstream_clients(pool)] == [
+        "http://10.0.0.1:8000/v1/",
+        "http://10.0.0.2:8000/v1/",
+    ]
+
+    assert get_upstream_clients(None) == []
+
+
+@pytest.mark.asyncio
+async def test_warm_up(httpserver):
+    httpserver.expect_request("/v1/models").respond_with_json(
+        {"object": "list", "data": []}
+    )
+    httpserver.expect_request("/v1/chat/completions").respond_with_data(status=503)
+
+    client = OpenAI(base_url=httpserver.url_for("/v1"), api_key="EMPTY")
+    circuit_breaker, adaptive_timeout = (
+        CircuitBreaker(failure_threshold=1),
+        AdaptiveTimeout(),
+    )
+    handler = ArchFunctionHandler(
+        ResilientClient(client, circuit_breaker, adaptive_timeout),
+        "Arch-Function",
+        ArchFunctionConfig,
+    )
+
+    # the failed function calling probe does not fail the warm-up
+    duration = await warm_up({"Arch-Function": handler}, num_connections=3)
+    assert duration > 0
+
+    paths = [request.path for request, _ in httpserver.log]
+    assert paths == ["/v1/models"] * 3 + ["/v1/chat/completions"]
+    assert "What time is it in UTC?" in httpserver.log[-1][0].get_data(as_text=True)
+
+    # the probe bypasses the proxies and caches of the handler
+    assert circuit_breaker.state == "closed"
+    assert len(adaptive_timeout._samples) == 0
+    assert len(handler.message_cache) == 0